@@ -0,0 +1,608 @@
+#!/usr/bin/python
+"""
+bench_showview.py
+
+benchmarks for showview. Every benchmark runs against synthetic show files
+of the given sizes, the results can be written as json and compared against
+a stored baseline:
+
+    ./bench_showview.py --sizes 100 10000 --json bench.json
+    ./bench_showview.py --sizes 100 10000 --baseline bench.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import string
+import sys
+import tempfile
+import timeit
+import tracemalloc
+from unittest.mock import patch
+import xml.etree.ElementTree as ET
+
+import showview
+from showview import ShowView, indent
+
+WORDS = ['the', 'office', 'house', 'game', 'of', 'thrones', 'breaking',
+         'bad', 'lost', 'friends', 'doctor', 'who', 'star', 'trek', 'next',
+         'generation', 'wire', 'dark', 'mirror', 'black', 'sopranos', 'mad',
+         'men', 'twin', 'peaks', 'west', 'wing', 'fargo', 'true', 'detective']
+# most show names have one to three words
+WORD_COUNTS = [1, 2, 3, 4, 5, 6]
+WORD_WEIGHTS = [30, 30, 20, 10, 6, 4]
+
+PREFIX = 'Prefix Bench '
+MATCHES = 100
+WORKERS = [1, 2, 4, 8]
+INCREMENTS = 20
+IMPORTS = 5000
+EVENTS = 10
+USERS = 16
+
+
+def random_name(rng):
+    """ a show name with a realistic length """
+
+    count = rng.choices(WORD_COUNTS, WORD_WEIGHTS)[0]
+    words = [rng.choice(WORDS).capitalize() for _ in range(count)]
+    suffix = ''.join(rng.choice(string.ascii_lowercase) for _ in range(4))
+    return ' '.join(words) + ' ' + suffix
+
+
+def generate_showfile(path, count, matches=0, seed=0):
+    """
+    write a synthetic show file with count shows, matches of them
+    starting with PREFIX
+    """
+
+    rng = random.Random(seed)
+    names = set('{}{:06}'.format(PREFIX, i) for i in range(matches))
+    while len(names) < count:
+        names.add(random_name(rng))
+
+    with open(path, 'w') as file:
+        file.write('<DocumentElement>\n')
+        for name in sorted(names):
+            file.write('  <Show>\n'
+                       '    <Name>{}</Name>\n'
+                       '    <Season>{}</Season>\n'
+                       '    <Episode>{}</Episode>\n'
+                       '  </Show>\n'.format(name,
+                                            rng.randint(0, 20),
+                                            rng.randint(0, 30)))
+        file.write('</DocumentElement>\n')
+
+
+class Showfiles():
+    """
+    generates every size once in a tempfolder and hands out fresh copies
+    (without snapshot or journal) to the benchmarks
+    """
+
+    def __init__(self, tempfolder):
+        self.tempfolder = tempfolder
+        self.copies = 0
+
+    def master(self, size):
+        """ the generated file for size """
+
+        path = os.path.join(self.tempfolder, 'master{}.xml'.format(size))
+        if not os.path.exists(path):
+            generate_showfile(path, size, min(MATCHES, size))
+        return path
+
+    def copy(self, size):
+        """ a fresh copy of the generated file for size """
+
+        self.copies += 1
+        path = os.path.join(self.tempfolder,
+                            'show{}-{}.xml'.format(size, self.copies))
+        shutil.copy(self.master(size), path)
+        return path
+
+
+def best(func, repeat):
+    """ the best time of repeat runs of func """
+
+    times = []
+    for _ in range(repeat):
+        start = timeit.default_timer()
+        func()
+        times.append(timeit.default_timer() - start)
+    return min(times)
+
+
+def measure(func):
+    """ returns the time and the peak of allocated memory of func() """
+
+    tracemalloc.start()
+    start = timeit.default_timer()
+    func()
+    elapsed = timeit.default_timer() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def result(benchmark, size, seconds, **extra):
+    """ one benchmark result, printed and returned for the json output """
+
+    print("{:<20} {:>8} shows {:12.6f}s".format(benchmark, size, seconds))
+    return dict(extra, benchmark=benchmark, size=size, seconds=seconds)
+
+
+def bench_operations(showfiles, size, repeat):
+    """ time the ShowView API on a file with size shows """
+
+    path = showfiles.copy(size)
+    results = [result('init', size, best(lambda: ShowView(path), repeat))]
+    # only a write that changes something leaves a snapshot
+    view = ShowView(path)
+    show = next(view.get_shows())
+    view.set_show(name=show['name'], episode=show['episode'] + 1)
+    view.write_shows()
+    results.append(result('init_snapshot', size,
+                          best(lambda: ShowView(path), repeat)))
+
+    view = ShowView(path)
+    names = [show['name'] for show in view.get_shows()]
+    name = names[len(names) // 2]
+    results.append(result('get_shows', size,
+                          best(lambda: list(view.get_shows()), repeat)))
+    results.append(result('get_shows_prefix', size,
+                          best(lambda: list(view.get_shows(PREFIX)), repeat)))
+    results.append(result('get_show', size,
+                          best(lambda: view.get_show(name), repeat)))
+
+    counter = iter(range(10 ** 9))
+    results.append(result(
+        'add_show', size,
+        best(lambda: view.add_show(name='Bench {}'.format(next(counter))),
+             repeat)))
+    results.append(result(
+        'set_show', size,
+        best(lambda: view.set_show(name=name, episode=next(counter)),
+             repeat)))
+
+    def write_added():
+        view.add_show(name='Bench {}'.format(next(counter)))
+        view.write_shows()
+
+    def write_patched():
+        episode = view.get_show(name)['episode']
+        view.set_show(name=name, episode=episode % 9 + 1)
+        view.write_shows()
+
+    view.set_show(name=name, episode=1)
+    results.append(result('write_shows', size, best(write_added, repeat)))
+    results.append(result('write_patch', size, best(write_patched, repeat)))
+    results.append(result('write_unchanged', size,
+                          best(view.write_shows, repeat)))
+    return results
+
+
+def run_main(argv):
+    """ run showview.main() with argv and throw the output away """
+
+    sys.argv = ['showview.py'] + argv
+    with contextlib.redirect_stdout(io.StringIO()):
+        showview.main()
+
+
+def bench_main(showfiles, size, repeat):
+    """ time whole commandline calls on a file with size shows """
+
+    path = showfiles.copy(size)
+    name = PREFIX + '000000'
+    argv = sys.argv
+    try:
+        return [
+            result('main_list', size,
+                   best(lambda: run_main(['--showfile', path]), repeat)),
+            result('main_list_jsonl', size,
+                   best(lambda: run_main(['--showfile', path, '--format',
+                                          'jsonl']), repeat)),
+            result('main_list_tsv', size,
+                   best(lambda: run_main(['--showfile', path, '--format',
+                                          'tsv']), repeat)),
+            result('main_list_page', size,
+                   best(lambda: run_main(['--showfile', path, '--format',
+                                          'tsv', '--limit', '20']),
+                        repeat)),
+            result('main_show', size,
+                   best(lambda: run_main(['--showfile', path, name]),
+                        repeat)),
+            result('main_incepisode', size,
+                   best(lambda: run_main(['--showfile', path, name, '-ie']),
+                        repeat)),
+        ]
+    finally:
+        sys.argv = argv
+
+
+def increment(path, name, count):
+    """ a stress worker: increment the episode of name count times """
+
+    for _ in range(count):
+        run_main(['--showfile', path, name, '-ie'])
+
+
+def bench_concurrency(showfiles, size, repeat):
+    """
+    N processes incrementing the same show through the commandline at once,
+    no increment may get lost
+    """
+
+    results = []
+    name = PREFIX + '000000'
+    for workers in WORKERS:
+        path = showfiles.copy(size)
+        before = ShowView(path).get_show(name)['episode']
+        processes = [multiprocessing.Process(target=increment,
+                                             args=(path, name, INCREMENTS))
+                     for _ in range(workers)]
+        start = timeit.default_timer()
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        elapsed = timeit.default_timer() - start
+        after = ShowView(path).get_show(name)['episode']
+        assert after - before == workers * INCREMENTS, (before, after)
+        results.append(result(
+            'concurrent_{}'.format(workers), size, elapsed,
+            writes_per_second=workers * INCREMENTS / elapsed))
+    return results
+
+
+def bench_search(showfiles, size, repeat):
+    """
+    compare search (with the saved trigram index) against filtering every
+    show for the substring, for a rare and a typo query
+    """
+
+    path = showfiles.copy(size)
+    view = ShowView(path)
+    view.write_shows()
+    list(view.search('x'))
+    view = ShowView(path, readonly=True)
+    query = PREFIX.lower() + '00004'
+
+    def scan():
+        return [show for show in view.get_shows()
+                if query in show['name'].lower()]
+
+    return [
+        result('search_scan', size, best(scan, repeat)),
+        result('search_index', size,
+               best(lambda: list(view.search(query)), repeat)),
+        result('search_typo', size,
+               best(lambda: list(view.search('Prefx Bench 000042')),
+                    repeat)),
+        result('search_cold', size,
+               best(lambda: list(ShowView(path, readonly=True).search(
+                   query)), repeat)),
+    ]
+
+
+def bench_shard(showfiles, size, repeat):
+    """
+    time one commandline change on a single showfile against a sharded
+    copy of it (shards of SHARD_SIZE shows)
+    """
+
+    path = showfiles.copy(size)
+    sharded = path + '.shards' + os.sep
+    showview.migrate(path, sharded)
+    name = PREFIX + '000000'
+    argv = sys.argv
+    try:
+        return [
+            result('shard_single', size,
+                   best(lambda: run_main(['--showfile', path, name, '-ie']),
+                        repeat)),
+            result('shard_sharded', size,
+                   best(lambda: run_main(['--showfile', sharded, name,
+                                          '-ie']), repeat)),
+        ]
+    finally:
+        sys.argv = argv
+
+
+def bench_prefix(showfiles, size, repeat):
+    """
+    time get_shows(prefix) and get_show(prefix), the matches are the same
+    for every size so the times should be too
+    """
+
+    view = ShowView(showfiles.master(size))
+    return [
+        result('prefix_get_shows', size,
+               best(lambda: list(view.get_shows(PREFIX)), repeat),
+               matches=min(MATCHES, size)),
+        result('prefix_get_show', size,
+               best(lambda: view.get_show(PREFIX), repeat)),
+    ]
+
+
+def bench_scan(showfiles, size, repeat):
+    """
+    compare reading the shows with the mmap scanner against ET.parse and
+    the parser fallback with every xml backend, time and peak memory
+    """
+
+    view = ShowView(showfiles.master(size), readonly=True)
+    funcs = [('scan_etree', lambda: ET.parse(view.sourcefile)),
+             ('scan_mmap', lambda: list(view._scan_file())),
+             ('scan_fallback_etree', lambda: fallback(view, ET))]
+    lxml = lxml_etree()
+    if lxml is not None:
+        funcs.append(('scan_fallback_lxml', lambda: fallback(view, lxml)))
+    results = []
+    for benchmark, func in funcs:
+        seconds = best(func, repeat)
+        peak = measure(func)[1]
+        results.append(result(benchmark, size, seconds, peak_bytes=peak))
+    return results
+
+
+def lxml_etree():
+    """ lxml.etree if it is installed, else None """
+
+    try:
+        from lxml import etree
+    except ImportError:
+        return None
+    return etree
+
+
+def fallback(view, etree):
+    """ read the shows with the xml parser fallback and etree as backend """
+
+    with patch('showview._etree', return_value=etree):
+        return list(view._iter_file())
+
+
+def write_lxml(view, path):
+    """ build an lxml tree and write it pretty printed by lxml """
+
+    from lxml import etree
+
+    root = etree.Element('DocumentElement')
+    for show in view.get_shows():
+        show_element = etree.SubElement(root, 'Show')
+        etree.SubElement(show_element, 'Name').text = show['name']
+        etree.SubElement(show_element, 'Season').text = str(show['season'])
+        etree.SubElement(show_element,
+                         'Episode').text = str(show['episode'])
+    etree.ElementTree(root).write(path, pretty_print=True)
+
+
+def write_etree(view, path):
+    """ the old save path: build the tree, indent() it and write it """
+
+    root = ET.Element('DocumentElement')
+    for show in view.get_shows():
+        show_element = ET.SubElement(root, 'Show')
+        ET.SubElement(show_element, 'Name').text = show['name']
+        ET.SubElement(show_element, 'Season').text = str(show['season'])
+        ET.SubElement(show_element, 'Episode').text = str(show['episode'])
+    indent(root)
+    ET.ElementTree(root).write(path)
+
+
+def bench_write(showfiles, size, repeat):
+    """
+    compare saving with the streaming writer (write_shows) against the old
+    indent() + ElementTree.write path and lxml's pretty_print (if lxml is
+    installed), time and peak memory
+    """
+
+    path = showfiles.copy(size)
+    view = ShowView(path)
+    old_path = path + '.etree'
+    old_time, old_peak = measure(lambda: write_etree(view, old_path))
+    new_time, new_peak = measure(view.write_shows)
+    with open(path, 'rb') as new, open(old_path, 'rb') as old:
+        assert new.read() == old.read()
+    results = [result('write_etree', size, old_time, peak_bytes=old_peak),
+               result('write_streaming', size, new_time,
+                      peak_bytes=new_peak)]
+    if lxml_etree() is not None:
+        lxml_time, lxml_peak = measure(
+            lambda: write_lxml(view, path + '.lxml'))
+        results.append(result('write_lxml', size, lxml_time,
+                              peak_bytes=lxml_peak))
+    return results
+
+
+def bench_history(showfiles, size, repeat):
+    """
+    time the watch history queries over EVENTS events per show (the
+    numpy path if numpy is installed)
+    """
+
+    rng = random.Random(size)
+    history = showview.WatchHistory(showfiles.copy(size) + '.history')
+    events = [('set', 'show {}'.format(rng.randrange(size)),
+               rng.randrange(10), rng.randrange(30),
+               1700000000 + i * 60) for i in range(size * EVENTS)]
+    history.record(events)
+    return [
+        result('history_per_month', size,
+               best(history.watched_per_month, repeat),
+               events=len(events), numpy=showview._numpy() is not None),
+        result('history_last', size, best(history.last_watched, repeat),
+               events=len(events), numpy=showview._numpy() is not None),
+    ]
+
+
+def bench_import(showfiles, size, repeat):
+    """
+    compare importing IMPORTS shows with an add_show loop against
+    import_shows (one merge and one write)
+    """
+
+    rng = random.Random(size)
+    shows = [{"name": random_name(rng) + ' import', "season": 1,
+              "episode": 1} for _ in range(IMPORTS)]
+
+    def add_loop():
+        view = ShowView(showfiles.copy(size))
+        with view.transaction():
+            for show in shows:
+                view.add_show(name=show['name'], season=show['season'],
+                              episode=show['episode'])
+            view.write_shows()
+
+    def import_shows():
+        ShowView(showfiles.copy(size)).import_shows(shows)
+
+    return [result('import_add_show', size, best(add_loop, repeat),
+                   shows=IMPORTS),
+            result('import_shows', size, best(import_shows, repeat),
+                   shows=IMPORTS)]
+
+
+def bench_refresh(showfiles, size, repeat):
+    """
+    compare refresh after another process changed one show against
+    loading a new ShowView, and refresh of an unchanged file (a stat)
+    """
+
+    path = showfiles.copy(size)
+    view = ShowView(path)
+    other = ShowView(path)
+    name = next(other.get_shows())['name']
+    times = []
+    for episode in range(repeat):
+        other.set_show(name=name, episode=episode + 100)
+        other.write_shows()
+        start = timeit.default_timer()
+        assert view.refresh()['changed'] == [name]
+        times.append(timeit.default_timer() - start)
+    return [result('refresh_unchanged', size, best(view.refresh, repeat)),
+            result('refresh_changed', size, min(times)),
+            result('refresh_reload', size,
+                   best(lambda: ShowView(path), repeat))]
+
+
+def bench_aggregate(showfiles, size, repeat):
+    """
+    aggregate USERS showfiles of size shows with 1, 2, 4 and 8 worker
+    processes
+    """
+
+    paths = [showfiles.copy(size) for _ in range(USERS)]
+    return [result('aggregate_{}'.format(workers), size,
+                   best(lambda: showview.aggregate(paths, workers),
+                        repeat),
+                   files=USERS, workers=workers)
+            for workers in WORKERS]
+
+
+BENCHMARKS = {
+    'aggregate': bench_aggregate,
+    'concurrency': bench_concurrency,
+    'history': bench_history,
+    'import': bench_import,
+    'operations': bench_operations,
+    'main': bench_main,
+    'prefix': bench_prefix,
+    'refresh': bench_refresh,
+    'scan': bench_scan,
+    'search': bench_search,
+    'shard': bench_shard,
+    'write': bench_write,
+}
+
+
+def compare(results, baseline, tolerance):
+    """
+    print how results compare to baseline, returns the regressions (more
+    than tolerance slower than the baseline)
+    """
+
+    before = {(entry['benchmark'], entry['size']): entry['seconds']
+              for entry in baseline}
+    regressions = []
+    for entry in results:
+        key = (entry['benchmark'], entry['size'])
+        if key not in before or not before[key]:
+            continue
+        ratio = entry['seconds'] / before[key]
+        regressed = ratio > 1 + tolerance
+        print("{:<20} {:>8} shows {:8.2f}x{}".format(
+            key[0], key[1], ratio, '  REGRESSION' if regressed else ''))
+        if regressed:
+            regressions.append(entry)
+    return regressions
+
+
+def main():
+    """ run the benchmarks """
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument('benchmarks',
+                    nargs='*',
+                    help='the benchmarks to run: {} (default: all)'.format(
+                        ', '.join(sorted(BENCHMARKS))),
+                    metavar='BENCHMARK')
+    ap.add_argument('--sizes',
+                    type=int,
+                    nargs='+',
+                    default=[100, 1000, 10000, 100000],
+                    help='number of shows in the generated files')
+    ap.add_argument('--repeat',
+                    type=int,
+                    default=5,
+                    help='how often each benchmark is timed (the best '
+                    'time counts)')
+    ap.add_argument('--json',
+                    help='write the results as json to FILE',
+                    metavar='FILE')
+    ap.add_argument('--baseline',
+                    help='compare the results against a json FILE written '
+                    'with --json and exit with 1 on a regression',
+                    metavar='FILE')
+    ap.add_argument('--tolerance',
+                    type=float,
+                    default=0.25,
+                    help='how much slower than the baseline is still fine '
+                    '(default: 0.25 = 25%%)')
+    args = ap.parse_args()
+    for benchmark in args.benchmarks:
+        if benchmark not in BENCHMARKS:
+            ap.error("unknown benchmark '{}'".format(benchmark))
+
+    results = []
+    tempfolder = tempfile.mkdtemp()
+    try:
+        showfiles = Showfiles(tempfolder)
+        for benchmark in args.benchmarks or sorted(BENCHMARKS):
+            for size in args.sizes:
+                results.extend(BENCHMARKS[benchmark](showfiles, size,
+                                                     args.repeat))
+    finally:
+        shutil.rmtree(tempfolder)
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump({'python': sys.version, 'results': results}, file,
+                      indent=2)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as file:
+            baseline = json.load(file)['results']
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
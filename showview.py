@@ -5,12 +5,61 @@ showview.py
 a tool to keep track of the shows you're watching
 """
 
-# TODO: put _ in front of private variables (self.tree, self.root)
+# argparse, asyncio, cProfile, fcntl, hashlib, json, shutil, socket,
+# socketserver, sqlite3 and ElementTree (or lxml) are imported where they
+# are used, so a call like --complete doesn't pay for importing them (and
+# doesn't need the posix only fcntl)
 
-import argparse
-import xml.etree.ElementTree as ET
+import array
+import bisect
+import contextlib
+import functools
+import heapq
+import io
+import itertools
+import marshal
+import mmap
+import operator
+import os
+import re
+import shlex
+import signal
+import struct
+import sys
+import threading
+import time
 
 SOURCE = '/mnt/sda4/_Daten/showview/show.xml'
+JOURNAL_LIMIT = 64 * 1024
+SNAPSHOT_VERSION = 2
+TRIGRAMS_VERSION = 1
+SQLITE_SCHEME = 'sqlite:'
+SQLITE_SUFFIXES = ('.db', '.sqlite', '.sqlite3')
+EMPTY_XML = '<DocumentElement />'
+SOCKET_SUFFIX = '.sock'
+NAMES_SUFFIX = '.names'
+TRIGRAMS_SUFFIX = '.trigrams'
+HISTORY_SUFFIX = '.history'
+# show id, season, episode, unix time (unsigned, good until 2106): four
+# 32 bit words, so the columns can be sliced out of a memoryview
+HISTORY_RECORD = struct.Struct('<IiiI')
+MANIFEST = 'manifest.json'
+SHARD_SIZE = 10000
+PATCH_LIMIT = 64
+DAEMON_FLUSH = 5.0
+DAEMON_TIMEOUT = 10.0
+DUPLICATES = ('skip', 'replace', 'error', 'keep')
+SHOW_FIELDS = ('name', 'season', 'episode')
+LISTING_FORMATS = ('text', 'json', 'jsonl', 'tsv')
+DUMP_CHUNK = 1000
+# the options (by dest) only main handles, not _run for a batch or daemon
+_MAIN_ONLY = ('showfile', 'migrate', 'rebalance', 'import_file', 'export',
+              'aggregate', 'workers', 'duplicates', 'journal', 'complete',
+              'daemon', 'profile', 'batch')
+# shows AsyncShowView.get_shows fetches in the executor at a time
+ASYNC_CHUNK = 1000
+# share of the trigrams of a search a name must have without containing it
+SEARCH_SIMILARITY = 0.5
 
 
 def indent(elem, level=0):
@@ -30,126 +79,2882 @@ def indent(elem, level=0):
             elem.tail = i
 
 
-class ShowView():
+_LOCKS = dict()
+_LOCKS_GUARD = threading.Lock()
+
+# the layout write_xml produces, anything else goes to the xml parser
+_CANONICAL_HEAD = re.compile(rb'(?:<\?xml [ -~]*?\?>\n)?'
+                             rb'<([A-Za-z_][A-Za-z0-9_.-]*)>')
+# what a rewrite keeps in front of the root element: the xml declaration
+_PROLOG = re.compile(rb'(?:\xef\xbb\xbf)?(<\?xml [ -~]*?\?>)?\s*<[A-Za-z_]')
+_FIELDS = ('Name', 'Season', 'Episode')
+# a name as _escape and xmlcharrefreplace write it, unrolled for speed
+_ESCAPED = rb'&(?:amp|lt|gt|#[0-9]{1,7});[^<>&]*'
+_CANONICAL_SHOW = re.compile(rb'\n  <Show>\n    <Name>([^<>&]+(?:' +
+                             _ESCAPED + rb')*|(?:' + _ESCAPED + rb')+)</Name>'
+                             rb'\n    <Season>(-?[0-9]+)</Season>'
+                             rb'\n    <Episode>(-?[0-9]+)</Episode>'
+                             rb'\n  </Show>')
+
+
+@contextlib.contextmanager
+def file_lock(sourcefile):
+    """
+    hold the advisory lock of sourcefile (on sourcefile + '.lock', the
+    sourcefile itself is replaced on every write). Threads of a process
+    take turns on a lock of their own in front of it, the thread holding
+    it can take it again. Without fcntl (on windows) only that thread lock
+    is taken.
+    """
+
+    try:
+        import fcntl
+    except ImportError:
+        fcntl = None
+
+    lockfile = os.path.abspath(sourcefile + '.lock')
+    with _LOCKS_GUARD:
+        if lockfile not in _LOCKS:
+            # the thread lock, the locked file and how often it is held
+            _LOCKS[lockfile] = [threading.RLock(), None, 0]
+        entry = _LOCKS[lockfile]
+    with entry[0]:
+        if not entry[2] and fcntl is not None:
+            file = open(lockfile, 'a')
+            try:
+                fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+            except BaseException:
+                file.close()
+                raise
+            entry[1] = file
+        entry[2] += 1
+        try:
+            yield
+        finally:
+            entry[2] -= 1
+            if not entry[2] and entry[1] is not None:
+                file = entry[1]
+                entry[1] = None
+                fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+                file.close()
+
+
+def _tmpfile(path):
+    """
+    create an empty file next to path to be moved over it, with the mode
+    of path if it exists. Its name is unique, so writers in other threads
+    and processes never share it.
+    """
+
+    import shutil
+    import tempfile
+
+    directory, name = os.path.split(os.path.abspath(path))
+    fd, tmpfile = tempfile.mkstemp(prefix=name + '.', suffix='.tmp',
+                                   dir=directory)
+    os.close(fd)
+    if os.path.exists(path):
+        shutil.copymode(path, tmpfile)
+    return tmpfile
+
+
+def _escape(text):
+    """ escape text for xml character data like ElementTree does """
+
+    if '&' in text:
+        text = text.replace('&', '&amp;')
+    if '<' in text:
+        text = text.replace('<', '&lt;')
+    if '>' in text:
+        text = text.replace('>', '&gt;')
+    return text
+
+
+_REFERENCE = re.compile(r'&(?:(amp|lt|gt)|#([0-9]+));')
+_ENTITIES = {'amp': '&', 'lt': '<', 'gt': '>'}
+
+
+def _unescape(text):
+    """
+    undo _escape and xmlcharrefreplace (raises ValueError for a character
+    reference that isn't a character)
+    """
+
+    return _REFERENCE.sub(
+        lambda match: (_ENTITIES[match.group(1)] if match.group(1)
+                       else chr(int(match.group(2)))), text)
+
+
+def write_xml(file, shows, roottag='DocumentElement', declaration=None):
+    """
+    write shows (Show records) in one pass to the binary file, in the
+    layout indent() and ElementTree.write produce, after the xml
+    declaration if there is one
+    """
+
+    if declaration:
+        file.write(declaration.encode('ascii') + b'\n')
+    if not shows:
+        file.write('<{} />'.format(roottag).encode('ascii'))
+        return
+    file.write('<{}>'.format(roottag).encode('ascii'))
+    for show in shows:
+        if show.name:
+            name = '<Name>{}</Name>'.format(_escape(show.name))
+        else:
+            name = '<Name />'
+        file.write('\n  <Show>\n    {}\n    <Season>{}</Season>\n'
+                   '    <Episode>{}</Episode>\n  </Show>'.format(
+                       name, show.season, show.episode).encode(
+                           'ascii', 'xmlcharrefreplace'))
+    file.write('\n</{}>\n'.format(roottag).encode('ascii'))
+
+
+def _lost_content(file):
+    """
+    returns what rewriting the xml file with write_xml would drop (for an
+    error message), or None if it only holds shows with a name, a season
+    and an episode
+    """
+
+    import xml.etree.ElementTree as ET
+
+    with open(file, 'rb') as source:
+        if _PROLOG.match(source.read(4096)) is None:
+            return 'a doctype, comment or processing instruction'
+    root = None
+    depth = 0
+    for event, elem in ET.iterparse(file, events=('start', 'end', 'comment',
+                                                  'pi')):
+        if event in ('comment', 'pi'):
+            return 'a comment or processing instruction'
+        if event == 'start':
+            depth += 1
+            if root is None:
+                root = elem
+            if elem.attrib or elem.tag.startswith('{'):
+                return 'attributes or namespaces'
+            if ((depth == 2 and elem.tag != 'Show') or
+                    (depth == 3 and elem.tag not in _FIELDS) or depth > 3):
+                return 'the element <{}>'.format(elem.tag)
+            continue
+        depth -= 1
+        if depth == 1:
+            # a show, only whitespace may be around its fields
+            if (sorted(child.tag for child in elem) != sorted(_FIELDS) or
+                    (elem.text or '').strip() or
+                    any((child.tail or '').strip() for child in elem)):
+                return 'a show with other content than {}'.format(
+                    ', '.join(_FIELDS))
+            # the tail of the last show isn't complete yet
+            done = root[:-1]
+        elif depth == 0:
+            done = root[:]
+        else:
+            continue
+        if ((root.text or '').strip() or
+                any((show.tail or '').strip() for show in done)):
+            return 'text between the shows'
+        del root[:len(done)]
+    return None
+
+
+class _Timer():
+    """ times one phase and reports it to a hook """
+
+    __slots__ = ('hook', 'phase', 'scanned', 'start')
+
+    def __init__(self, hook, phase):
+        self.hook = hook
+        self.phase = phase
+        self.scanned = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.hook(self.phase, time.perf_counter() - self.start, self.scanned)
+
+
+class _NullTimer():
+    """ stands in for _Timer when there is no hook """
+
+    scanned = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Show():
+    """
+    one show you're watching. ShowView keeps these compact records in
+    memory instead of an ElementTree.
+    """
+
+    __slots__ = ('name', 'season', 'episode')
+
+    def __init__(self, name, season=0, episode=0):
+        self.name = name
+        self.season = int(season)
+        self.episode = int(episode)
+
+    def __repr__(self):
+        return 'Show({!r}, {!r}, {!r})'.format(self.name,
+                                               self.season,
+                                               self.episode)
+
+    def as_dict(self):
+        """ the dict the ShowView API hands out """
+
+        return {"name": self.name,
+                "season": self.season,
+                "episode": self.episode}
+
+
+def _trigrams(text):
+    """ the trigrams of text, lowercase and padded with a space """
+
+    text = ' ' + text.lower() + ' '
+    return set(text[i:i + 3] for i in range(len(text) - 2))
+
+
+def _names_data(names):
+    """ the content of the names cache for names """
+
+    return '\n'.join(name for name in names
+                     if '\n' not in name).encode('utf-8')
+
+
+def _names_digest(data):
+    """ what a saved search index has to match: the names cache content """
+
+    import hashlib
+
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+class _TrigramIndex():
+    """
+    maps every trigram of the show names to the ids (positions in names) of
+    the names that contain it, a search only visits the names sharing a
+    trigram with it. A removed name leaves None at its id.
+    """
+
+    def __init__(self, names=(), postings=None):
+        """
+        index names, or take names and postings (trigram -> bytes of the
+        uint32 ids) from a saved index as they are
+        """
+
+        self._ids = None
+        if postings is not None:
+            self.names = names
+            self.postings = postings
+            return
+        self.names = []
+        self.postings = dict()
+        for name in names:
+            self.add(name)
+
+    def _posting(self, trigram):
+        """ the ids for trigram as an array (saved ones are bytes) """
+
+        ids = self.postings.get(trigram)
+        if isinstance(ids, bytes):
+            ids = self.postings[trigram] = array.array('I', ids)
+        return ids
+
+    def add(self, name):
+        """ index name """
+
+        if self._ids is None:
+            self._ids = {name: i for i, name in enumerate(self.names)
+                         if name is not None}
+        if name in self._ids:
+            return
+        self._ids[name] = len(self.names)
+        for trigram in _trigrams(name):
+            ids = self._posting(trigram)
+            if ids is None:
+                ids = self.postings[trigram] = array.array('I')
+            ids.append(len(self.names))
+        self.names.append(name)
+
+    def remove(self, name):
+        """ forget name """
+
+        if self._ids is None:
+            self._ids = {name: i for i, name in enumerate(self.names)
+                         if name is not None}
+        if name in self._ids:
+            self.names[self._ids.pop(name)] = None
+
+    def table(self):
+        """ the names and postings to save """
+
+        return self.names, {trigram: bytes(ids)
+                            for trigram, ids in self.postings.items()}
+
+    def search(self, text):
+        """
+        returns (rank, name) for the names containing text (names starting
+        with it first, then names with a word starting with it) and the
+        names sharing at least SEARCH_SIMILARITY of its trigrams. Lower
+        ranks are better.
+        """
+
+        query = text.lower()
+        if not query.strip():
+            return []
+        if len(query) < 3:
+            # too short for a trigram of its own, but every name containing
+            # it has a trigram containing it
+            trigrams = [trigram for trigram in self.postings
+                        if query in trigram]
+            counts = dict.fromkeys(i for trigram in trigrams
+                                   for i in self._posting(trigram))
+        else:
+            trigrams = _trigrams(query)
+            counts = dict()
+            for trigram in trigrams:
+                for i in self._posting(trigram) or ():
+                    counts[i] = counts.get(i, 0) + 1
+
+        results = []
+        for i, shared in counts.items():
+            name = self.names[i]
+            if name is None:
+                continue
+            lower = name.lower()
+            if query in lower:
+                tier = 0 if lower.startswith(query) else \
+                    1 if ' ' + query in lower else 2
+                score = 1.0
+            elif shared:
+                tier = 3
+                score = shared / len(trigrams)
+                if score < SEARCH_SIMILARITY:
+                    continue
+            else:
+                continue
+            results.append(((tier, -score, len(name), name), name))
+        return results
+
+
+def _etree():
+    """
+    the ElementTree API the xml parser fallback and root use: lxml.etree
+    if it is installed (its C parser is faster), else the stdlib one
+    """
+
+    try:
+        from lxml import etree
+    except ImportError:
+        import xml.etree.ElementTree as etree
+    return etree
+
+
+def _numpy():
+    """ numpy if it is installed (the history queries use it), else None """
+
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+class WatchHistory():
+    """
+    every change of a season or episode as a fixed-width event (show id,
+    season, episode, unix time) in an append-only file. The show ids are
+    the lines of historyfile + '.names' (json strings), a rename rewrites
+    the name of its id.
+    """
+
+    def __init__(self, historyfile):
+        self.historyfile = historyfile
+        self.namesfile = historyfile + NAMES_SUFFIX
+
+    def names(self):
+        """ the name of every show id """
+
+        import json
+
+        try:
+            with open(self.namesfile, 'r', encoding='utf-8') as file:
+                lines = file.read().split('\n')
+            # every name ends with a newline, the rest is torn
+            return json.loads('[' + ','.join(lines[:-1]) + ']')
+        except (OSError, ValueError):
+            return []
+
+    def record(self, events):
+        """
+        append events: ('set', name, season, episode, time) and ('rename',
+        name, new_name) in order. The caller holds the file_lock of the
+        showfile.
+        """
+
+        import json
+
+        names = self.names()
+        ids = {name: i for i, name in enumerate(names)}
+        known = len(names)
+        renamed = False
+        data = bytearray()
+        for event in events:
+            if event[0] == 'rename':
+                if event[1] in ids:
+                    i = ids.pop(event[1])
+                    names[i] = event[2]
+                    ids[event[2]] = i
+                    renamed = True
+                continue
+            _, name, season, episode, when = event
+            if name not in ids:
+                ids[name] = len(names)
+                names.append(name)
+            data += HISTORY_RECORD.pack(ids[name], season, episode, when)
+
+        if renamed:
+            tmpfile = _tmpfile(self.namesfile)
+            with open(tmpfile, 'w', encoding='utf-8') as file:
+                file.write(''.join(json.dumps(name) + '\n' for name in names))
+            os.replace(tmpfile, self.namesfile)
+        elif len(names) > known:
+            with open(self.namesfile, 'a', encoding='utf-8') as file:
+                file.write(''.join(json.dumps(name) + '\n'
+                                   for name in names[known:]))
+        if data:
+            with open(self.historyfile, 'ab') as file:
+                # an event torn by a crash would shift every later one
+                torn = file.tell() % HISTORY_RECORD.size
+                if torn:
+                    file.truncate(file.tell() - torn)
+                file.write(data)
+
+    def columns(self):
+        """
+        (ids, seasons, episodes, times) of every event, numpy arrays if
+        numpy is installed, tuples otherwise. A torn last event is left out.
+        """
+
+        try:
+            with open(self.historyfile, 'rb') as file:
+                data = memoryview(file.read())
+        except OSError:
+            data = memoryview(b'')
+        data = data[:len(data) - len(data) % HISTORY_RECORD.size]
+        numpy = _numpy()
+        if numpy is not None:
+            events = numpy.frombuffer(data, dtype=numpy.dtype(
+                [('id', '<u4'), ('season', '<i4'), ('episode', '<i4'),
+                 ('time', '<u4')]))
+            return (events['id'], events['season'], events['episode'],
+                    events['time'].astype(numpy.int64))
+        if sys.byteorder != 'little':
+            return tuple(zip(*HISTORY_RECORD.iter_unpack(data))) or \
+                ((), (), (), ())
+        words = data.cast('I')
+        signed = data.cast('i')
+        return (words[0::4].tolist(), signed[1::4].tolist(),
+                signed[2::4].tolist(), words[3::4].tolist())
+
+    def watched_per_month(self):
+        """
+        returns {(name, 'YYYY-MM'): episodes} for every show and month (UTC)
+        it was watched in. An event within the season counts the episodes
+        it moved forward, one into a later season the episodes of that
+        season up to its episode. The first event of a show counts as one
+        episode (where it started is unknown), corrections backwards don't
+        count.
+        """
+
+        ids, seasons, episodes, times = self.columns()
+        counts = dict()
+        numpy = _numpy()
+        if numpy is not None:
+            if len(ids):
+                order = numpy.argsort(ids, kind='stable')
+                ids = ids[order]
+                seasons = seasons[order].astype(numpy.int64)
+                episodes = episodes[order].astype(numpy.int64)
+                watched = numpy.ones(len(ids), dtype=numpy.int64)
+                same = ids[1:] == ids[:-1]
+                watched[1:][same] = numpy.where(
+                    seasons[1:] > seasons[:-1], numpy.maximum(episodes[1:], 0),
+                    numpy.where(seasons[1:] == seasons[:-1],
+                                numpy.maximum(episodes[1:] - episodes[:-1],
+                                              0), 0))[same]
+                months = times[order].astype('datetime64[s]').astype(
+                    'datetime64[M]').astype(numpy.int64)
+                keys, inverse = numpy.unique(
+                    numpy.stack([ids.astype(numpy.int64), months], axis=1),
+                    axis=0, return_inverse=True)
+                totals = numpy.bincount(inverse.reshape(-1), weights=watched,
+                                        minlength=len(keys))
+                for (i, month), total in zip(keys.tolist(), totals.tolist()):
+                    if total:
+                        key = (i, 1970 + month // 12, month % 12 + 1)
+                        counts[key] = int(total)
+        else:
+            last = dict()
+            months = dict()
+            for i, season, episode, when in zip(ids, seasons, episodes,
+                                                times):
+                before = last.get(i)
+                last[i] = (season, episode)
+                if before is None:
+                    watched = 1
+                elif season > before[0]:
+                    watched = max(episode, 0)
+                elif season == before[0]:
+                    watched = max(episode - before[1], 0)
+                else:
+                    watched = 0
+                if not watched:
+                    continue
+                day = when // 86400
+                month = months.get(day)
+                if month is None:
+                    month = months[day] = time.gmtime(when)[:2]
+                key = (i,) + month
+                counts[key] = counts.get(key, 0) + watched
+
+        names = self.names()
+        watched = dict()
+        for (i, year, month), total in counts.items():
+            if i < len(names):
+                key = (names[i], '{:04}-{:02}'.format(year, month))
+                watched[key] = watched.get(key, 0) + total
+        return watched
+
+    def last_watched(self):
+        """ returns {name: unix time of its last event} """
+
+        ids, _, _, times = self.columns()
+        numpy = _numpy()
+        if numpy is not None:
+            unique, index = numpy.unique(ids[::-1], return_index=True)
+            last = dict(zip(unique.tolist(),
+                            times[len(times) - 1 - index].tolist()))
+        else:
+            # the events are in the order they were written
+            last = dict(zip(ids, times))
+
+        names = self.names()
+        watched = dict()
+        for i, when in last.items():
+            if i < len(names) and when > watched.get(names[i], when - 1):
+                watched[names[i]] = when
+        return watched
+
+
+class _BaseShowView():
+    """
+    what every storage backend shares: read-only checks and batching of
+    writes. Backends implement _flush (and _savepoint and _discard if they
+    can roll back).
+    """
+
+    readonly = False
+    hook = None
+    auto_refresh = None
+    _refreshed = float('-inf')
+    _replaying = False
+    _batch_depth = 0
+    _pending_write = False
+
+    def _timed(self, phase):
+        """
+        a context manager that reports the time of phase (and the shows
+        it scanned, set its scanned attribute) to the hook. Without a hook
+        it does nothing.
+        """
+
+        if self.hook is None:
+            return _NULL_TIMER
+        return _Timer(self.hook, phase)
+
+    def _check_writable(self):
+        """ raise if the ShowView was opened read-only """
+
+        if self.readonly and not self._replaying:
+            raise RuntimeError("'{}' was opened read-only".format(
+                self.sourcefile))
+
+    @staticmethod
+    def _show_to_add(show, name, season, episode):
+        """
+        the show dict add_show stores, from show and the arguments. A
+        season or episode that isn't given is 0.
+        """
+
+        if not (show or name):
+            raise LookupError("Name or show must be set")
+
+        if not show:
+            show = dict()
+
+        if name:
+            show['name'] = name
+        show['season'] = season or 0
+        show['episode'] = episode or 0
+        return show
+
+    @staticmethod
+    def _show_to_set(show, name, season, episode, new_name):
+        """
+        the show dict set_show applies, from show and the arguments that
+        are given
+        """
+
+        if not (show or name):
+            raise LookupError("Name or show must be set")
+
+        if not show:
+            show = dict()
+
+        if name is not None:
+            show['name'] = name
+        if season is not None:
+            show['season'] = season
+        if episode is not None:
+            show['episode'] = episode
+        if new_name is not None:
+            show['new_name'] = new_name
+        return show
+
+    def begin(self):
+        """
+        start a batch: write_shows only marks the file as changed until
+        the matching commit. Batches can be nested.
+        """
+
+        self._check_writable()
+        if not self._batch_depth:
+            self._savepoint()
+        self._batch_depth += 1
+
+    def commit(self):
+        """ end a batch and write the file once if anything changed """
+
+        if not self._batch_depth:
+            raise RuntimeError("commit without begin")
+        self._batch_depth -= 1
+        if not self._batch_depth and self._pending_write:
+            self.write_shows()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        batch the changes in a with block and write them once at the end.
+        Nothing is written if the block raises.
+        """
+
+        self.begin()
+        try:
+            yield self
+        except BaseException:
+            self._batch_depth -= 1
+            if not self._batch_depth:
+                self._pending_write = False
+                self._discard()
+            raise
+        self.commit()
+
+    def write_shows(self):
+        """ write the changes to the storage (once at commit in a batch) """
+
+        self._check_writable()
+        if self._batch_depth:
+            self._pending_write = True
+            return
+        self._pending_write = False
+        self._flush()
+
+    def _flush(self):
+        """ write the changes to the storage """
+
+        raise NotImplementedError
+
+    def _savepoint(self):
+        """ remember what _discard goes back to (at the outer begin) """
+
+    def _discard(self):
+        """ throw away the changes of a failed transaction if possible """
+
+    def import_shows(self, shows, duplicates='skip'):
+        """
+        add many shows (dicts like get_shows returns) at once and write
+        them once. duplicates decides about shows that already exist (or
+        come twice): 'skip' keeps the first one, 'replace' takes the
+        season and episode of the last one, 'error' raises a ValueError
+        before anything is changed and 'keep' adds every show as another
+        one of its name. Returns the number of added and replaced shows.
+        """
+
+        self._check_writable()
+        if duplicates not in DUPLICATES:
+            raise ValueError("duplicates must be one of {}".format(
+                ', '.join(DUPLICATES)))
+        batch = dict()
+        kept = []
+        for show in shows:
+            record = Show(str(show['name']), int(show.get('season') or 0),
+                          int(show.get('episode') or 0))
+            if duplicates == 'keep':
+                kept.append(record)
+            elif record.name not in batch or duplicates == 'replace':
+                batch[record.name] = record
+            elif duplicates == 'error':
+                raise ValueError("Show '{}' is imported twice".format(
+                    record.name))
+        batch = sorted(kept if duplicates == 'keep' else batch.values(),
+                       key=lambda record: record.name)
+        with self.transaction():
+            count = self._import(batch, duplicates)
+            self.write_shows()
+        return count
+
+    def _import(self, batch, duplicates):
+        """
+        import_shows for the backend: batch is sorted by name and has no
+        duplicates of its own (unless duplicates is 'keep')
+        """
+
+        raise NotImplementedError
+
+    def refresh(self):
+        """
+        catch up with changes other processes made to the storage, returns
+        the names of the shows that were added, removed and changed (sqlite
+        always reads the current data, so there is nothing to do)
+        """
+
+        return {"added": [], "removed": [], "changed": []}
+
+    def _check_refresh(self):
+        """ refresh before a read if auto_refresh seconds have passed """
+
+        if (self.auto_refresh is not None and
+                time.monotonic() - self._refreshed >= self.auto_refresh):
+            self.refresh()
+            self._refreshed = time.monotonic()
+
+    def _histories(self):
+        """ the WatchHistories of the storage, sqlite keeps none """
+
+        return []
+
+    def watched_per_month(self):
+        """
+        returns {(name, 'YYYY-MM'): episodes} from the watch history, see
+        WatchHistory.watched_per_month
+        """
+
+        watched = dict()
+        for history in self._histories():
+            for key, total in history.watched_per_month().items():
+                watched[key] = watched.get(key, 0) + total
+        return watched
+
+    def untouched(self, days=90, now=None):
+        """
+        yields the shows without a watch history event in the last days
+        (before now, a unix time)
+        """
+
+        cutoff = (time.time() if now is None else now) - days * 24 * 3600
+        last = dict()
+        for history in self._histories():
+            for name, when in history.last_watched().items():
+                last[name] = max(when, last.get(name, when))
+        for show in self.get_shows():
+            if last.get(show['name'], cutoff - 1) < cutoff:
+                yield show
+
+    def search(self, text, limit=None):
+        """
+        yields the shows whose name contains text (case-insensitive) or is
+        similar to it (typos), the best matches first
+        """
+
+        names = [name for _, name in sorted(self._search(text))[:limit]]
+        shows = self._shows_named(set(names))
+        for name in names:
+            yield from shows.get(name, ())
+
+    def _search(self, text):
+        """
+        the (rank, name) matches of text. Backends without a search index
+        build one from every name.
+        """
+
+        return _TrigramIndex(show['name']
+                             for show in self.get_shows()).search(text)
+
+    def _shows_named(self, names):
+        """ returns name -> [show] for the shows called one of names """
+
+        shows = dict()
+        for show in self.get_shows():
+            if show['name'] in names:
+                shows.setdefault(show['name'], []).append(show)
+        return shows
+
+
+class ShowView(_BaseShowView):
     """
     the shows you're watching
     """
 
-    def __init__(self, sourcefile=SOURCE):
-        """ reads the xml file """
+    def __init__(self, sourcefile=SOURCE, readonly=False, journal=False,
+                 hook=None, history=True, auto_refresh=None):
+        """
+        reads the xml file and replays its journal. With readonly the file
+        isn't loaded at all, get_shows and get_show stream it with
+        iterparse instead and every change raises a RuntimeError.
+
+        With journal every change is appended to the journal file
+        (sourcefile + '.journal') and write_shows only rewrites the xml
+        file once the journal grows past JOURNAL_LIMIT bytes.
+
+        hook(phase, seconds, scanned) is called after every phase
+        (snapshot, parse, index, replay, lookup, mutate, journal, merge,
+        serialize, fsync, rename) with its time and the shows it scanned.
+
+        Writes hold the file_lock of the sourcefile. If another process
+        wrote the file since it was loaded, the changes made here are
+        merged field by field into the new content. Fields both changed
+        keep the value from here and are listed in conflicts.
+
+        With history every change of a season or episode is appended to
+        the WatchHistory sourcefile + '.history' on write.
+
+        With auto_refresh get_shows and get_show call refresh first if
+        that many seconds passed since the last check (0 checks on every
+        read, which costs two stat calls).
+        """
+
+        self.sourcefile = sourcefile
+        self.journalfile = sourcefile + '.journal'
+        self.snapshotfile = sourcefile + '.snapshot'
+        self.namesfile = sourcefile + NAMES_SUFFIX
+        self.trigramsfile = sourcefile + TRIGRAMS_SUFFIX
+        self.readonly = readonly
+        self.journal = journal
+        self.hook = hook
+        self.history = (WatchHistory(sourcefile + HISTORY_SUFFIX)
+                        if history else None)
+        self.auto_refresh = auto_refresh
+        self._roottag = 'DocumentElement'
+        self._shows = None
+        self._trigrams = None
+        self._events = []
+        self._changes = []
+        self._names_changed = False
+        self._canonical = False
+        self.conflicts = []
+        if readonly and not self._journal_size():
+            return
+        seen = self._stamp()
+        self._version = self._stat()
+        self._load()
+        self._build_index()
+        self._replay_journal()
+        self._seen = seen
+
+    def _stamp(self):
+        """
+        what tells whether the sourcefile or its journal changed since the
+        shows were read
+        """
+
+        return self._stat(), self._journal_size()
+
+    def _stat(self):
+        """ what tells whether the sourcefile was written since it was read """
+
+        stat = os.stat(self.sourcefile)
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def _load(self):
+        """
+        read the shows into Show records, from the snapshot if it is
+        still valid and from the xml file otherwise. Remembers whether the
+        file is laid out like write_xml writes it (a snapshot is only made
+        of such files).
+        """
+
+        with self._timed('snapshot'):
+            table = self._load_snapshot()
+        self._canonical = True
+        if table is None:
+            with self._timed('parse') as timer:
+                try:
+                    self._shows = [Show(*row) for row in self._scan_file()]
+                except ValueError:
+                    self._canonical = False
+                    self._shows = [Show(*row) for row in self._iter_file()]
+                timer.scanned = len(self._shows)
+        else:
+            self._roottag = table[0]
+            self._shows = [Show(*row) for row in zip(*table[1:])]
+
+    @property
+    def root(self):
+        """
+        the shows as a (pretty printed) element of the _etree backend. It is
+        built on every access, use get_shows where possible. It is only a
+        copy: changing it doesn't change the shows, use add_show and
+        set_show for that.
+        """
+
+        if self._shows is None:
+            return None
+        etree = _etree()
+        sub_element = etree.SubElement
+        root = etree.Element(self._roottag)
+        for show in self._shows:
+            show_element = sub_element(root, 'Show')
+            sub_element(show_element, 'Name').text = show.name
+            sub_element(show_element, 'Season').text = str(show.season)
+            sub_element(show_element, 'Episode').text = str(show.episode)
+        indent(root)
+        return root
+
+    def _journal_size(self):
+        """ the size of the journal file (0 if there is none) """
+
+        try:
+            return os.path.getsize(self.journalfile)
+        except OSError:
+            return 0
+
+    def _replay_journal(self):
+        """
+        apply the records of the journal. A torn last record (from a crash
+        while it was written) is ignored. The journal starts with the
+        version of the sourcefile it was written for, a journal of another
+        version is already part of the file (_write crashed before it
+        could remove it).
+        """
+
+        import json
+
+        if not self._journal_size():
+            return
+        self._replaying = True
+        try:
+            with self._timed('replay'), open(self.journalfile, 'r') as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break
+                    op = record.pop('op')
+                    if op == 'base':
+                        if record['version'] != list(self._stat()):
+                            break
+                    elif op == 'add':
+                        self.add_show(**record)
+                    elif op == 'set':
+                        self.set_show(**record)
+                    elif op == 'remove':
+                        self._remove(record['name'])
+        finally:
+            self._replaying = False
+
+    def _log(self, op, *shows):
+        """ append a record for every change to the journal (one fsync) """
+
+        import json
+
+        if not self.journal or self._replaying or not shows:
+            return
+        current = self._stamp() == self._seen
+        with self._timed('journal'), open(self.journalfile, 'a') as file:
+            if not file.tell():
+                file.write(json.dumps({"op": "base",
+                                       "version": list(self._stat())}) +
+                           '\n')
+            file.write(''.join(json.dumps(dict(show, op=op)) + '\n'
+                               for show in shows))
+            file.flush()
+            os.fsync(file.fileno())
+        if current:
+            # nobody else wrote in between, refresh needn't read this back
+            self._seen = self._stamp()
+
+    def _file_digest(self):
+        """ mtime, size and hash of the sourcefile """
+
+        import hashlib
+
+        stat = os.stat(self.sourcefile)
+        digest = hashlib.blake2b(digest_size=16)
+        with open(self.sourcefile, 'rb') as file:
+            # in chunks, the file may be much bigger than the memory
+            for chunk in iter(functools.partial(file.read, 1 << 20), b''):
+                digest.update(chunk)
+        return stat.st_mtime_ns, stat.st_size, digest.digest()
+
+    def _load_snapshot(self):
+        """
+        returns the (roottag, names, seasons, episodes) table of the snapshot
+        or None if there is no snapshot or the sourcefile changed since it
+        was made
+        """
+
+        try:
+            with open(self.snapshotfile, 'rb') as file:
+                snapshot = marshal.loads(file.read())
+            version, digest, table = snapshot
+            if version != SNAPSHOT_VERSION or digest != self._file_digest():
+                return None
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+        return table
+
+    def _save_snapshot(self):
+        """
+        write a snapshot of the shows next to the sourcefile. The snapshot
+        is only a cache, so failing to write it is ignored.
+        """
+
+        table = (self._roottag,
+                 [show.name for show in self._shows],
+                 [show.season for show in self._shows],
+                 [show.episode for show in self._shows])
+        try:
+            tmpfile = _tmpfile(self.snapshotfile)
+            with open(tmpfile, 'wb') as file:
+                marshal.dump((SNAPSHOT_VERSION, self._file_digest(), table),
+                             file)
+            os.replace(tmpfile, self.snapshotfile)
+        except OSError:
+            pass
+
+    def _save_names(self):
+        """
+        write the sorted names, one per line, for complete(). Like the
+        snapshot it is only a cache.
+        """
+
+        data = _names_data(self._names)
+        try:
+            with open(self.namesfile, 'rb') as file:
+                old = file.read()
+        except OSError:
+            old = None
+        try:
+            tmpfile = _tmpfile(self.namesfile)
+            with open(tmpfile, 'wb') as file:
+                file.write(data)
+            os.replace(tmpfile, self.namesfile)
+        except OSError:
+            return
+        self._names_changed = False
+        if old != data:
+            self._update_trigrams(old, data)
+
+    def _load_trigrams(self, digest):
+        """
+        returns the saved search index or None if there is none or it
+        wasn't made for the names with digest
+        """
+
+        try:
+            with open(self.trigramsfile, 'rb') as file:
+                version, saved, names, postings = marshal.loads(file.read())
+            if version != TRIGRAMS_VERSION or saved != digest:
+                return None
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+        return _TrigramIndex(names, postings)
+
+    def _save_trigrams(self, index, digest):
+        """
+        write the search index for the names with digest next to the
+        sourcefile, like the snapshot it is only a cache
+        """
+
+        try:
+            tmpfile = _tmpfile(self.trigramsfile)
+            with open(tmpfile, 'wb') as file:
+                marshal.dump((TRIGRAMS_VERSION, digest) + index.table(), file)
+            os.replace(tmpfile, self.trigramsfile)
+        except OSError:
+            pass
+
+    def _update_trigrams(self, old, data):
+        """
+        the names cache changed from old to data: save the search index in
+        use, or bring a saved one for old up to date with the names that
+        were added and removed
+        """
+
+        index = self._trigrams
+        if index is None:
+            if old is None:
+                return
+            index = self._load_trigrams(_names_digest(old))
+            if index is None:
+                return
+            before = set(old.decode('utf-8').split('\n')) if old else set()
+            after = set(data.decode('utf-8').split('\n')) if data else set()
+            for name in before - after:
+                index.remove(name)
+            for name in sorted(after - before):
+                index.add(name)
+        self._save_trigrams(index, _names_digest(data))
+
+    def _read_names(self):
+        """
+        the content of the names cache if it is fresh, else the names are
+        read from the showfile
+        """
+
+        try:
+            if (os.stat(self.namesfile).st_mtime_ns >=
+                    os.stat(self.sourcefile).st_mtime_ns):
+                with open(self.namesfile, 'rb') as file:
+                    return file.read()
+        except OSError:
+            pass
+        return _names_data(sorted(show['name'] for show in self.get_shows()))
+
+    def _search(self, text):
+        """
+        the (rank, name) matches of text from the search index, which is
+        loaded (or built and saved) on the first search and kept current by
+        every change of a name
+        """
+
+        with self._timed('search') as timer:
+            if self._trigrams is None and self._changes:
+                # a saved index is for the names on disk
+                self._trigrams = _TrigramIndex(self._index)
+            elif self._trigrams is None:
+                data = (_names_data(self._names) if self._shows is not None
+                        else self._read_names())
+                digest = _names_digest(data)
+                self._trigrams = self._load_trigrams(digest)
+                if self._trigrams is None:
+                    self._trigrams = _TrigramIndex(
+                        data.decode('utf-8').split('\n') if data else ())
+                    self._save_trigrams(self._trigrams, digest)
+            results = self._trigrams.search(text)
+            timer.scanned = len(results)
+        return results
+
+    def _shows_named(self, names):
+        """ returns name -> [show] for the shows called one of names """
+
+        if self._shows is not None:
+            return {name: [record.as_dict() for record in self._index[name]]
+                    for name in names if name in self._index}
+        table = self._load_snapshot()
+        if table is None:
+            return super()._shows_named(names)
+        shows = dict()
+        for name, season, episode in zip(*table[1:]):
+            if name in names:
+                shows.setdefault(name, []).append(
+                    {"name": name, "season": season, "episode": episode})
+        return shows
+
+    def _scan_file(self, decode=True):
+        """
+        yields (name, season, episode) of every show by scanning the memory
+        mapped sourcefile, without building any elements. Raises ValueError
+        as soon as the file isn't laid out like write_xml writes it
+        (comments, entities, attributes, other whitespace...). Without
+        decode only the matches are yielded.
+        """
+
+        with open(self.sourcefile, 'rb') as file, \
+                mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            head = _CANONICAL_HEAD.match(data)
+            if head is None:
+                raise ValueError("not a canonical showfile")
+            tail = b'\n</' + head.group(1) + b'>\n'
+            end = len(data) - len(tail)
+            if data[end:] != tail:
+                raise ValueError("not a canonical showfile")
+            self._roottag = head.group(1).decode('ascii')
+            position = head.end()
+            while position < end:
+                match = _CANONICAL_SHOW.match(data, position)
+                if match is None:
+                    raise ValueError("not a canonical showfile")
+                position = match.end()
+                if decode:
+                    name = match.group(1).decode('utf-8')
+                    if '&' in name:
+                        name = _unescape(name)
+                    yield name, int(match.group(2)), int(match.group(3))
+                else:
+                    yield match
+            if position != end:
+                raise ValueError("not a canonical showfile")
+
+    def _is_canonical(self):
+        """ can _scan_file read the sourcefile? """
+
+        try:
+            for _ in self._scan_file(decode=False):
+                pass
+        except ValueError:
+            return False
+        return True
+
+    def _iter_rows(self):
+        """
+        yields (name, season, episode) of every show in one pass: scanned
+        with _scan_file while the file is canonical, from the first row
+        that isn't parsed with _iter_file (skipping the rows already
+        yielded)
+        """
+
+        rows = self._scan_file()
+        done = 0
+        while True:
+            try:
+                row = next(rows)
+            except StopIteration:
+                return
+            except ValueError:
+                break
+            yield row
+            done += 1
+        yield from itertools.islice(self._iter_file(), done, None)
+
+    def _iter_file(self):
+        """
+        yields (name, season, episode) of every Show element of the
+        sourcefile, parsed with the _etree backend. Every element is
+        dropped again after it was read so memory stays constant.
+        """
+
+        etree = _etree()
+        if hasattr(etree, 'LXML_VERSION'):
+            yield from self._iter_lxml(etree)
+            return
+        root = None
+        for event, elem in etree.iterparse(self.sourcefile,
+                                           events=('start', 'end')):
+            if root is None:
+                root = elem
+                self._roottag = root.tag
+            elif event == 'end' and elem.tag == 'Show':
+                yield (elem.find('Name').text,
+                       int(elem.find('Season').text),
+                       int(elem.find('Episode').text))
+                root.clear()
+
+    def _iter_lxml(self, etree):
+        """
+        _iter_file for lxml: it only hands out the Show elements, and reads
+        their fields from one pass over the children because find() costs
+        more than the parsing in lxml
+        """
+
+        # like ElementTree: no external entities, nothing from the network
+        parser = etree.iterparse(self.sourcefile, tag='Show',
+                                 resolve_entities=False, no_network=True)
+        for _, elem in parser:
+            fields = dict()
+            for child in elem:
+                fields.setdefault(child.tag, child.text)
+            yield (fields['Name'], int(fields['Season']),
+                   int(fields['Episode']))
+            elem.clear(keep_tail=True)
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+        self._roottag = parser.root.tag
+
+    def _build_index(self):
+        """
+        build the name index: a dict name -> [Show] for exact lookups and
+        a sorted list of names for prefix lookups and insert positions
+        """
+
+        with self._timed('index') as timer:
+            self._index = dict()
+            for show in self._shows:
+                self._index.setdefault(show.name, []).append(show)
+            self._names = sorted(show.name for show in self._shows)
+            self._trigrams = None
+            timer.scanned = len(self._shows)
+
+    def _find_first(self, name):
+        """ returns the first Show whose name starts with name """
+
+        if name in self._index:
+            return self._index[name][0]
+        return next(self._prefix_range(name), None)
+
+    def _prefix_range(self, prefix):
+        """
+        yields the Shows whose name starts with prefix in name order. Only
+        the matching slice of the sorted names is visited.
+        """
+
+        i = bisect.bisect_left(self._names, prefix)
+        previous = None
+        while i < len(self._names) and self._names[i].startswith(prefix):
+            name = self._names[i]
+            if name != previous:
+                yield from self._index[name]
+                previous = name
+            i += 1
+
+    def get_shows(self, name=None):
+        """ returns all shows (or the ones starting with name) """
+
+        self._check_refresh()
+        if self._shows is None:
+            yield from self._stream_shows(name)
+            return
+
+        if name:
+            shows = self._prefix_range(name)
+        else:
+            shows = self._shows
+        for show in shows:
+            yield show.as_dict()
+
+    def _stream_shows(self, name):
+        """
+        get_shows and get_show for readonly: streamed from the file in
+        constant memory. The snapshot isn't used, checking it would hash
+        the whole file and unmarshal every show before the first one could
+        be yielded. The stream phase includes the time spent by the caller
+        between two shows.
+        """
+
+        with self._timed('stream') as timer:
+            shows = ({"name": _name, "season": season, "episode": episode}
+                     for _name, season, episode in self._iter_rows())
+            for show in shows:
+                timer.scanned += 1
+                if (not name) or show['name'].startswith(name):
+                    yield show
+
+    def get_show(self, name):
+        """ returns one show found by its name """
+
+        self._check_refresh()
+        with self._timed('lookup') as timer:
+            if self._shows is None:
+                # the first match ends the stream early
+                for show in self._stream_shows(name):
+                    return show
+                raise KeyError("No show found for name '{}'".format(name))
+
+            show = self._find_first(name)
+            timer.scanned = 1
+            if show is None:
+                raise KeyError("No show found for name '{}'".format(name))
+
+            return show.as_dict()
+
+    def add_show(self,
+                 show=None,
+                 name=None,
+                 season=None,
+                 episode=None):
+        """
+        create a show entry and insert it at the right position
+        (alphabetically)
+        """
+
+        self._check_writable()
+        show = self._show_to_add(show, name, season, episode)
+
+        with self._timed('mutate') as timer:
+            record = Show(str(show['name']), show['season'], show['episode'])
+            insert_index = bisect.bisect_left(self._names, record.name)
+            self._shows.insert(insert_index, record)
+            self._names.insert(insert_index, record.name)
+            self._index.setdefault(record.name, []).append(record)
+            self._names_changed = True
+            if self._trigrams is not None:
+                self._trigrams.add(record.name)
+            timer.scanned = 1
+        if not self._replaying:
+            self._changes.append(('add', record.name, record.season,
+                                  record.episode))
+        self._log('add', show)
+
+        return show
+
+    def set_show(self,
+                 show=None,
+                 name=None,
+                 season=None,
+                 episode=None,
+                 new_name=None):
+        """ update a show with new values """
+
+        self._check_writable()
+        show = self._show_to_set(show, name, season, episode, new_name)
+
+        with self._timed('mutate') as timer:
+            records = self._index.get(show['name'], [])
+            if records and not self._replaying:
+                self._record_change(records[0], show)
+            changed = False
+            for record in records:
+                for field in ('season', 'episode'):
+                    if (field in show and
+                            int(show[field]) != getattr(record, field)):
+                        setattr(record, field, int(show[field]))
+                        changed = True
+            if ('new_name' in show and show['name'] in self._index and
+                    str(show['new_name']) != show['name']):
+                self._rename(show['name'], str(show['new_name']))
+                changed = True
+            timer.scanned = len(records)
+        if changed:
+            self._log('set', {key: show[key]
+                              for key in ('name', 'season', 'episode',
+                                          'new_name')
+                              if key in show})
+
+    def _record_change(self, record, show):
+        """ remember the fields show changes (from -> to) for a merge """
+
+        change = {}
+        for field in ('season', 'episode'):
+            if field in show and int(show[field]) != getattr(record, field):
+                change[field] = (getattr(record, field), int(show[field]))
+        if 'new_name' in show and str(show['new_name']) != record.name:
+            change['name'] = (record.name, str(show['new_name']))
+        if change:
+            self._changes.append(('set', record.name, change))
+        if self.history is not None and ('season' in change or
+                                         'episode' in change):
+            self._events.append((
+                'set', record.name,
+                change.get('season', (None, record.season))[1],
+                change.get('episode', (None, record.episode))[1],
+                int(time.time())))
+
+    def refresh(self):
+        """
+        re-read the showfile if another process changed it or its journal
+        (a stat of both tells) and patch the shows, the name index and the
+        search index for the shows that differ, instead of rebuilding them.
+        The new shows are read from the snapshot the writer left if it is
+        valid. Returns the names of the added, removed and changed shows.
+        Changes that aren't on disk yet are merged into the new content
+        like on write. A read-only view reads the file on every call
+        anyway.
+        """
+
+        diff = {"added": [], "removed": [], "changed": []}
+        if self._shows is None:
+            return diff
+        stamp = self._stamp()
+        if stamp == self._seen:
+            return diff
+
+        with self._timed('refresh') as timer:
+            old = self._columns()
+            if self._changes and not self.journal:
+                before = set(self._index)
+                self._merge()
+                touched = self._touched(old, self._columns())
+                diff = self._classify(touched, before, self._index)
+                timer.scanned = len(self._shows)
+                return diff
+
+            version = self._stat()
+            table = None if self._journal_size() else self._load_snapshot()
+            if table is None:
+                fresh = ShowView(self.sourcefile, journal=self.journal,
+                                 history=False)
+                roottag, version = fresh._roottag, fresh._version
+                canonical = fresh._canonical
+                new = fresh._columns()
+            else:
+                roottag = table[0]
+                canonical = True
+                new = table[1:]
+            touched = self._touched(old, new)
+            names, seasons, episodes = new
+            after = dict()
+            for i in itertools.compress(range(len(names)),
+                                        map(touched.__contains__, names)):
+                after.setdefault(names[i], []).append(
+                    (names[i], seasons[i], episodes[i]))
+            diff = self._classify(touched, self._index, after)
+
+            replaced = []
+            for name in diff['changed']:
+                records = self._index[name]
+                if len(records) == len(after[name]):
+                    for record, (_, season, episode) in zip(records,
+                                                            after[name]):
+                        record.season = season
+                        record.episode = episode
+                else:
+                    replaced.append(name)
+
+            removed = diff['removed'] + replaced
+            if removed:
+                dropped = set(id(record) for name in removed
+                              for record in self._index.pop(name))
+                self._shows = [record for record in self._shows
+                               if id(record) not in dropped]
+                for name in removed:
+                    i = bisect.bisect_left(self._names, name)
+                    while i < len(self._names) and self._names[i] == name:
+                        del self._names[i]
+                    if self._trigrams is not None:
+                        self._trigrams.remove(name)
+
+            added = [Show(*row) for name in sorted(diff['added'] + replaced)
+                     for row in after[name]]
+            if added:
+                self._shows = list(heapq.merge(
+                    self._shows, added, key=lambda record: record.name))
+                self._names = list(heapq.merge(
+                    self._names, [record.name for record in added]))
+                for record in added:
+                    self._index.setdefault(record.name, []).append(record)
+                    if self._trigrams is not None:
+                        self._trigrams.add(record.name)
+
+            self._roottag = roottag
+            self._canonical = canonical
+            self._version = version
+            self._seen = stamp
+            timer.scanned = len(touched)
+        return diff
+
+    def _columns(self):
+        """ the names, seasons and episodes of the shows as three lists """
+
+        return ([show.name for show in self._shows],
+                [show.season for show in self._shows],
+                [show.episode for show in self._shows])
+
+    @staticmethod
+    def _touched(old, new):
+        """
+        the names whose shows differ between old and new (both are names,
+        seasons and episodes columns)
+        """
+
+        if old[0] == new[0]:
+            # no show was added or removed, compare the columns in place
+            names = new[0]
+            return (set(itertools.compress(names, map(operator.ne, old[1],
+                                                      new[1]))) |
+                    set(itertools.compress(names, map(operator.ne, old[2],
+                                                      new[2]))))
+        old = list(zip(*old))
+        new = list(zip(*new))
+        old_set = set(old)
+        new_set = set(new)
+        rows = old_set ^ new_set
+        if len(old_set) != len(old) or len(new_set) != len(new):
+            # duplicate rows, their counts have to match as well
+            import collections
+
+            old_counts = collections.Counter(old)
+            new_counts = collections.Counter(new)
+            rows = (old_counts - new_counts) + (new_counts - old_counts)
+        return set(row[0] for row in rows)
+
+    @staticmethod
+    def _classify(touched, before, after):
+        """
+        sort the touched names into added, removed and changed by whether
+        they are in the before and after mappings
+        """
+
+        return {
+            "added": sorted(name for name in touched if name not in before),
+            "removed": sorted(name for name in touched if name not in after),
+            "changed": sorted(name for name in touched
+                              if name in before and name in after),
+        }
+
+    def _savepoint(self):
+        """ remember the shows, the pending changes and the journal size """
+
+        self._saved = (self._columns(), self._roottag, list(self._changes),
+                       list(self._events), self._names_changed,
+                       self._journal_size(), self._version, self._canonical)
+
+    def _discard(self):
+        """
+        go back to the savepoint. The journal records of the failed
+        transaction are cut off again, or if another process appended to
+        the journal since, undone by records that restore the shows they
+        touched.
+        """
+
+        (columns, roottag, changes, events, names_changed, journal_size,
+         version, canonical) = self._saved
+        touched = self._touched(self._columns(), columns)
+        current = self._stamp() == self._seen
+        self._shows = [Show(*row) for row in zip(*columns)]
+        self._build_index()
+        self._roottag = roottag
+        self._changes = changes
+        self._events = events
+        self._names_changed = names_changed
+        self._version = version
+        self._canonical = canonical
+        if not self.journal or self._journal_size() == journal_size:
+            return
+        if current:
+            with file_lock(self.sourcefile):
+                os.truncate(self.journalfile, journal_size)
+            self._seen = self._stamp()
+            return
+        for name in sorted(touched):
+            self._log('remove', {"name": name})
+            if name in self._index:
+                self._log('add', *(record.as_dict()
+                                   for record in self._index[name]))
+
+    def _merge(self):
+        """
+        reload the sourcefile another process wrote and apply the changes
+        made here on top of it. A field only conflicts if both sides
+        changed it to different values, then the value from here wins.
+        """
+
+        changes = self._changes
+        self._changes = []
+        with self._timed('merge') as timer:
+            self._seen = self._stamp()
+            self._version = self._stat()
+            self._load()
+            self._build_index()
+            self._replay_journal()
+            self._replaying = True
+            try:
+                for change in changes:
+                    if change[0] == 'add':
+                        # with journal the add is on disk already
+                        if not self.journal:
+                            self.add_show(name=change[1], season=change[2],
+                                          episode=change[3])
+                        continue
+                    if change[0] == 'remove':
+                        self._remove(change[1])
+                        continue
+                    name, fields = change[1:]
+                    if name not in self._index:
+                        self.conflicts.append((name, 'name', None, name))
+                        continue
+                    record = self._index[name][0]
+                    values = {}
+                    for field, (before, after) in fields.items():
+                        current = record.name if field == 'name' else \
+                            getattr(record, field)
+                        if current != before and current != after:
+                            self.conflicts.append((name, field, current,
+                                                   after))
+                        values['new_name' if field == 'name' else field] = \
+                            after
+                    self.set_show(name=name, **values)
+            finally:
+                self._replaying = False
+            timer.scanned = len(changes)
+
+    def _import(self, batch, duplicates):
+        """
+        merge the sorted batch into the sorted shows and names in one pass
+        instead of an insort for every show
+        """
+
+        with self._timed('mutate') as timer:
+            existing = [record for record in batch
+                        if duplicates != 'keep' and record.name in self._index]
+            if existing and duplicates == 'error':
+                raise ValueError("Show '{}' already exists".format(
+                    existing[0].name))
+            names = set(record.name for record in existing)
+            added = [record for record in batch if record.name not in names]
+            replaced = []
+            if duplicates == 'replace':
+                for record in existing:
+                    show = record.as_dict()
+                    if not self._replaying:
+                        self._record_change(self._index[record.name][0],
+                                            show)
+                    for current in self._index[record.name]:
+                        current.season = record.season
+                        current.episode = record.episode
+                    replaced.append(show)
+
+            self._shows = list(heapq.merge(
+                self._shows, added, key=lambda record: record.name))
+            self._names = list(heapq.merge(self._names,
+                                           [record.name for record in added]))
+            for record in added:
+                self._index[record.name] = [record]
+                if self._trigrams is not None:
+                    self._trigrams.add(record.name)
+                if not self._replaying:
+                    self._changes.append(('add', record.name, record.season,
+                                          record.episode))
+            self._names_changed = self._names_changed or bool(added)
+            timer.scanned = len(self._shows)
+        self._log('add', *(record.as_dict() for record in added))
+        self._log('set', *replaced)
+        return len(added) + len(replaced)
+
+    def _remove(self, name):
+        """
+        drop every show called name (when it moves to another shard),
+        returns them
+        """
+
+        self._check_writable()
+        records = self._index.pop(name, [])
+        for record in records:
+            self._shows.remove(record)
+            del self._names[bisect.bisect_left(self._names, name)]
+        if records:
+            self._names_changed = True
+            if self._trigrams is not None:
+                self._trigrams.remove(name)
+            if not self._replaying:
+                self._changes.append(('remove', name))
+            self._log('remove', {"name": name})
+        return [record.as_dict() for record in records]
+
+    def _rename(self, name, new_name):
+        """ rename every show called name and keep the index current """
+
+        records = self._index.pop(name)
+        for record in records:
+            record.name = new_name
+            i = bisect.bisect_left(self._names, name)
+            del self._names[i]
+            bisect.insort(self._names, new_name)
+        self._index.setdefault(new_name, []).extend(records)
+        self._names_changed = True
+        if self.history is not None and not self._replaying:
+            self._events.append(('rename', name, new_name))
+        if self._trigrams is not None:
+            self._trigrams.remove(name)
+            self._trigrams.add(new_name)
+
+    def _flush(self):
+        """
+        write the xml back to the file. With journal the changes are
+        already on disk, so the file is only rewritten once the journal is
+        too big.
+        """
+
+        if self.journal and self._journal_size() < JOURNAL_LIMIT:
+            if self._names_changed:
+                self._save_names()
+        else:
+            self.compact()
+        if self._events:
+            with file_lock(self.sourcefile):
+                self.history.record(self._events)
+            self._events = []
+
+    def _histories(self):
+        """ the WatchHistory of the showfile """
+
+        return [] if self.history is None else [self.history]
+
+    def compact(self):
+        """
+        write the xml to a temporary file, move it over the sourcefile and
+        drop the journal that is now part of it
+        """
+
+        self._check_writable()
+        with file_lock(self.sourcefile):
+            if self._stamp() != self._seen:
+                # another writer rewrote the file or added to the journal
+                self._merge()
+                self._write()
+            elif self._changes or self._journal_size():
+                if not self._patch():
+                    self._write()
+        self._changes = []
+
+    def _patch(self):
+        """
+        write the changed seasons and episodes into the sourcefile in place
+        instead of rewriting it (the file_lock is held). Only done if
+        every change sets a season or episode to a value as wide as the one
+        in the file, of at most PATCH_LIMIT shows; returns whether it was.
+        Every field stays valid on its own, so a crash in between leaves a
+        well-formed file with some of the changes.
+        """
+
+        if (not self._canonical or self._journal_size() or
+                len(self._changes) > PATCH_LIMIT or
+                any(change[0] != 'set' or 'name' in change[2]
+                    for change in self._changes)):
+            return False
+        with self._timed('patch') as timer, \
+                open(self.sourcefile, 'r+b') as file, \
+                mmap.mmap(file.fileno(), 0) as data:
+            patches = []
+            for name in set(change[1] for change in self._changes):
+                needle = '\n  <Show>\n    <Name>{}</Name>'.format(
+                    _escape(name)).encode('ascii', 'xmlcharrefreplace')
+                # the shows of name in file order
+                first = bisect.bisect_left(self._names, name)
+                count = len(self._index.get(name, ()))
+                records = self._shows[first:first + count]
+                if any(record.name != name for record in records):
+                    return False
+                position = data.find(needle)
+                for record in records:
+                    match = (_CANONICAL_SHOW.match(data, position)
+                             if position >= 0 else None)
+                    if match is None:
+                        return False
+                    for group, value in ((2, record.season),
+                                         (3, record.episode)):
+                        value = str(value).encode('ascii')
+                        if len(value) != len(match.group(group)):
+                            return False
+                        if value != match.group(group):
+                            patches.append((match.start(group), value))
+                    position = data.find(needle, match.end())
+                if position >= 0:
+                    # more shows of that name in the file than here
+                    return False
+            if not patches:
+                # changed back to what is in the file
+                return True
+            for start, value in patches:
+                data[start:start + len(value)] = value
+            timer.scanned = len(patches)
+            with self._timed('fsync'):
+                data.flush()
+                # the size and inode stay, make sure the mtime tells others
+                stat = os.fstat(file.fileno())
+                if stat.st_mtime_ns <= self._version[0]:
+                    os.utime(file.fileno(),
+                             ns=(stat.st_atime_ns, self._version[0] + 1))
+                os.fsync(file.fileno())
+        before = self._version[0]
+        self._version = self._stat()
+        self._seen = self._stamp()
+        try:
+            # no name changed: a names cache that was fresh stays fresh
+            stat = os.stat(self.namesfile)
+            if stat.st_mtime_ns >= before:
+                os.utime(self.namesfile,
+                         ns=(stat.st_atime_ns, self._version[0]))
+        except OSError:
+            pass
+        with self._timed('snapshot'):
+            self._save_snapshot()
+        return True
+
+    def _declaration(self):
+        """
+        the xml declaration of the sourcefile, which _write keeps. Raises
+        ValueError if the sourcefile holds anything else _write would drop
+        (only a file the scanner can't read can).
+        """
+
+        with open(self.sourcefile, 'rb') as file:
+            prolog = _PROLOG.match(file.read(4096))
+        lost = None if self._canonical and prolog else _lost_content(
+            self.sourcefile)
+        if lost is not None:
+            raise ValueError(
+                "'{}' contains {}, which showview can't write back. Remove "
+                "it to make changes.".format(self.sourcefile, lost))
+        return prolog.group(1).decode('ascii') if prolog.group(1) else None
+
+    def _write(self):
+        """ write the xml (the file_lock is held) """
+
+        declaration = self._declaration()
+        tmpfile = _tmpfile(self.sourcefile)
+        try:
+            with open(tmpfile, 'wb') as file:
+                with self._timed('serialize') as timer:
+                    write_xml(file, self._shows, self._roottag, declaration)
+                    file.flush()
+                    timer.scanned = len(self._shows)
+                with self._timed('fsync'):
+                    os.fsync(file.fileno())
+        except BaseException:
+            os.remove(tmpfile)
+            raise
+        with self._timed('rename'):
+            os.replace(tmpfile, self.sourcefile)
+            if os.path.exists(self.journalfile):
+                os.remove(self.journalfile)
+            self._version = self._stat()
+            self._seen = self._stamp()
+            self._canonical = True
+        with self._timed('snapshot'):
+            self._save_snapshot()
+        self._save_names()
+
+
+class SQLiteShowView(_BaseShowView):
+    """
+    the shows you're watching, stored in an indexed sqlite database
+    """
+
+    def __init__(self, sourcefile, readonly=False, hook=None,
+                 check_same_thread=True, **kwargs):
+        """
+        opens (or creates) the database, readonly opens an existing one
+        without write access. kwargs for the xml storage (like journal) are
+        ignored, sqlite keeps its own write-ahead log. hook gets the lookup
+        and commit phases like with ShowView. With check_same_thread=False
+        other threads than the opening one may use the connection, the
+        caller has to make sure only one at a time does.
+        """
+
+        import sqlite3
+
+        self.sourcefile = sourcefile
+        self.readonly = readonly
+        self.hook = hook
+        if readonly:
+            import urllib.parse
+
+            self._connection = sqlite3.connect(
+                'file:{}?mode=ro'.format(urllib.parse.quote(sourcefile)),
+                uri=True, check_same_thread=check_same_thread)
+            return
+        self._connection = sqlite3.connect(
+            sourcefile, check_same_thread=check_same_thread)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS Show ('
+            'id INTEGER PRIMARY KEY, '
+            'name TEXT NOT NULL, '
+            'season INTEGER NOT NULL, '
+            'episode INTEGER NOT NULL)')
+        self._connection.execute(
+            'CREATE INDEX IF NOT EXISTS ShowName ON Show (name)')
+        self._connection.commit()
+
+    def close(self):
+        """ close the database connection """
+
+        self._connection.close()
+
+    def get_shows(self, name=None):
+        """ returns all shows (or the ones starting with name) """
+
+        if name:
+            # the successor of the prefix makes the range usable for the index
+            cursor = self._connection.execute(
+                'SELECT name, season, episode FROM Show '
+                'WHERE name >= ? AND name < ? ORDER BY name, id',
+                (name, name[:-1] + chr(ord(name[-1]) + 1)))
+        else:
+            cursor = self._connection.execute(
+                'SELECT name, season, episode FROM Show ORDER BY name, id')
+        for _name, season, episode in cursor:
+            yield {"name": _name, "season": season, "episode": episode}
+
+    def get_show(self, name):
+        """ returns one show found by its name """
+
+        with self._timed('lookup') as timer:
+            for show in self.get_shows(name):
+                timer.scanned = 1
+                return show
+            raise KeyError("No show found for name '{}'".format(name))
+
+    def add_show(self,
+                 show=None,
+                 name=None,
+                 season=None,
+                 episode=None):
+        """ create a show entry """
+
+        self._check_writable()
+        show = self._show_to_add(show, name, season, episode)
+
+        self._connection.execute(
+            'INSERT INTO Show (name, season, episode) VALUES (?, ?, ?)',
+            (str(show['name']), int(show['season']), int(show['episode'])))
+
+        return show
+
+    def set_show(self,
+                 show=None,
+                 name=None,
+                 season=None,
+                 episode=None,
+                 new_name=None):
+        """ update a show with new values """
+
+        self._check_writable()
+        show = self._show_to_set(show, name, season, episode, new_name)
+
+        if 'season' in show:
+            self._connection.execute(
+                'UPDATE Show SET season = ? WHERE name = ?',
+                (int(show['season']), show['name']))
+        if 'episode' in show:
+            self._connection.execute(
+                'UPDATE Show SET episode = ? WHERE name = ?',
+                (int(show['episode']), show['name']))
+        if 'new_name' in show:
+            self._connection.execute(
+                'UPDATE Show SET name = ? WHERE name = ?',
+                (str(show['new_name']), show['name']))
+
+    def _import(self, batch, duplicates):
+        """ insert (and update) the batch with one statement each """
+
+        existing = [record for record in batch if duplicates != 'keep' and
+                    self._connection.execute(
+                        'SELECT 1 FROM Show WHERE name = ? LIMIT 1',
+                        (record.name,)).fetchone()]
+        if existing and duplicates == 'error':
+            raise ValueError("Show '{}' already exists".format(
+                existing[0].name))
+        names = set(record.name for record in existing)
+        added = [(record.name, record.season, record.episode)
+                 for record in batch if record.name not in names]
+        self._connection.executemany(
+            'INSERT INTO Show (name, season, episode) VALUES (?, ?, ?)',
+            added)
+        if duplicates != 'replace':
+            return len(added)
+        self._connection.executemany(
+            'UPDATE Show SET season = ?, episode = ? WHERE name = ?',
+            [(record.season, record.episode, record.name)
+             for record in existing])
+        return len(added) + len(existing)
+
+    def _flush(self):
+        """ commit the changes """
+
+        with self._timed('commit'):
+            self._connection.commit()
+
+    def _discard(self):
+        """ roll the changes of a failed transaction back """
+
+        self._connection.rollback()
+
+
+def _save_manifest(manifestfile, starts, files):
+    """ write the manifest of a sharded showfile (atomically) """
+
+    import json
+
+    tmpfile = _tmpfile(manifestfile)
+    with open(tmpfile, 'w') as file:
+        json.dump({"version": 1, "shards": list(zip(starts, files))}, file,
+                  indent=1)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmpfile, manifestfile)
+
+
+def create_sharded(directory):
+    """ create an empty sharded showfile (a directory with one shard) """
+
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, 'shard-000000.xml'), 'w') as file:
+        file.write(EMPTY_XML)
+    _save_manifest(os.path.join(directory, MANIFEST), [''],
+                   ['shard-000000.xml'])
+
+
+class ShardedShowView(_BaseShowView):
+    """
+    the shows you're watching, split by name into xml shards in a
+    directory. Its manifest lists the first name every shard owns, a show
+    is only read from and written to the shard that owns its name.
+    """
+
+    def __init__(self, sourcefile, readonly=False, journal=False,
+                 hook=None, history=True, auto_refresh=None):
+        """
+        reads the manifest of the directory sourcefile. The shards are
+        ShowViews (with readonly, journal, hook and history) that are only
+        loaded
+        when a show of them is needed; shards that were only read are
+        streamed and not kept. auto_refresh works like for ShowView.
+        """
+
+        self.sourcefile = sourcefile
+        self.manifestfile = os.path.join(sourcefile, MANIFEST)
+        self.readonly = readonly
+        self.journal = journal
+        self.hook = hook
+        self.history = history
+        self.auto_refresh = auto_refresh
+        self._views = dict()
+        self._dirty = set()
+        self._read_manifest()
+
+    def _read_manifest(self):
+        """ read the shard starts and files from the manifest """
+
+        import json
+
+        stat = os.stat(self.manifestfile)
+        with open(self.manifestfile, 'r') as file:
+            shards = json.load(file)['shards']
+        self._manifest = stat.st_mtime_ns, stat.st_size, stat.st_ino
+        self._starts = [start for start, _ in shards]
+        self._files = [shard for _, shard in shards]
+
+    def _owner(self, name):
+        """ the index of the shard that owns name """
+
+        return bisect.bisect_right(self._starts, name) - 1
+
+    def _view(self, i, write=False):
+        """
+        the ShowView of shard i. For write it is loaded and kept until the
+        changes are written, otherwise a loaded one is reused or the shard
+        is opened read-only.
+        """
+
+        shard = self._files[i]
+        if shard in self._views:
+            return self._views[shard]
+        path = os.path.join(self.sourcefile, shard)
+        if not write:
+            return ShowView(path, readonly=True, hook=self.hook,
+                            history=self.history)
+        view = ShowView(path, journal=self.journal, hook=self.hook,
+                        history=self.history)
+        if self._batch_depth:
+            view._savepoint()
+        self._views[shard] = view
+        return view
+
+    def _change(self, name):
+        """ the loaded ShowView of the shard owning name, marked dirty """
+
+        self._check_writable()
+        i = self._owner(name)
+        self._dirty.add(self._files[i])
+        return self._view(i, write=True)
+
+    def get_shows(self, name=None):
+        """
+        returns all shows (or the ones starting with name) in name order,
+        shard after shard
+        """
+
+        self._check_refresh()
+        first = self._owner(name) if name else 0
+        for i in range(first, len(self._files)):
+            start = self._starts[i]
+            if i > first and name and not start.startswith(name):
+                break
+            end = self._starts[i + 1] if i + 1 < len(self._starts) else None
+            for show in self._view(i).get_shows(name):
+                # shows a crashed rebalance left behind belong to the next
+                # shard
+                if end is None or show['name'] < end:
+                    yield show
+
+    def get_show(self, name):
+        """ returns one show found by its name """
+
+        for show in self.get_shows(name):
+            return show
+        raise KeyError("No show found for name '{}'".format(name))
+
+    def add_show(self,
+                 show=None,
+                 name=None,
+                 season=None,
+                 episode=None):
+        """ create a show entry in the shard that owns its name """
+
+        if not (show or name):
+            raise LookupError("Name or show must be set")
+
+        view = self._change(str(name or show['name']))
+        return view.add_show(show, name, season, episode)
+
+    def set_show(self,
+                 show=None,
+                 name=None,
+                 season=None,
+                 episode=None,
+                 new_name=None):
+        """
+        update a show with new values, a new name owned by another shard
+        moves it there
+        """
+
+        show = self._show_to_set(show, name, season, episode, new_name)
+
+        view = self._change(show['name'])
+        if ('new_name' not in show or
+                self._owner(str(show['new_name'])) ==
+                self._owner(show['name'])):
+            view.set_show(show)
+            return
+
+        target = self._change(str(show['new_name']))
+        for moved in view._remove(show['name']):
+            record = target.add_show(
+                name=str(show['new_name']),
+                season=int(show.get('season', moved['season'])),
+                episode=int(show.get('episode', moved['episode'])))
+            if view.history is not None:
+                view._events.append(('rename', moved['name'],
+                                     record['name']))
+            if target.history is not None and (
+                    (record['season'], record['episode']) !=
+                    (moved['season'], moved['episode'])):
+                target._events.append(('set', record['name'],
+                                       record['season'], record['episode'],
+                                       int(time.time())))
+
+    def _import(self, batch, duplicates):
+        """ import the part of the sorted batch every shard owns """
+
+        count = 0
+        i = 0
+        while i < len(batch):
+            shard = self._owner(batch[i].name)
+            end = i + 1
+            while end < len(batch) and self._owner(batch[end].name) == shard:
+                end += 1
+            view = self._change(batch[i].name)
+            count += view._import(batch[i:end], duplicates)
+            i = end
+        return count
+
+    def _histories(self):
+        """ the WatchHistory of every shard """
+
+        return [self._view(i).history for i in range(len(self._files))
+                if self.history]
+
+    def _search(self, text):
+        """ the (rank, name) matches of text from the index of every shard """
+
+        results = []
+        for i in range(len(self._files)):
+            results.extend(self._view(i)._search(text))
+        return results
+
+    def _shows_named(self, names):
+        """ returns name -> [show], every name from the shard owning it """
+
+        shards = dict()
+        for name in names:
+            shards.setdefault(self._owner(name), set()).add(name)
+        shows = dict()
+        for i, shard_names in shards.items():
+            shows.update(self._view(i)._shows_named(shard_names))
+        return shows
+
+    def _flush(self):
+        """ write the shards that changed """
+
+        for shard in sorted(self._dirty):
+            self._views[shard].write_shows()
+        self._dirty.clear()
+
+    def _savepoint(self):
+        """ a savepoint in every loaded shard """
+
+        for view in self._views.values():
+            view._savepoint()
+
+    def _discard(self):
+        """
+        roll the loaded shards back to their savepoints (which cuts their
+        journals) and forget them
+        """
+
+        for view in self._views.values():
+            view._discard()
+        self._views.clear()
+        self._dirty.clear()
+
+    def refresh(self):
+        """
+        re-read the manifest if a rebalance changed it (loaded shards that
+        are no longer listed are dropped) and refresh the loaded shards,
+        returns the names of the added, removed and changed shows of them
+        """
+
+        diff = {"added": [], "removed": [], "changed": []}
+        stat = os.stat(self.manifestfile)
+        if (stat.st_mtime_ns, stat.st_size, stat.st_ino) != self._manifest:
+            self._read_manifest()
+            for shard in set(self._views) - set(self._files):
+                del self._views[shard]
+                self._dirty.discard(shard)
+        for shard in sorted(self._views):
+            for key, names in self._views[shard].refresh().items():
+                diff[key].extend(names)
+        return {key: sorted(names) for key, names in diff.items()}
+
+    def rebalance(self, shard_size=SHARD_SIZE):
+        """
+        split every shard with more than shard_size shows into shards of
+        (at most) shard_size shows, shows with the same name stay together.
+        The new shards and the manifest are written before the split shard
+        is shrunk. Returns the number of shards.
+        """
+
+        self._check_writable()
+        if self._batch_depth:
+            raise RuntimeError("rebalance inside a transaction")
+        with file_lock(self.manifestfile):
+            self.write_shows()
+            starts = []
+            files = []
+            shrunk = []
+            number = len(self._files)
+            for i, shard in enumerate(self._files):
+                view = self._view(i, write=True)
+                records = sorted(view._shows, key=lambda record: record.name)
+                chunks = []
+                begin = 0
+                while begin < len(records) or not chunks:
+                    end = min(begin + shard_size, len(records))
+                    while (end < len(records) and
+                           records[end].name == records[end - 1].name):
+                        end += 1
+                    chunks.append(records[begin:end])
+                    begin = end
+                starts.append(self._starts[i])
+                files.append(shard)
+                if len(chunks) > 1:
+                    shrunk.append((view, chunks[0]))
+                for chunk in chunks[1:]:
+                    while True:
+                        new_shard = 'shard-{:06}.xml'.format(number)
+                        number += 1
+                        path = os.path.join(self.sourcefile, new_shard)
+                        if not os.path.exists(path):
+                            break
+                    with open(path, 'wb') as file:
+                        write_xml(file, chunk)
+                        file.flush()
+                        os.fsync(file.fileno())
+                    starts.append(chunk[0].name)
+                    files.append(new_shard)
+            _save_manifest(self.manifestfile, starts, files)
+            for view, chunk in shrunk:
+                with file_lock(view.sourcefile):
+                    view._shows = chunk
+                    view._build_index()
+                    view._write()
+            self._read_manifest()
+            self._views.clear()
+        return len(files)
+
+
+class AsyncShowView():
+    """
+    ShowView for asyncio: every call of the showview runs in an executor
+    (loading a shard, a sqlite query or an auto_refresh can take a while),
+    writes that come in while one is pending are coalesced into one and a
+    lock keeps readers from seeing the shows while they are written
+    """
+
+    def __init__(self, sourcefile=SOURCE, executor=None, **kwargs):
+        """ call (and await) load before anything else """
+
+        import asyncio
+
+        self.sourcefile = sourcefile
+        self._executor = executor
+        self._kwargs = kwargs
+        self._showview = None
+        self._lock = asyncio.Lock()
+        self._flush_task = None
+
+    async def _in_executor(self, func, *args, **kwargs):
+        """ run func in the executor """
+
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(func, *args, **kwargs))
+
+    async def load(self):
+        """ read the showfile """
+
+        kwargs = dict(self._kwargs)
+        if _is_sqlite(self.sourcefile) and not _is_sharded(self.sourcefile):
+            # opened in the executor but used on the loop thread as well,
+            # the lock keeps the two from using it at the same time
+            kwargs['check_same_thread'] = False
+        async with self._lock:
+            self._showview = await self._in_executor(
+                open_showview, self.sourcefile, **kwargs)
+        return self
+
+    async def get_shows(self, name=None):
+        """
+        returns all shows (or the ones starting with name), fetched
+        ASYNC_CHUNK at a time. The lock is only held while a chunk is
+        fetched, so the loop may change shows; changes to shows that
+        weren't yielded yet may or may not show up.
+        """
+
+        # a generator, nothing runs before the first chunk is fetched
+        shows = self._showview.get_shows(name)
+        while True:
+            async with self._lock:
+                chunk = await self._in_executor(
+                    list, itertools.islice(shows, ASYNC_CHUNK))
+            for show in chunk:
+                yield show
+            if len(chunk) < ASYNC_CHUNK:
+                return
+
+    async def get_show(self, name):
+        """ returns one show found by its name """
 
-        self.sourcefile = sourcefile
-        self.tree = ET.parse(sourcefile)
-        self.root = self.tree.getroot()
+        async with self._lock:
+            return await self._in_executor(self._showview.get_show, name)
 
-    def get_shows(self, name=None):
-        """ returns all shows """
+    async def add_show(self, *args, **kwargs):
+        """ create a show entry, see ShowView.add_show """
 
-        for show in self.root.findall('Show'):
-            if (not name) or (show.find('Name').text.startswith(name)):
-                yield {"name": show.find('Name').text,
-                       "season": int(show.find('Season').text),
-                       "episode": int(show.find('Episode').text)}
+        async with self._lock:
+            return await self._in_executor(self._showview.add_show, *args,
+                                           **kwargs)
 
-    def get_show(self, name):
-        """ returns one show found by its name """
+    async def set_show(self, *args, **kwargs):
+        """ update a show with new values, see ShowView.set_show """
 
-        show = None
-        for _show in self.root.findall('Show'):
-            if _show.find('Name').text.startswith(name):
-                show = _show
-                break
-        else:
-            raise KeyError("No show found for name '{}'".format(name))
+        async with self._lock:
+            return await self._in_executor(self._showview.set_show, *args,
+                                           **kwargs)
 
-        return {"name": show.find('Name').text,
-                "season": int(show.find('Season').text),
-                "episode": int(show.find('Episode').text)}
+    async def import_shows(self, shows, duplicates='skip'):
+        """ add many shows and write them, see ShowView.import_shows """
 
-    def add_show(self,
-                 show=None,
-                 name=None,
-                 season=None,
-                 episode=None):
+        shows = list(shows)
+        async with self._lock:
+            return await self._in_executor(self._showview.import_shows,
+                                           shows, duplicates)
+
+    async def refresh(self):
+        """ catch up with other writers, see ShowView.refresh """
+
+        async with self._lock:
+            return await self._in_executor(self._showview.refresh)
+
+    async def write_shows(self):
         """
-        create a show entry and insert it at the right position
-        (alphabetically)
+        write the shows. Calls that come in before the write starts share
+        it, so N set_show + write_shows calls in a row write once.
         """
 
-        if not (show or name):
-            raise LookupError("Name or show must be set")
+        import asyncio
 
-        if not show:
-            show = dict()
+        if self._flush_task is None:
+            self._flush_task = asyncio.ensure_future(self._flush())
+        await asyncio.shield(self._flush_task)
 
-        if name:
-            show['name'] = name
-        if season:
-            show['season'] = season
-        else:
-            show['season'] = 0
-        if episode:
-            show['episode'] = episode
-        else:
-            show['episode'] = 0
+    async def _flush(self):
+        """ the coalesced write """
 
-        show_element = ET.Element('Show')
-        name_element = ET.SubElement(show_element, 'Name')
-        name_element.text = str(show['name'])
-        season_element = ET.SubElement(show_element, 'Season')
-        season_element.text = str(show['season'])
-        episode_element = ET.SubElement(show_element, 'Episode')
-        episode_element.text = str(show['episode'])
+        import asyncio
 
-        shownames = [show['name'] for show in self.get_shows()]
-        shownames.append(show['name'])
-        insert_index = sorted(shownames).index(show['name'])
-        self.root.insert(insert_index, show_element)
+        # give the other changes of this round a chance to join
+        await asyncio.sleep(0)
+        async with self._lock:
+            self._flush_task = None
+            await self._in_executor(self._showview.write_shows)
 
-        return show
 
-    def set_show(self,
-                 show=None,
-                 name=None,
-                 season=None,
-                 episode=None,
-                 new_name=None):
-        """ update a show with new values """
+def complete(prefix, showfile=SOURCE):
+    """
+    returns the names starting with prefix for shell completion. They come
+    from the names cache write_shows keeps next to the showfile, if the
+    cache is missing or older than the showfile the showfile is read.
+    """
 
-        if not (show or name):
-            raise LookupError("Name or show must be set")
+    namesfile = showfile + NAMES_SUFFIX
+    try:
+        fresh = (os.stat(namesfile).st_mtime_ns >=
+                 os.stat(showfile).st_mtime_ns)
+        with open(namesfile, 'rb') as file:
+            names = file.read().split(b'\n') if fresh else None
+    except OSError:
+        names = None
+    if names is None:
+        return [show['name'] for show in
+                open_showview(showfile, readonly=True).get_shows(prefix)]
 
-        if not show:
-            show = dict()
+    key = prefix.encode('utf-8')
+    i = bisect.bisect_left(names, key)
+    matches = []
+    while i < len(names) and names[i].startswith(key):
+        matches.append(names[i].decode('utf-8'))
+        i += 1
+    return matches
 
-        if name is not None:
-            show['name'] = name
-        if season is not None:
-            show['season'] = season
-        if episode is not None:
-            show['episode'] = episode
-        if new_name is not None:
-            show['new_name'] = new_name
 
-        for _show in self.root.findall('Show'):
-            if _show.find('Name').text == show['name']:
-                if 'new_name' in show:
-                    _show.find('Name').text = str(show['new_name'])
-                if 'season' in show:
-                    _show.find('Season').text = str(show['season'])
-                if 'episode' in show:
-                    _show.find('Episode').text = str(show['episode'])
+def _complete_main(argv):
+    """
+    --complete PREFIX [--showfile FILE] without argparse, every keystroke
+    of a shell completion runs this
+    """
 
-    def write_shows(self):
-        """ write the xml back to the file """
+    showfile = SOURCE
+    if '--showfile' in argv:
+        i = argv.index('--showfile')
+        showfile = argv[i + 1]
+        del argv[i:i + 2]
+    prefix = argv[0] if argv else ''
+    matches = complete(prefix, showfile)
+    if matches:
+        sys.stdout.write('\n'.join(matches) + '\n')
 
-        indent(self.root)
-        self.tree = ET.ElementTree(self.root)
-        self.tree.write(self.sourcefile)
 
+def _is_sqlite(showfile):
+    """ does showfile name a sqlite database? """
 
-def main():
-    """ this function gets called from the commandline """
+    return (showfile.startswith(SQLITE_SCHEME) or
+            showfile.endswith(SQLITE_SUFFIXES))
+
+
+def _is_sharded(showfile):
+    """ does showfile name a sharded showfile (a directory)? """
+
+    return os.path.isdir(showfile) or showfile.endswith(os.sep)
+
+
+def open_showview(showfile=SOURCE, **kwargs):
+    """
+    open showfile with the matching storage: sqlite for 'sqlite:PATH' or a
+    .db/.sqlite/.sqlite3 file, xml shards for a directory, xml otherwise
+    """
+
+    if _is_sharded(showfile):
+        return ShardedShowView(showfile, **kwargs)
+    if _is_sqlite(showfile):
+        return SQLiteShowView(_sqlite_path(showfile), **kwargs)
+    return ShowView(showfile, **kwargs)
+
+
+def _sqlite_path(showfile):
+    """ the database file of a sqlite showfile """
+
+    if showfile.startswith(SQLITE_SCHEME):
+        showfile = showfile[len(SQLITE_SCHEME):]
+        if showfile.startswith('//'):
+            showfile = showfile[2:]
+    return showfile
+
+
+def migrate(source, destination):
+    """
+    copy every show from the showfile source to the (new or empty) showfile
+    destination, both can be any storage open_showview knows. A sharded
+    destination (a directory, a new one ends with /) is split into shards
+    of SHARD_SIZE shows. Every show is copied, a second one of a name too.
+    A destination created here is removed again if the migration fails.
+    """
+
+    shows = open_showview(source, readonly=True).get_shows()
+    path = (_sqlite_path(destination) if _is_sqlite(destination)
+            else destination)
+    created = [file for file in _showfile_paths(path)
+               if not os.path.exists(file)]
+    target = None
+    try:
+        if _is_sharded(destination):
+            if not os.path.exists(os.path.join(destination, MANIFEST)):
+                create_sharded(destination)
+        elif not (_is_sqlite(destination) or os.path.exists(destination)):
+            with open(destination, 'w') as file:
+                file.write(EMPTY_XML)
+        target = open_showview(destination)
+        if next(target.get_shows(), None) is not None:
+            raise FileExistsError(
+                "'{}' already contains shows".format(destination))
+        target.import_shows(shows, duplicates='keep')
+        if isinstance(target, ShardedShowView):
+            target.rebalance()
+    except BaseException:
+        if isinstance(target, SQLiteShowView):
+            target.close()
+        _remove_paths(created)
+        raise
+    return target
+
+
+def _showfile_paths(path):
+    """ the showfile path and the files kept next to it """
+
+    return [path] + [path + suffix for suffix in (
+        '.journal', '.snapshot', '.lock', NAMES_SUFFIX, TRIGRAMS_SUFFIX,
+        HISTORY_SUFFIX, HISTORY_SUFFIX + NAMES_SUFFIX, '-wal', '-shm',
+        '-journal')]
+
+
+def _remove_paths(paths):
+    """ remove the files (and directories) of paths that exist """
+
+    import shutil
+
+    for path in paths:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+
+
+def _aggregate_files(showfiles):
+    """
+    the partial aggregate of a batch of showfiles (run in a worker):
+    (files, {name: files}, {name: {season: files}}). A show that is in a
+    file twice counts once, with its first season.
+    """
+
+    tracked = dict()
+    seasons = dict()
+    for showfile in showfiles:
+        seen = set()
+        for show in open_showview(showfile, readonly=True).get_shows():
+            name = show['name']
+            if name in seen:
+                continue
+            seen.add(name)
+            tracked[name] = tracked.get(name, 0) + 1
+            counts = seasons.setdefault(name, dict())
+            counts[show['season']] = counts.get(show['season'], 0) + 1
+    return len(showfiles), tracked, seasons
+
+
+def aggregate(showfiles, workers=None):
+    """
+    read many showfiles (one per user, any storage open_showview knows) and
+    sum them up: returns {"files": number of files, "tracked": {name:
+    files tracking the show}, "seasons": {name: {season: files at that
+    season}}}. The files are read in batches by a ProcessPoolExecutor of
+    workers processes (default: one per cpu, 1 reads them here), every
+    batch comes back as one partial aggregate that is merged in as soon
+    as it is done.
+    """
+
+    showfiles = list(showfiles)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    # a few batches per worker keep them busy when files differ in size
+    size = max(1, -(-len(showfiles) // (workers * 4)))
+    batches = [showfiles[i:i + size]
+               for i in range(0, len(showfiles), size)]
+    total = {"files": 0, "tracked": dict(), "seasons": dict()}
+    if workers == 1:
+        partials = map(_aggregate_files, batches)
+    else:
+        import concurrent.futures
+
+        executor = concurrent.futures.ProcessPoolExecutor(workers)
+        partials = (future.result() for future in
+                    concurrent.futures.as_completed(
+                        executor.submit(_aggregate_files, batch)
+                        for batch in batches))
+    try:
+        for files, tracked, seasons in partials:
+            total['files'] += files
+            for name, count in tracked.items():
+                total['tracked'][name] = total['tracked'].get(name, 0) + count
+            for name, counts in seasons.items():
+                merged = total['seasons'].setdefault(name, dict())
+                for season, count in counts.items():
+                    merged[season] = merged.get(season, 0) + count
+    finally:
+        if workers != 1:
+            executor.shutdown(cancel_futures=True)
+    return total
+
+
+def _expand_showfiles(patterns):
+    """
+    the showfiles matching the glob patterns, sorted per pattern (a
+    pattern that matches nothing is taken as it is)
+    """
+
+    import glob
+
+    showfiles = []
+    for pattern in patterns:
+        showfiles.extend(sorted(glob.glob(pattern)) or [pattern])
+    return showfiles
+
+
+def exchange_format(path):
+    """ the import/export format of path by its suffix: csv or jsonl """
+
+    suffix = os.path.splitext(path)[1].lower()
+    if suffix == '.csv':
+        return 'csv'
+    if suffix in ('.jsonl', '.ndjson') or path == '-':
+        return 'jsonl'
+    raise ValueError("Unknown format of '{}', use .csv or .jsonl".format(
+        path))
+
+
+def read_shows(file, fmt):
+    """
+    yields the shows in the csv (with a name, season, episode header) or
+    jsonl file one by one. Raises ValueError (with the line number) for a
+    line that isn't a show.
+    """
+
+    import json
+
+    if fmt == 'csv':
+        import csv
+
+        reader = csv.DictReader(file)
+        if reader.fieldnames is not None and 'name' not in reader.fieldnames:
+            raise ValueError("line 1: the csv header has no name column")
+        rows = ((reader.line_num, row) for row in reader)
+    else:
+        rows = ((number, line) for number, line in enumerate(file, 1)
+                if line.strip())
+    for number, row in rows:
+        try:
+            if fmt != 'csv':
+                row = json.loads(row)
+            if row['name'] is None:
+                raise KeyError('name')
+            show = {"name": row['name'],
+                    "season": int(row.get('season') or 0),
+                    "episode": int(row.get('episode') or 0)}
+        except KeyError:
+            raise ValueError("line {}: a show without a name".format(
+                number)) from None
+        except (ValueError, TypeError, AttributeError) as e:
+            raise ValueError("line {}: {}".format(number, e)) from e
+        yield show
+
+
+def _jsonl_lines(shows):
+    """
+    json.dumps(show) of every show dict, without the generic encoder (%
+    formatting is faster than format here)
+    """
+
+    import json.encoder
+
+    encode = json.encoder.encode_basestring_ascii
+    return ['{"name": %s, "season": %d, "episode": %d}' % (
+        encode(show['name']), show['season'], show['episode'])
+            for show in shows]
+
+
+def _tsv_escape(name):
+    """ name with backslashes, tabs and newlines escaped like \\t """
+
+    return name.replace('\\', '\\\\').replace('\t', '\\t').replace(
+        '\n', '\\n')
+
+
+def _tsv_lines(shows):
+    """
+    name, season and episode of every show separated by tabs, the names
+    escaped by _tsv_escape
+    """
+
+    names = [show['name'] for show in shows]
+    joined = ''.join(names)
+    if '\\' in joined or '\t' in joined or '\n' in joined:
+        names = [_tsv_escape(name) for name in names]
+    return ['%s\t%d\t%d' % (name, show['season'], show['episode'])
+            for name, show in zip(names, shows)]
+
+
+def dump_shows(file, shows, fmt):
+    """
+    write the shows to the file as csv, jsonl, json (one array) or tsv
+    (without a header), returns how many were written. The shows are
+    consumed lazily and written DUMP_CHUNK lines per write call.
+    """
+
+    count = 0
+    if fmt == 'csv':
+        import csv
+
+        writer = csv.writer(file)
+        writer.writerow(SHOW_FIELDS)
+        for show in shows:
+            writer.writerow([show[field] for field in SHOW_FIELDS])
+            count += 1
+        return count
+
+    lines = _tsv_lines if fmt == 'tsv' else _jsonl_lines
+    shows = iter(shows)
+    if fmt == 'json':
+        file.write('[')
+    while True:
+        chunk = lines(list(itertools.islice(shows, DUMP_CHUNK)))
+        if not chunk:
+            break
+        if fmt == 'json':
+            file.write((',\n' if count else '\n') + ',\n'.join(chunk))
+        else:
+            file.write('\n'.join(chunk) + '\n')
+        count += len(chunk)
+    if fmt == 'json':
+        file.write('\n]\n' if count else ']\n')
+    return count
+
+
+def _open_exchange(path, mode):
+    """ open path for read_shows/dump_shows, - is stdin/stdout """
+
+    if path == '-':
+        return contextlib.nullcontext(sys.stdin if mode == 'r' else
+                                      sys.stdout)
+    return open(path, mode, newline='', encoding='utf-8')
+
+
+def _build_parser():
+    """ the argument parser for the commandline """
+
+    import argparse
+
+    def count(value):
+        """ a number of shows, not negative """
+
+        number = int(value)
+        if number < 0:
+            raise argparse.ArgumentTypeError(
+                "must not be negative: {}".format(value))
+        return number
 
     ap = argparse.ArgumentParser()
     ap.add_argument('-n', '--name',
@@ -168,9 +2973,11 @@ def main():
                     action='store_true',
                     help='increase the season by one')
     ap.add_argument('-se', '--setepisode',
+                    type=int,
                     help='set the new episode value',
                     metavar='INTEGER')
     ap.add_argument('-ss', '--setseason',
+                    type=int,
                     help='set the new season value',
                     metavar='INTEGER')
     ap.add_argument('-as', '--addshow',
@@ -179,18 +2986,167 @@ def main():
                     '{name=SHOW, season=0, episode=0}')
     ap.add_argument('--showfile',
                     default=SOURCE,
-                    help='the xmlfile with the shows')
+                    help='the xmlfile with the shows (sqlite:PATH or a '
+                    '.db/.sqlite/.sqlite3 file for a sqlite database)')
+    ap.add_argument('--migrate',
+                    help='copy every show from the showfile to the new '
+                    'showfile DEST (xml or sqlite) and exit',
+                    metavar='DEST')
+    ap.add_argument('--search',
+                    help='list the shows whose name contains TEXT or is '
+                    'similar to it, best matches first',
+                    metavar='TEXT')
+    ap.add_argument('--format',
+                    choices=LISTING_FORMATS,
+                    default='text',
+                    help='how shows (and -n) are listed: aligned text '
+                    '(default), a json array, json lines or tab separated '
+                    'values')
+    ap.add_argument('--limit',
+                    type=count,
+                    help='list at most N shows',
+                    metavar='N')
+    ap.add_argument('--offset',
+                    type=count,
+                    default=0,
+                    help='skip the first N shows of a listing',
+                    metavar='N')
+    ap.add_argument('--per-month',
+                    action='store_true',
+                    help='print the episodes watched per show and month '
+                    'from the watch history (as text, paged by --limit '
+                    'and --offset)')
+    ap.add_argument('--untouched',
+                    nargs='?',
+                    type=int,
+                    const=90,
+                    help='list the shows not watched in the last DAYS '
+                    '(default: 90)',
+                    metavar='DAYS')
+    ap.add_argument('--rebalance',
+                    nargs='?',
+                    type=int,
+                    const=SHARD_SIZE,
+                    help='split the shards of a sharded showfile (a '
+                    'directory) with more than N shows (default: '
+                    '{}) and exit'.format(SHARD_SIZE),
+                    metavar='N')
+    ap.add_argument('--import',
+                    dest='import_file',
+                    help='add the shows from a .csv or .jsonl FILE (- for '
+                    'jsonl on stdin) and exit',
+                    metavar='FILE')
+    ap.add_argument('--export',
+                    help='write the shows (or the ones starting with SHOW) '
+                    'to a .csv or .jsonl FILE (- for jsonl on stdout) and '
+                    'exit',
+                    metavar='FILE')
+    ap.add_argument('--aggregate',
+                    nargs='+',
+                    help='count how many of the showfiles (or glob '
+                    'patterns of them, one per user) track each show and '
+                    'at which season, most tracked first, and exit',
+                    metavar='SHOWFILE')
+    ap.add_argument('--workers',
+                    type=count,
+                    help='the processes --aggregate reads with (default '
+                    'and 0: one per cpu)',
+                    metavar='N')
+    ap.add_argument('--duplicates',
+                    choices=DUPLICATES,
+                    default='skip',
+                    help='what --import does with shows that already exist '
+                    '(default: skip)')
+    ap.add_argument('--journal',
+                    action='store_true',
+                    help='append changes to a journal instead of rewriting '
+                    'the showfile every time')
+    ap.add_argument('--complete',
+                    help='print the names starting with PREFIX for shell '
+                    'completion (fastest as the first argument)',
+                    metavar='PREFIX')
+    ap.add_argument('--daemon',
+                    action='store_true',
+                    help='keep the showfile loaded and answer the calls of '
+                    'this command on a unix socket next to it')
+    ap.add_argument('--profile',
+                    nargs='?',
+                    const='',
+                    help='print the time spent in every phase to stderr, '
+                    'or with FILE dump cProfile stats to it',
+                    metavar='FILE')
+    ap.add_argument('--batch',
+                    type=argparse.FileType('r'),
+                    help='read one command per line (the same arguments '
+                    'as on the commandline) from FILE or - for stdin and '
+                    'write the file once at the end',
+                    metavar='FILE')
     ap.add_argument('show',
                     nargs='?',
                     help='select a single show (or the name for --addshow)',
                     metavar='SHOW')
-    args = ap.parse_args()
+    return ap
+
+
+def _is_mutating(args):
+    """ does the command change the showfile? """
+
+    return bool(args.addshow or
+                args.setepisode is not None or args.setseason is not None or
+                args.incepisode or args.incseason or
+                args.decepisode or args.decseason)
+
+
+def _page(shows, args):
+    """
+    the shows from args.offset on, at most args.limit of them. The shows
+    are only consumed as far as the page goes.
+    """
+
+    stop = None if args.limit is None else args.offset + args.limit
+    return itertools.islice(shows, args.offset, stop)
+
 
-    showview = ShowView(args.showfile)
+def _list_shows(shows, args):
+    """ print the page of shows in args.format """
+
+    shows = _page(shows, args)
+    if args.format != 'text':
+        dump_shows(sys.stdout, shows, args.format)
+        return
+    for show in shows:
+        print("{:40} {:2} - {:2}".format(show["name"],
+                                         show["season"],
+                                         show["episode"]))
+
+
+def _run(showview, args):
+    """ run one parsed command against showview """
 
     try:
+        if args.search is not None:
+            _list_shows(showview.search(args.search), args)
+            return
+
+        if args.per_month:
+            if args.format != 'text':
+                raise ValueError("--per-month is only listed as text, "
+                                 "not --format {}".format(args.format))
+            for (name, month), total in _page(sorted(
+                    showview.watched_per_month().items(),
+                    key=lambda item: (item[0][1], item[0][0])), args):
+                print("{} {:40} {:3}".format(month, name, total))
+            return
+
+        if args.untouched is not None:
+            _list_shows(showview.untouched(args.untouched), args)
+            return
+
         if args.name:
-            for show in showview.get_shows(args.show):
+            if args.format != 'text':
+                _list_shows(showview.get_shows(args.show), args)
+                return
+            for show in _page(showview.get_shows(args.show), args):
                 print(show["name"])
             return
 
@@ -198,46 +3154,386 @@ def main():
 
             if args.addshow:
                 show = showview.add_show(name=args.show)
-                showview.write_shows()
             else:
                 show = showview.get_show(args.show)
 
-            if args.setepisode:
+            if args.setepisode is not None:
                 show['episode'] = args.setepisode
                 showview.set_show(show)
-                showview.write_shows()
-            if args.setseason:
+            if args.setseason is not None:
                 show['season'] = args.setseason
                 showview.set_show(show)
-                showview.write_shows()
             if args.incepisode:
                 show['episode'] += 1
                 showview.set_show(show)
-                showview.write_shows()
             if args.incseason:
                 show['season'] += 1
                 showview.set_show(show)
-                showview.write_shows()
             if args.decepisode:
                 show['episode'] -= 1
                 showview.set_show(show)
-                showview.write_shows()
             if args.decseason:
                 show['season'] -= 1
                 showview.set_show(show)
+            if _is_mutating(args):
                 showview.write_shows()
 
-            print("{:40} {:2} - {:2}".format(show["name"],
-                                             show["season"],
-                                             show["episode"]))
+            _list_shows([show], args)
         else:
-            for show in showview.get_shows():
-                print("{:40} {:2} - {:2}".format(show["name"],
-                                                 show["season"],
-                                                 show["episode"]))
-    except KeyError as e:
+            _list_shows(showview.get_shows(), args)
+    except (KeyError, ValueError) as e:
         print(e)
 
 
+def _print_aggregate(total, args):
+    """
+    print the page of the shows of an aggregate, most tracked first, in
+    args.format
+    """
+
+    import json
+
+    rows = _page(sorted(total['tracked'].items(),
+                        key=lambda item: (-item[1], item[0])), args)
+    rows = [{"name": name, "files": files,
+             "seasons": {str(season): count for season, count in
+                         sorted(total['seasons'][name].items())}}
+            for name, files in rows]
+    if args.format == 'json':
+        print(json.dumps({"files": total['files'], "shows": rows},
+                         indent=1))
+        return
+    for row in rows:
+        seasons = ' '.join('{}:{}'.format(season, count)
+                           for season, count in row['seasons'].items())
+        if args.format == 'jsonl':
+            print(json.dumps(row))
+        elif args.format == 'tsv':
+            print('{}\t{}\t{}'.format(_tsv_escape(row['name']), row['files'],
+                                      seasons))
+        else:
+            print("{:40} {:5}  {}".format(row['name'], row['files'],
+                                         seasons))
+
+
+def _unsupported(ap, args, allowed=()):
+    """
+    the options (except allowed, by dest) given in args that _run
+    doesn't handle, they only work on the commandline itself
+    """
+
+    return [max(action.option_strings, key=len) for action in ap._actions
+            if action.dest in _MAIN_ONLY and action.dest not in allowed and
+            getattr(args, action.dest) != action.default]
+
+
+def _run_batch(showview, ap, lines):
+    """
+    run every command in lines (one per line, # starts a comment) with a
+    single write at the end. A line that isn't valid (or has an option
+    that doesn't work in a batch) fails the batch before anything is
+    written.
+    """
+
+    with showview.transaction():
+        for number, line in enumerate(lines, 1):
+            argv = shlex.split(line, comments=True)
+            if not argv:
+                continue
+            args = ap.parse_args(argv)
+            unsupported = _unsupported(ap, args)
+            if unsupported:
+                ap.error("line {}: {} can't be used in a batch".format(
+                    number, ', '.join(unsupported)))
+            _run(showview, args)
+
+
+class ShowViewDaemon():
+    """
+    keeps a showfile loaded and runs commandline requests against it on the
+    unix socket showfile + '.sock'. Changes are written at most every
+    flush_interval seconds and when the daemon stops.
+    """
+
+    def __init__(self, showfile=SOURCE, flush_interval=DAEMON_FLUSH,
+                 **kwargs):
+        import socketserver
+
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            """ answers one request: a line of commandline arguments """
+
+            def handle(self):
+                line = self.rfile.readline().decode('utf-8')
+                self.wfile.write(daemon.execute(line).encode('utf-8'))
+
+        class Server(socketserver.UnixStreamServer):
+            """ flushes between requests """
+
+            def service_actions(self):
+                daemon.service_actions()
+
+        self.showview = open_showview(showfile, **kwargs)
+        self.parser = _build_parser()
+        self.flush_interval = flush_interval
+        self.last_flush = time.monotonic()
+        self.showview.begin()
+        self.socketfile = showfile + SOCKET_SUFFIX
+        if os.path.exists(self.socketfile) and _daemon_request(
+                showfile, ['-n']) is None:
+            # left over from a daemon that didn't stop cleanly
+            os.remove(self.socketfile)
+        self.server = Server(self.socketfile, Handler)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server_close()
+
+    def execute(self, line):
+        """ run one request and return its output """
+
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output), \
+                contextlib.redirect_stderr(output):
+            try:
+                args = self.parser.parse_args(shlex.split(line))
+                # main sends the showfile the daemon is for along
+                unsupported = _unsupported(self.parser, args, ('showfile',))
+                if unsupported:
+                    print("{} can't be sent to the daemon".format(
+                        ', '.join(unsupported)))
+                else:
+                    self.showview.refresh()
+                    _run(self.showview, args)
+            except SystemExit:
+                pass
+        return output.getvalue()
+
+    def flush(self):
+        """ write the pending changes """
+
+        self.showview.commit()
+        self.showview.begin()
+        self.last_flush = time.monotonic()
+
+    def service_actions(self):
+        """ flush if there are changes older than flush_interval """
+
+        if (self.showview._pending_write and
+                time.monotonic() - self.last_flush >= self.flush_interval):
+            self.flush()
+
+    def serve_forever(self, poll_interval=0.5):
+        """ answer requests until shutdown """
+
+        self.server.serve_forever(poll_interval)
+
+    def shutdown(self):
+        """ stop serve_forever (from another thread) """
+
+        self.server.shutdown()
+
+    def server_close(self):
+        """ close the socket and write the pending changes """
+
+        self.server.server_close()
+        self.showview.commit()
+        if os.path.exists(self.socketfile):
+            os.remove(self.socketfile)
+
+
+def _daemon_request(showfile, argv):
+    """
+    send argv to the daemon for showfile and return its output, or None if
+    no daemon is running. Once connected the daemon may already have run
+    the request, so errors after that (like a timeout) are raised instead.
+    """
+
+    import socket
+
+    socketfile = showfile + SOCKET_SUFFIX
+    if not os.path.exists(socketfile):
+        return None
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(DAEMON_TIMEOUT)
+        try:
+            client.connect(socketfile)
+        except OSError:
+            return None
+        client.sendall((shlex.join(argv) + '\n').encode('utf-8'))
+        client.shutdown(socket.SHUT_WR)
+        with client.makefile('rb') as response:
+            return response.read().decode('utf-8')
+
+
+def _phase_collector(phases):
+    """ a hook that sums up time, calls and scanned shows per phase """
+
+    def hook(phase, seconds, scanned):
+        total = phases.setdefault(phase, [0.0, 0, 0])
+        total[0] += seconds
+        total[1] += 1
+        total[2] += scanned
+    return hook
+
+
+def _print_phases(phases):
+    """ print the per-phase breakdown of --profile to stderr """
+
+    print("{:10} {:>10} {:>6} {:>8}".format('phase', 'ms', 'calls',
+                                             'scanned'),
+          file=sys.stderr)
+    for phase, (seconds, calls, scanned) in phases.items():
+        print("{:10} {:10.3f} {:6} {:8}".format(phase, seconds * 1000,
+                                                 calls, scanned),
+              file=sys.stderr)
+
+
+def _write_lock(showfile):
+    """
+    the lock a command that changes showfile holds from reading to writing
+    it (sqlite locks itself)
+    """
+
+    if _is_sqlite(showfile):
+        return contextlib.nullcontext()
+    if _is_sharded(showfile):
+        return file_lock(os.path.join(showfile, MANIFEST))
+    return file_lock(showfile)
+
+
+def _main(ap, args, hook):
+    """ run the parsed commandline """
+
+    if args.migrate:
+        try:
+            migrate(args.showfile, args.migrate)
+        except (ValueError, OSError) as e:
+            ap.error(e)
+        return
+
+    if args.rebalance is not None:
+        if not _is_sharded(args.showfile):
+            ap.error("--rebalance needs a sharded showfile (a directory)")
+        with _write_lock(args.showfile):
+            count = open_showview(args.showfile, hook=hook).rebalance(
+                args.rebalance)
+        print("{} shards".format(count))
+        return
+
+    if args.aggregate:
+        _print_aggregate(aggregate(_expand_showfiles(args.aggregate),
+                                   args.workers or None), args)
+        return
+
+    if args.export:
+        try:
+            fmt = exchange_format(args.export)
+        except ValueError as e:
+            ap.error(e)
+        showview = open_showview(args.showfile, readonly=True, hook=hook)
+        shows = iter(showview.get_shows(args.show))
+        # a readonly showfile is streamed, so an unreadable one only fails
+        # on the first show, before the export is truncated
+        first = next(shows, None)
+        if first is not None:
+            shows = itertools.chain((first,), shows)
+        with _open_exchange(args.export, 'w') as file:
+            dump_shows(file, shows, fmt)
+        return
+
+    if args.import_file:
+        try:
+            fmt = exchange_format(args.import_file)
+            with _open_exchange(args.import_file, 'r') as file, \
+                    _write_lock(args.showfile):
+                showview = open_showview(args.showfile,
+                                         journal=args.journal,
+                                         hook=hook)
+                count = showview.import_shows(read_shows(file, fmt),
+                                              args.duplicates)
+        except ValueError as e:
+            print(e)
+            return
+        print("{} shows imported".format(count))
+        return
+
+    if args.batch:
+        with args.batch, _write_lock(args.showfile):
+            _run_batch(open_showview(args.showfile,
+                                     journal=args.journal,
+                                     hook=hook),
+                       ap, args.batch)
+        return
+
+    if not _is_mutating(args):
+        _run(open_showview(args.showfile, readonly=True, hook=hook), args)
+        return
+
+    with _write_lock(args.showfile):
+        showview = open_showview(args.showfile,
+                                 journal=args.journal,
+                                 hook=hook)
+        _run(showview, args)
+
+
+def main():
+    """ this function gets called from the commandline """
+
+    if sys.argv[1:2] == ['--complete']:
+        _complete_main(sys.argv[2:])
+        return
+
+    ap = _build_parser()
+    args = ap.parse_args()
+
+    if args.complete is not None:
+        _complete_main([args.complete, '--showfile', args.showfile])
+        return
+
+    if args.daemon:
+        # stop (and flush) on SIGTERM like on ^C
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        with ShowViewDaemon(args.showfile, journal=args.journal) as daemon:
+            try:
+                daemon.serve_forever()
+            except KeyboardInterrupt:
+                pass
+        return
+
+    if not (args.batch or args.migrate or args.import_file or
+            args.export or args.rebalance is not None or args.aggregate or
+            args.profile is not None):
+        argv = [arg for arg in sys.argv[1:] if arg != '--journal']
+        try:
+            output = _daemon_request(args.showfile, argv)
+        except OSError as e:
+            ap.error("the daemon didn't answer: {}".format(e))
+        if output is not None:
+            print(output, end='')
+            return
+
+    if not args.profile:
+        phases = dict()
+        hook = None if args.profile is None else _phase_collector(phases)
+        _main(ap, args, hook)
+        if hook is not None:
+            _print_phases(phases)
+        return
+
+    import cProfile
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        _main(ap, args, None)
+    finally:
+        profiler.disable()
+        profiler.dump_stats(args.profile)
+
+
 if __name__ == '__main__':
     main()
@@ -2,14 +2,27 @@
 tests for showview
 """
 
+import asyncio
+import contextlib
+import io
+import importlib.util
+import json
+import os
+import socket
+import sqlite3
 import sys
 import shutil
 import tempfile
-from unittest import TestCase
+import threading
+from unittest import IsolatedAsyncioTestCase, TestCase, skipUnless
 from unittest.mock import patch, call
 import xml.etree.ElementTree as ET
 
-from showview import ShowView, main
+import showview
+from showview import (HISTORY_RECORD, AsyncShowView, ShardedShowView, Show,
+                      ShowView, ShowViewDaemon, SQLiteShowView, _etree,
+                      aggregate, complete, dump_shows, file_lock, indent,
+                      main, migrate, open_showview, write_xml)
 
 TESTXML = './test.xml'
 
@@ -153,9 +166,108 @@ class TestInsertShow(SimpleTestCase):
         print(shows)
         shows_new = list(self.showview.get_shows())
         print(shows_new)
-        print(ET.tostring(self.showview.root))
+        print(showview._etree().tostring(self.showview.root))
         self.assertEqual(shows, shows_new)
 
+    def test_insert_show_is_indexed(self):
+        """ a new show can be found by name and prefix """
+
+        self.showview.add_show(name='test15', season=3, episode=4)
+        self.assertEqual(self.showview.get_show('test15'),
+                         {"name": "test15", "season": 3, "episode": 4})
+        self.assertEqual(self.showview.get_show('test1'),
+                         {"name": "test1", "season": 1, "episode": 1})
+        self.assertEqual([show.find('Name').text
+                          for show in self.showview.root],
+                         ['test1', 'test15', 'test2'])
+
+
+class TestIndex(SimpleTestCase):
+    """ test the name index """
+
+    def test_prefix_lookup(self):
+        """ a prefix returns the first show in name order """
+
+        self.assertEqual(self.showview.get_show('test')['name'], 'test1')
+
+    def test_rename_updates_index(self):
+        """ after a rename only the new name can be found """
+
+        self.showview.set_show(name='test2', new_name='a_test')
+        self.assertEqual(self.showview.get_show('a_')['name'], 'a_test')
+        self.assertEqual(self.showview.get_show('test')['name'], 'test1')
+        with self.assertRaises(KeyError):
+            self.showview.get_show('test2')
+
+    def test_prefix_range(self):
+        """ a prefix query returns only the matching shows in name order """
+
+        self.showview.add_show(name='test10')
+        self.showview.add_show(name='other')
+        self.assertEqual([show['name']
+                          for show in self.showview.get_shows('test1')],
+                         ['test1', 'test10'])
+
+
+class TestShowRecord(SimpleTestCase):
+    """ test the compact Show records """
+
+    def test_records(self):
+        """ the shows are kept as Show records with int fields """
+
+        self.assertEqual([(show.name, show.season, show.episode)
+                          for show in self.showview._shows],
+                         [('test1', 1, 1), ('test2', 10, 10)])
+        with self.assertRaises(AttributeError):
+            Show('test').rating = 5
+
+    def test_set_string_value(self):
+        """ values from the commandline are stored as int """
+
+        self.showview.set_show(name='test1', season='3', episode='4')
+        self.assertEqual(self.showview.get_show('test1'),
+                         {"name": "test1", "season": 3, "episode": 4})
+
+    def test_root(self):
+        """ root still builds the xml of the shows """
+
+        root = self.showview.root
+        self.assertEqual(root.tag, 'DocumentElement')
+        self.assertEqual([show.find('Name').text for show in root],
+                         ['test1', 'test2'])
+
+
+class TestReadOnly(TestCase):
+    """ test the streaming read-only mode """
+
+    def setUp(self):
+        """ open the xmlfile read-only """
+        self.showview = ShowView(TESTXML, readonly=True)
+
+    def test_return_all_shows(self):
+        """ streaming returns the same shows as a full parse """
+
+        self.assertEqual(list(self.showview.get_shows()),
+                         list(ShowView(TESTXML).get_shows()))
+
+    def test_return_one_show(self):
+        """ get one show and a missing one """
+
+        self.assertEqual(self.showview.get_show('test2'),
+                         {"name": "test2", "season": 10, "episode": 10})
+        with self.assertRaises(KeyError):
+            self.showview.get_show('NotExisting')
+
+    def test_no_changes(self):
+        """ every change raises """
+
+        with self.assertRaises(RuntimeError):
+            self.showview.add_show(name='test0')
+        with self.assertRaises(RuntimeError):
+            self.showview.set_show(name='test1', episode=2)
+        with self.assertRaises(RuntimeError):
+            self.showview.write_shows()
+
 
 class TestWrite(TestCaseWithTempDir):
     """ test the writing to a file """
@@ -170,13 +282,1510 @@ class TestWrite(TestCaseWithTempDir):
         show['episode'] += 1
         self.showview.set_show(show)
         self.showview.write_shows()
-        xml_expected = ET.tostring(self.showview.root).decode()
+        xml_expected = showview._etree().tostring(
+            self.showview.root).decode()
         with open(self.tmpxml, 'r') as file:
             xml_after = ''.join(file.readlines())
 
         self.assertNotEqual(xml_before, xml_after)
 
         self.assertEqual(xml_expected, xml_after)
+        self.assertEqual(sorted(os.listdir(self.tempfolder)),
+                         ['test.xml', 'test.xml.history',
+                          'test.xml.history.names', 'test.xml.lock',
+                          'test.xml.names', 'test.xml.snapshot'])
+
+
+    def test_keep_declaration(self):
+        """ the xml declaration is written back """
+
+        with open(self.tmpxml, 'r') as file:
+            xml = file.read()
+        declaration = '<?xml version="1.0" encoding="utf-8"?>'
+        with open(self.tmpxml, 'w') as file:
+            file.write(declaration + '\n' + xml)
+        showview = ShowView(self.tmpxml)
+        showview.set_show(name='test1', episode=2)
+        showview.write_shows()
+        with open(self.tmpxml, 'r') as file:
+            self.assertTrue(file.read().startswith(declaration + '\n<'))
+        self.assertTrue(ShowView(self.tmpxml)._is_canonical())
+        self.assertEqual(ShowView(self.tmpxml).get_show('test1')['episode'],
+                         2)
+
+    def test_unknown_content(self):
+        """ a file with content write_xml would drop isn't rewritten """
+
+        with open(self.tmpxml, 'r') as file:
+            xml = file.read()
+        for old, new in (('<Episode>', '<Rating>5</Rating><Episode>'),
+                         ('<Show>', '<Show id="7">'),
+                         ('<DocumentElement>',
+                          '<DocumentElement version="2">'),
+                         ('<Show>', '<!-- a comment --><Show>'),
+                         ('</Show>', '</Show>text'),
+                         ('<DocumentElement>',
+                          '<!DOCTYPE DocumentElement>\n<DocumentElement>')):
+            with open(self.tmpxml, 'w') as file:
+                file.write(xml.replace(old, new, 1))
+            showview = ShowView(self.tmpxml)
+            showview.set_show(name='test1', episode=3)
+            with self.assertRaises(ValueError):
+                showview.write_shows()
+            with open(self.tmpxml, 'r') as file:
+                self.assertEqual(file.read(), xml.replace(old, new, 1))
+
+    def test_main_unknown_content(self):
+        """ the commandline reports a file it can't rewrite """
+
+        with open(self.tmpxml, 'r') as file:
+            xml = file.read()
+        with open(self.tmpxml, 'w') as file:
+            file.write(xml.replace('<Episode>', '<Rating>5</Rating><Episode>'))
+        sys.argv = ['showview.py', '--showfile', self.tmpxml, 'test1', '-ie']
+        output = io.StringIO()
+        with patch('sys.stdout', output):
+            main()
+        self.assertIn('<Rating>', output.getvalue())
+
+
+class TestTransaction(TestCaseWithTempDir):
+    """ test batching changes into a single write """
+
+    def read_xml(self):
+        """ the current content of the xml file """
+        with open(self.tmpxml, 'r') as file:
+            return file.read()
+
+    def test_single_write(self):
+        """ the file is only written when the transaction ends """
+
+        xml_before = self.read_xml()
+        with self.showview.transaction():
+            self.showview.add_show(name='test0')
+            self.showview.write_shows()
+            self.showview.set_show(name='test0', episode=5)
+            self.showview.write_shows()
+            self.assertEqual(self.read_xml(), xml_before)
+        self.assertEqual(ShowView(self.tmpxml).get_show('test0'),
+                         {"name": "test0", "season": 0, "episode": 5})
+
+    def test_no_write_on_error(self):
+        """ nothing is written if the transaction fails """
+
+        xml_before = self.read_xml()
+        with self.assertRaises(KeyError):
+            with self.showview.transaction():
+                self.showview.add_show(name='test0')
+                self.showview.write_shows()
+                self.showview.get_show('NotExisting')
+        self.assertEqual(self.read_xml(), xml_before)
+
+    def fail_transaction(self, showview):
+        """ change test1 and add test0 in a transaction that raises """
+        with self.assertRaises(KeyError):
+            with showview.transaction():
+                showview.set_show(name='test1', episode=9)
+                showview.add_show(name='test0')
+                showview.write_shows()
+                showview.get_show('NotExisting')
+
+    def test_rollback(self):
+        """ a later write doesn't carry the changes of a failed one """
+
+        xml_before = self.read_xml()
+        for journal in (False, True):
+            showview = ShowView(self.tmpxml, journal=journal)
+            self.fail_transaction(showview)
+            self.assertEqual(showview.get_show('test1')['episode'], 1)
+            self.assertRaises(KeyError, showview.get_show, 'test0')
+            showview.add_show(name='test3')
+            showview.write_shows()
+            reloaded = ShowView(self.tmpxml, journal=journal)
+            self.assertEqual(reloaded.get_show('test1')['episode'], 1)
+            self.assertEqual([show['name'] for show in
+                              reloaded.get_shows()],
+                             ['test1', 'test2', 'test3'])
+            with open(self.tmpxml, 'w') as file:
+                file.write(xml_before)
+
+    def test_rollback_journal_appended(self):
+        """ records another process appended since stay in the journal """
+
+        showview = ShowView(self.tmpxml, journal=True)
+        other = ShowView(self.tmpxml, journal=True)
+        with self.assertRaises(KeyError):
+            with showview.transaction():
+                showview.set_show(name='test1', episode=9)
+                showview.add_show(name='test0')
+                other.set_show(name='test2', episode=3)
+                showview.get_show('NotExisting')
+        reloaded = ShowView(self.tmpxml, journal=True)
+        self.assertEqual(list(reloaded.get_shows()),
+                         [{"name": "test1", "season": 1, "episode": 1},
+                          {"name": "test2", "season": 10, "episode": 3}])
+
+    def test_rollback_sharded(self):
+        """ the journals of the shards are cut off as well """
+
+        sharddir = os.path.join(self.tempfolder, 'shows')
+        migrate(self.tmpxml, sharddir + os.sep).rebalance(1)
+        self.fail_transaction(ShardedShowView(sharddir, journal=True))
+        self.assertEqual(list(ShardedShowView(sharddir).get_shows()),
+                         list(ShowView(self.tmpxml).get_shows()))
+
+    def test_commit_without_begin(self):
+        """ commit needs a begin """
+
+        with self.assertRaises(RuntimeError):
+            self.showview.commit()
+
+    @patch('builtins.print')
+    def test_main_batch(self, mock_print):
+        """ run several commands from a batch file """
+
+        batchfile = self.tempfolder + '/batch.txt'
+        with open(batchfile, 'w') as file:
+            file.write('# add a show\n'
+                       '"test 3" -as\n'
+                       '\n'
+                       'test1 -ie\n'
+                       '"test 3" -se 4\n')
+        sys.argv = ['showview.py', '--showfile', self.tmpxml,
+                    '--batch', batchfile]
+        main()
+        expected = [call('test 3                                    0 -  0'),
+                    call('test1                                     1 -  2'),
+                    call('test 3                                    0 -  4')]
+        self.assertEqual(mock_print.mock_calls, expected)
+        self.assertEqual(list(ShowView(self.tmpxml).get_shows()),
+                         [{"name": "test 3", "season": 0, "episode": 4},
+                          {"name": "test1", "season": 1, "episode": 2},
+                          {"name": "test2", "season": 10, "episode": 10}])
+
+    def test_main_batch_unsupported(self):
+        """ an option only the commandline handles fails the batch """
+
+        batchfile = self.tempfolder + '/batch.txt'
+        xml_before = self.read_xml()
+        for line in ('--import shows.csv', '--showfile other.xml',
+                     '--migrate other.db', 'test1 --journal'):
+            with open(batchfile, 'w') as file:
+                file.write('test1 -ie\n' + line + '\n')
+            sys.argv = ['showview.py', '--showfile', self.tmpxml,
+                        '--batch', batchfile]
+            with patch('sys.stdout', io.StringIO()), \
+                    patch('sys.stderr', io.StringIO()) as stderr, \
+                    self.assertRaises(SystemExit):
+                main()
+            self.assertIn("line 2: --{} can't be used in a batch".format(
+                line.split('--')[1].split()[0]), stderr.getvalue())
+            self.assertEqual(self.read_xml(), xml_before)
+
+
+class TestJournal(TestCaseWithTempDir):
+    """ test the append-only journal """
+
+    def setUp(self):
+        super().setUp()
+        self.showview = ShowView(self.tmpxml, journal=True)
+        with open(self.tmpxml, 'r') as file:
+            self.xml_before = file.read()
+
+    def read_xml(self):
+        """ the current content of the xml file """
+        with open(self.tmpxml, 'r') as file:
+            return file.read()
+
+    def test_changes_are_replayed(self):
+        """ changes go to the journal and are replayed on load """
+
+        self.showview.add_show(name='test0', season=2)
+        self.showview.set_show(name='test1', episode=7)
+        self.showview.set_show(name='test2', new_name='test3')
+        self.showview.write_shows()
+        self.assertEqual(self.read_xml(), self.xml_before)
+
+        expected = [{"name": "test0", "season": 2, "episode": 0},
+                    {"name": "test1", "season": 1, "episode": 7},
+                    {"name": "test3", "season": 10, "episode": 10}]
+        self.assertEqual(list(ShowView(self.tmpxml).get_shows()), expected)
+        self.assertEqual(
+            list(ShowView(self.tmpxml, readonly=True).get_shows()), expected)
+
+    def test_torn_record(self):
+        """ a half written record is ignored """
+
+        self.showview.set_show(name='test1', episode=7)
+        with open(self.showview.journalfile, 'a') as file:
+            file.write('{"op": "set", "name": "te')
+        self.assertEqual(ShowView(self.tmpxml).get_show('test1'),
+                         {"name": "test1", "season": 1, "episode": 7})
+
+    def test_duplicate_add(self):
+        """ a second show of a name is replayed as well """
+
+        self.showview.add_show(name='test1', season=2)
+        self.showview.write_shows()
+        shows = list(self.showview.get_shows())
+        self.assertEqual(len(shows), 3)
+        self.assertEqual(list(ShowView(self.tmpxml).get_shows()), shows)
+
+    def test_journal_of_old_file(self):
+        """ a journal left over from an interrupted rewrite is skipped """
+
+        self.showview.add_show(name='test0')
+        # the new file is in place, but the journal wasn't removed
+        with open(self.tmpxml, 'wb') as file:
+            write_xml(file, self.showview._shows)
+        self.assertEqual([show['name'] for show in
+                          ShowView(self.tmpxml).get_shows()],
+                         ['test0', 'test1', 'test2'])
+
+    @patch('showview.JOURNAL_LIMIT', 1)
+    def test_compact(self):
+        """ the journal is folded into the xml file when it's too big """
+
+        self.showview.set_show(name='test1', episode=7)
+        self.showview.write_shows()
+        self.assertNotEqual(self.read_xml(), self.xml_before)
+        self.assertFalse(os.path.exists(self.showview.journalfile))
+        self.assertEqual(ShowView(self.tmpxml).get_show('test1'),
+                         {"name": "test1", "season": 1, "episode": 7})
+
+
+class TestSnapshot(TestCaseWithTempDir):
+    """ test the binary snapshot cache """
+
+    def test_snapshot_is_used(self):
+        """ after a write loading doesn't read the xml """
+
+        self.showview.set_show(name='test1', episode=7)
+        self.showview.write_shows()
+        self.assertTrue(os.path.exists(self.showview.snapshotfile))
+
+        with patch.object(ShowView, '_iter_file') as mock_iter, \
+                patch.object(ShowView, '_scan_file') as mock_scan:
+            self.assertEqual(list(ShowView(self.tmpxml).get_shows()),
+                             [{"name": "test1", "season": 1, "episode": 7},
+                              {"name": "test2", "season": 10, "episode": 10}])
+        mock_iter.assert_not_called()
+        mock_scan.assert_not_called()
+
+    def test_readonly_streams(self):
+        """ the read-only listing streams without checking the snapshot """
+
+        self.showview.set_show(name='test1', episode=7)
+        self.showview.write_shows()
+        readonly = ShowView(self.tmpxml, readonly=True)
+        with patch.object(ShowView, '_file_digest') as mock_digest:
+            self.assertEqual(next(readonly.get_shows()),
+                             {"name": "test1", "season": 1, "episode": 7})
+            self.assertEqual(len(list(readonly.get_shows('test'))), 2)
+        mock_digest.assert_not_called()
+
+    def test_stale_snapshot(self):
+        """ a snapshot is ignored after the xml file changed """
+
+        self.showview.write_shows()
+        with open(self.tmpxml, 'r') as file:
+            xml = file.read()
+        with open(self.tmpxml, 'w') as file:
+            file.write(xml.replace('test2', 'test3'))
+
+        readonly = ShowView(self.tmpxml, readonly=True)
+        self.assertIsNone(readonly._load_snapshot())
+        self.assertEqual(readonly.get_show('test3'),
+                         {"name": "test3", "season": 10, "episode": 10})
+
+
+class TestDirty(TestCaseWithTempDir):
+    """ test writing only what changed """
+
+    def setUp(self):
+        super().setUp()
+        # bring the file into the canonical layout
+        self.showview._write()
+        self.phases = []
+        self.showview = ShowView(self.tmpxml, hook=self.hook)
+        del self.phases[:]
+
+    def hook(self, phase, seconds, scanned):
+        """ remember every phase """
+        self.phases.append((phase, scanned))
+
+    def assertCanonical(self):
+        """ the file is what a full write would make of the shows """
+        with open(self.tmpxml, 'rb') as file:
+            content = file.read()
+        expected = io.BytesIO()
+        write_xml(expected, ShowView(self.tmpxml)._shows)
+        self.assertEqual(content, expected.getvalue())
+
+    def test_unchanged(self):
+        """ nothing is written without a change """
+
+        stat = os.stat(self.tmpxml)
+        self.showview.set_show(name='test1', season=1, episode=1)
+        self.showview.write_shows()
+        self.assertEqual(self.phases, [('mutate', 1)])
+        self.assertEqual(os.stat(self.tmpxml).st_mtime_ns, stat.st_mtime_ns)
+
+    def test_not_canonical(self):
+        """
+        a file the scanner can't read is left alone without a change and
+        rewritten with one
+        """
+
+        xml = ('<DocumentElement>\n<Show><Name>a</Name><Season>1</Season>'
+               '<Episode>2</Episode></Show>\n</DocumentElement>\n')
+        with open(self.tmpxml, 'w') as file:
+            file.write(xml)
+        ShowView(self.tmpxml).write_shows()
+        with open(self.tmpxml, 'r') as file:
+            self.assertEqual(file.read(), xml)
+        showview = ShowView(self.tmpxml)
+        showview.set_show(name='a', episode=3)
+        showview.write_shows()
+        self.assertTrue(ShowView(self.tmpxml)._is_canonical())
+
+    def test_patch(self):
+        """ values as wide as the old ones are patched in place """
+
+        inode = os.stat(self.tmpxml).st_ino
+        self.showview.set_show(name='test1', episode=5)
+        self.showview.set_show(name='test2', season=12)
+        self.showview.write_shows()
+        self.assertIn(('patch', 2), self.phases)
+        self.assertNotIn('serialize', [phase for phase, _ in self.phases])
+        self.assertEqual(os.stat(self.tmpxml).st_ino, inode)
+        self.assertCanonical()
+        self.assertEqual(list(ShowView(self.tmpxml).get_shows()),
+                         [{"name": "test1", "season": 1, "episode": 5},
+                          {"name": "test2", "season": 12, "episode": 10}])
+        # the snapshot was renewed
+        self.assertIsNotNone(self.showview._load_snapshot())
+
+    def test_patch_duplicates(self):
+        """ every show of the name is patched """
+
+        self.showview.add_show(name='test1', season=2, episode=2)
+        self.showview.write_shows()
+        self.showview.set_show(name='test1', episode=7)
+        self.showview.write_shows()
+        self.assertIn(('patch', 2), self.phases)
+        self.assertEqual([show['episode'] for show in
+                          ShowView(self.tmpxml).get_shows('test1')], [7, 7])
+
+    def test_wider(self):
+        """ a value wider than the old one rewrites the file """
+
+        inode = os.stat(self.tmpxml).st_ino
+        self.showview.set_show(name='test1', episode=10)
+        self.showview.write_shows()
+        self.assertNotEqual(os.stat(self.tmpxml).st_ino, inode)
+        self.assertCanonical()
+
+    def test_rename(self):
+        """ a rename rewrites the file """
+
+        self.showview.set_show(name='test1', new_name='test3')
+        self.showview.write_shows()
+        self.assertIn('serialize', [phase for phase, _ in self.phases])
+        self.assertEqual(ShowView(self.tmpxml).get_show('test3')['episode'],
+                         1)
+
+    def test_other_writer(self):
+        """ another writer sees the patch and merges it """
+
+        other = ShowView(self.tmpxml)
+        self.showview.set_show(name='test1', episode=5)
+        self.showview.write_shows()
+        other.set_show(name='test2', episode=20)
+        other.write_shows()
+        self.assertEqual(list(ShowView(self.tmpxml).get_shows()),
+                         [{"name": "test1", "season": 1, "episode": 5},
+                          {"name": "test2", "season": 10, "episode": 20}])
+        self.assertEqual(other.refresh(),
+                         {"added": [], "removed": [], "changed": []})
+
+    def test_journal_unchanged(self):
+        """ a set that changes nothing isn't journaled """
+
+        showview = ShowView(self.tmpxml, journal=True)
+        showview.set_show(name='test1', episode=1)
+        self.assertFalse(os.path.exists(showview.journalfile))
+
+
+class TestWriteXml(TestCase):
+    """ test the streaming xml writer """
+
+    def etree_xml(self, shows):
+        """ what indent() and ElementTree.write make of shows """
+
+        root = ET.Element('DocumentElement')
+        for show in shows:
+            show_element = ET.SubElement(root, 'Show')
+            ET.SubElement(show_element, 'Name').text = show.name
+            ET.SubElement(show_element, 'Season').text = str(show.season)
+            ET.SubElement(show_element, 'Episode').text = str(show.episode)
+        indent(root)
+        file = io.BytesIO()
+        ET.ElementTree(root).write(file)
+        return file.getvalue()
+
+    def streamed_xml(self, shows):
+        """ what write_xml makes of shows """
+
+        file = io.BytesIO()
+        write_xml(file, shows)
+        return file.getvalue()
+
+    def test_same_output(self):
+        """ the output is byte-identical to the ElementTree output """
+
+        shows = [Show('Tom & Jerry <US>', 1, 2),
+                 Show('Caf\u00e9 \u4e2d', -1, 0),
+                 Show('', 3, 4)]
+        self.assertEqual(self.streamed_xml(shows), self.etree_xml(shows))
+
+    def test_no_shows(self):
+        """ an empty file is written like ElementTree does """
+
+        self.assertEqual(self.streamed_xml([]), self.etree_xml([]))
+
+
+class TestHook(TestCaseWithTempDir):
+    """ test the profiling hook """
+
+    def setUp(self):
+        super().setUp()
+        self.phases = []
+        self.showview = ShowView(self.tmpxml, hook=self.hook)
+
+    def hook(self, phase, seconds, scanned):
+        """ remember every phase """
+        self.assertGreaterEqual(seconds, 0)
+        self.phases.append((phase, scanned))
+
+    def test_phases(self):
+        """ every phase is reported with the shows it scanned """
+
+        self.assertEqual(self.phases, [('snapshot', 0), ('parse', 2),
+                                       ('index', 2)])
+        del self.phases[:]
+        self.showview.get_show('test1')
+        self.showview.set_show(name='test1', episode=2)
+        self.showview.write_shows()
+        self.assertEqual(self.phases, [('lookup', 1), ('mutate', 1),
+                                       ('serialize', 2), ('fsync', 0),
+                                       ('rename', 0), ('snapshot', 0)])
+
+    def test_stream(self):
+        """ the read-only mode reports the streamed shows """
+
+        showview = ShowView(self.tmpxml, readonly=True, hook=self.hook)
+        list(showview.get_shows('test2'))
+        self.assertEqual(self.phases[-1], ('stream', 2))
+
+    @patch('builtins.print')
+    def test_main_profile(self, mock_print):
+        """ --profile prints the phases to stderr """
+
+        sys.argv = ['showview.py', '--showfile', self.tmpxml, 'test1', '-ie',
+                    '--profile']
+        main()
+        printed = [args[0] for _, args, kwargs in mock_print.mock_calls
+                   if kwargs.get('file') is sys.stderr]
+        self.assertEqual(printed[0].split(),
+                         ['phase', 'ms', 'calls', 'scanned'])
+        self.assertEqual([line.split()[0] for line in printed[1:]],
+                         ['snapshot', 'parse', 'index', 'lookup', 'mutate',
+                          'serialize', 'fsync', 'rename'])
+
+
+class TestDaemon(TestCaseWithTempDir):
+    """ test the daemon and the commandline talking to it """
+
+    def setUp(self):
+        super().setUp()
+        self.daemon = ShowViewDaemon(self.tmpxml, flush_interval=3600)
+        self.thread = threading.Thread(target=self.daemon.serve_forever,
+                                       kwargs={'poll_interval': 0.01})
+        self.thread.start()
+        with open(self.tmpxml, 'r') as file:
+            self.xml_before = file.read()
+
+    def tearDown(self):
+        self.stop()
+        super().tearDown()
+
+    def stop(self):
+        """ stop the daemon (if it still runs) """
+        if self.thread.is_alive():
+            self.daemon.shutdown()
+            self.thread.join()
+            self.daemon.server_close()
+
+    def run_main(self, *argv):
+        """ run main with argv and return what it printed """
+        sys.argv = ['showview.py', '--showfile', self.tmpxml] + list(argv)
+        output = io.StringIO()
+        with patch('sys.stdout', output):
+            main()
+        return output.getvalue()
+
+    def test_requests(self):
+        """ the commandline is answered by the daemon """
+
+        with patch.object(ShowView, '__init__') as mock_init:
+            self.assertEqual(self.run_main('test1', '-ie'),
+                             'test1                                     '
+                             '1 -  2\n')
+            self.assertEqual(self.run_main('-n'), 'test1\ntest2\n')
+            self.assertEqual(self.run_main('missing'),
+                             '"No show found for name \'missing\'"\n')
+        mock_init.assert_not_called()
+
+    def test_flush_on_stop(self):
+        """ changes are written when the daemon stops """
+
+        self.run_main('test1', '-se', '5')
+        with open(self.tmpxml, 'r') as file:
+            self.assertEqual(file.read(), self.xml_before)
+        self.stop()
+        self.assertFalse(os.path.exists(self.tmpxml + '.sock'))
+        self.assertEqual(ShowView(self.tmpxml).get_show('test1'),
+                         {"name": "test1", "season": 1, "episode": 5})
+
+    def test_fallback(self):
+        """ without the daemon main reads the file itself """
+
+        self.run_main('test1', '-ie')
+        self.stop()
+        self.assertEqual(self.run_main('test1'),
+                         'test1                                     1 -  2\n')
+
+
+    def test_unsupported(self):
+        """ options only the commandline handles aren't run """
+
+        self.assertEqual(self.daemon.execute('--import shows.csv'),
+                         "--import can't be sent to the daemon\n")
+        self.assertEqual(self.daemon.execute(
+            '--showfile {} test1'.format(self.tmpxml)),
+            'test1                                     1 -  1\n')
+
+    def test_no_answer(self):
+        """ a request the daemon got but didn't answer isn't run again """
+
+        self.stop()
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+            server.bind(self.tmpxml + '.sock')
+            server.listen()
+            with patch('showview.DAEMON_TIMEOUT', 0.05), \
+                    patch.object(ShowView, '__init__') as mock_init, \
+                    patch('sys.stderr', io.StringIO()) as stderr, \
+                    self.assertRaises(SystemExit):
+                self.run_main('test1', '-ie')
+        mock_init.assert_not_called()
+        self.assertIn("the daemon didn't answer", stderr.getvalue())
+
+
+class TestAsync(IsolatedAsyncioTestCase):
+    """ test the asyncio ShowView """
+
+    async def asyncSetUp(self):
+        """ copy xml to a tempfolder and load it """
+        self.tempfolder = tempfile.mkdtemp()
+        self.tmpxml = shutil.copy(TESTXML, self.tempfolder)
+        self.showview = await AsyncShowView(self.tmpxml).load()
+
+    async def asyncTearDown(self):
+        """clean up the tempfolder """
+        shutil.rmtree(self.tempfolder)
+
+    async def test_read(self):
+        """ get one and all shows """
+
+        self.assertEqual(await self.showview.get_show('test2'),
+                         {"name": "test2", "season": 10, "episode": 10})
+        self.assertEqual([show async for show in self.showview.get_shows()],
+                         list(ShowView(self.tmpxml).get_shows()))
+        with self.assertRaises(KeyError):
+            await self.showview.get_show('NotExisting')
+
+    async def test_coalesced_writes(self):
+        """ rapid changes are written once """
+
+        async def change(episode):
+            await self.showview.set_show(name='test1', episode=episode)
+            await self.showview.write_shows()
+
+        with patch.object(ShowView, '_flush', autospec=True,
+                          side_effect=ShowView._flush) as mock_flush:
+            await asyncio.gather(*(change(episode)
+                                   for episode in range(1, 6)))
+            await self.showview.add_show(name='test0')
+            await self.showview.write_shows()
+        self.assertEqual(mock_flush.call_count, 2)
+        self.assertEqual(list(ShowView(self.tmpxml).get_shows()),
+                         [{"name": "test0", "season": 0, "episode": 0},
+                          {"name": "test1", "season": 1, "episode": 5},
+                          {"name": "test2", "season": 10, "episode": 10}])
+
+    async def test_off_the_loop(self):
+        """ the showview is only used in the executor """
+
+        loop_thread = threading.get_ident()
+        threads = set()
+        get_shows = ShowView.get_shows
+
+        def record(func):
+            def wrapper(*args, **kwargs):
+                threads.add(threading.get_ident())
+                return func(*args, **kwargs)
+            return wrapper
+
+        def record_shows(*args):
+            for show in get_shows(*args):
+                threads.add(threading.get_ident())
+                yield show
+
+        with patch.object(ShowView, 'get_show',
+                          record(ShowView.get_show)), \
+                patch.object(ShowView, 'add_show',
+                             record(ShowView.add_show)), \
+                patch.object(ShowView, 'set_show',
+                             record(ShowView.set_show)), \
+                patch.object(ShowView, 'get_shows', record_shows), \
+                patch('showview.ASYNC_CHUNK', 1):
+            await self.showview.add_show(name='test0')
+            await self.showview.set_show(name='test0', episode=2)
+            self.assertEqual(await self.showview.get_show('test0'),
+                             {"name": "test0", "season": 0, "episode": 2})
+            self.assertEqual(
+                [show['name'] async for show in self.showview.get_shows()],
+                ['test0', 'test1', 'test2'])
+        self.assertTrue(threads)
+        self.assertNotIn(loop_thread, threads)
+
+    async def test_sqlite(self):
+        """ the database opened in the executor is usable on the loop """
+
+        database = os.path.join(self.tempfolder, 'shows.db')
+        migrate(self.tmpxml, database).close()
+        showview = await AsyncShowView(database).load()
+        self.assertEqual(await showview.get_show('test2'),
+                         {"name": "test2", "season": 10, "episode": 10})
+        await showview.set_show(name='test1', episode=5)
+        await showview.write_shows()
+        self.assertEqual([show async for show in showview.get_shows()],
+                         list(SQLiteShowView(database).get_shows()))
+        await showview.refresh()
+
+
+class TestConcurrentWriters(TestCaseWithTempDir):
+    """ test two ShowViews writing the same file """
+
+    def setUp(self):
+        super().setUp()
+        self.other = ShowView(self.tmpxml)
+
+    def test_merge(self):
+        """ changes of both writers end up in the file """
+
+        self.showview.set_show(name='test1', episode=5)
+        self.showview.add_show(name='test0')
+        self.other.set_show(name='test2', season=3)
+        self.other.set_show(name='test1', season=2)
+        self.other.add_show(name='test3')
+        self.showview.write_shows()
+        self.other.write_shows()
+
+        self.assertEqual(self.other.conflicts, [])
+        self.assertEqual(list(ShowView(self.tmpxml).get_shows()),
+                         [{"name": "test0", "season": 0, "episode": 0},
+                          {"name": "test1", "season": 2, "episode": 5},
+                          {"name": "test2", "season": 3, "episode": 10},
+                          {"name": "test3", "season": 0, "episode": 0}])
+
+    def test_merge_duplicate_add(self):
+        """ a second show of a name survives a merge """
+
+        self.showview.add_show(name='test1', season=2)
+        self.other.set_show(name='test2', episode=3)
+        self.other.write_shows()
+        self.showview.write_shows()
+        self.assertEqual(
+            sorted((show['name'], show['season']) for show in
+                   ShowView(self.tmpxml).get_shows()),
+            [('test1', 1), ('test1', 2), ('test2', 10)])
+
+    def test_journal_appended(self):
+        """ a rewrite keeps what another writer added to the journal """
+
+        for episode, journal in ((2, False), (3, True)):
+            showview = ShowView(self.tmpxml, journal=True)
+            other = ShowView(self.tmpxml, journal=journal)
+            showview.set_show(name='test1', episode=episode)
+            showview.write_shows()
+            other.set_show(name='test2', episode=episode)
+            other.compact()
+            self.assertEqual(
+                list(ShowView(self.tmpxml).get_shows()),
+                [{"name": "test1", "season": 1, "episode": episode},
+                 {"name": "test2", "season": 10, "episode": episode}])
+            self.assertFalse(os.path.exists(self.tmpxml + '.journal'))
+
+    def test_conflict(self):
+        """ a field both writers changed keeps the last value """
+
+        self.showview.set_show(name='test1', episode=5)
+        self.other.set_show(name='test1', episode=7)
+        self.showview.write_shows()
+        self.other.write_shows()
+
+        self.assertEqual(self.other.conflicts, [('test1', 'episode', 5, 7)])
+        self.assertEqual(ShowView(self.tmpxml).get_show('test1'),
+                         {"name": "test1", "season": 1, "episode": 7})
+
+    def test_rename(self):
+        """ a renamed show gets the changes of the other writer """
+
+        self.showview.set_show(name='test1', new_name='test9')
+        self.other.set_show(name='test1', episode=5)
+        self.other.write_shows()
+        self.showview.write_shows()
+
+        self.assertEqual(ShowView(self.tmpxml).get_show('test9'),
+                         {"name": "test9", "season": 1, "episode": 5})
+
+    def test_threads(self):
+        """ writers in two threads don't lose each other's changes """
+
+        for trial in range(20):
+            views = [ShowView(self.tmpxml), ShowView(self.tmpxml)]
+
+            def write(view, name):
+                view.add_show(name=name)
+                view.write_shows()
+
+            threads = [threading.Thread(target=write,
+                                        args=(view, 'thread{}-{}'.format(
+                                            trial, i)))
+                       for i, view in enumerate(views)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            names = [show['name'] for show in
+                     ShowView(self.tmpxml).get_shows('thread{}-'.format(
+                         trial))]
+            self.assertEqual(names, ['thread{}-0'.format(trial),
+                                     'thread{}-1'.format(trial)])
+        self.assertFalse([name for name in os.listdir(self.tempfolder)
+                          if name.endswith('.tmp')])
+
+    def test_no_fcntl(self):
+        """ without fcntl (windows) only the threads are kept apart """
+
+        with patch.dict(sys.modules, {'fcntl': None}):
+            with file_lock(self.tmpxml):
+                self.showview.set_show(name='test1', episode=5)
+                self.showview.write_shows()
+        self.assertFalse(os.path.exists(self.tmpxml + '.lock'))
+        self.assertEqual(ShowView(self.tmpxml).get_show('test1')['episode'],
+                         5)
+
+    def test_lock_threads(self):
+        """ another thread waits for the lock """
+
+        events = []
+
+        def other():
+            with file_lock(self.tmpxml):
+                events.append('other')
+
+        with file_lock(self.tmpxml):
+            thread = threading.Thread(target=other)
+            thread.start()
+            thread.join(0.2)
+            events.append('main')
+        thread.join()
+        self.assertEqual(events, ['main', 'other'])
+
+    def test_reentrant_lock(self):
+        """ the lock can be taken again while it is held """
+
+        with file_lock(self.tmpxml):
+            with file_lock(self.tmpxml):
+                self.showview.set_show(name='test1', episode=5)
+                self.showview.write_shows()
+        self.assertEqual(ShowView(self.tmpxml).get_show('test1')['episode'],
+                         5)
+
+
+class TestRefresh(TestCaseWithTempDir):
+    """ test picking up what another process wrote """
+
+    def setUp(self):
+        super().setUp()
+        self.other = ShowView(self.tmpxml)
+
+    def test_unchanged(self):
+        """ nothing is read when the file didn't change """
+
+        self.assertEqual(self.showview.refresh(),
+                         {"added": [], "removed": [], "changed": []})
+
+    def test_diff(self):
+        """ added, removed and changed shows are patched in """
+
+        self.other.set_show(name='test1', episode=5)
+        self.other.set_show(name='test2', new_name='test4')
+        self.other.add_show(name='test0')
+        self.other.write_shows()
+
+        self.assertEqual(self.showview.refresh(),
+                         {"added": ['test0', 'test4'], "removed": ['test2'],
+                          "changed": ['test1']})
+        self.assertEqual([show['name'] for show in self.showview.get_shows()],
+                         ['test0', 'test1', 'test4'])
+        self.assertEqual(self.showview.get_show('test1')['episode'], 5)
+        self.assertEqual(self.showview._names, ['test0', 'test1', 'test4'])
+        self.assertEqual(list(self.showview.search('test4'))[0],
+                         {"name": "test4", "season": 10, "episode": 10})
+        self.assertEqual(self.showview.refresh(),
+                         {"added": [], "removed": [], "changed": []})
+
+    def test_duplicates(self):
+        """ a show whose count of entries changed is replaced """
+
+        self.other.add_show(name='test1', season=2)
+        self.other.write_shows()
+
+        self.assertEqual(self.showview.refresh()['changed'], ['test1'])
+        self.assertEqual(list(self.showview.get_shows('test1')),
+                         list(ShowView(self.tmpxml).get_shows('test1')))
+
+    def test_journal(self):
+        """ journaled changes of the other process are read """
+
+        showview = ShowView(self.tmpxml, journal=True)
+        other = ShowView(self.tmpxml, journal=True)
+        showview.add_show(name='test0')
+        self.assertEqual(showview.refresh()['added'], [])
+        other.set_show(name='test2', episode=3)
+
+        self.assertEqual(showview.refresh(),
+                         {"added": [], "removed": [], "changed": ['test2']})
+        self.assertEqual(showview.get_show('test2')['episode'], 3)
+        self.assertEqual(other.refresh()['added'], ['test0'])
+
+    def test_unsaved_changes(self):
+        """ own changes that aren't written are kept """
+
+        self.showview.set_show(name='test1', episode=7)
+        self.other.add_show(name='test3')
+        self.other.write_shows()
+
+        self.assertEqual(self.showview.refresh(),
+                         {"added": ['test3'], "removed": [], "changed": []})
+        self.assertEqual(self.showview.get_show('test1')['episode'], 7)
+        self.showview.write_shows()
+        self.assertEqual([show['name'] for show in
+                          ShowView(self.tmpxml).get_shows()],
+                         ['test1', 'test2', 'test3'])
+
+    @patch('time.monotonic')
+    def test_auto_refresh(self, mock_monotonic):
+        """ reads refresh when auto_refresh seconds passed """
+
+        mock_monotonic.return_value = 100
+        showview = ShowView(self.tmpxml, auto_refresh=5)
+        showview.get_show('test1')
+        self.other.add_show(name='test0')
+        self.other.write_shows()
+        mock_monotonic.return_value = 102
+        self.assertEqual(len(list(showview.get_shows())), 2)
+        mock_monotonic.return_value = 105
+        self.assertEqual(len(list(showview.get_shows())), 3)
+
+
+class TestScanner(TestCaseWithTempDir):
+    """ test the mmap scanner for canonical files """
+
+    def setUp(self):
+        super().setUp()
+        # bring the file into the canonical layout
+        self.showview._write()
+        os.remove(self.showview.snapshotfile)
+        with open(self.tmpxml, 'r') as file:
+            self.xml = file.read()
+
+    def test_canonical(self):
+        """ a file written by write_shows is scanned without the parser """
+
+        with patch.object(ShowView, '_iter_file') as mock_iter:
+            self.assertEqual(ShowView(self.tmpxml)._shows[1].name, 'test2')
+            self.assertEqual(
+                list(ShowView(self.tmpxml, readonly=True).get_shows()),
+                [{"name": "test1", "season": 1, "episode": 1},
+                 {"name": "test2", "season": 10, "episode": 10}])
+        mock_iter.assert_not_called()
+
+    def test_fallback(self):
+        """ anything else is read by the xml parser """
+
+        for old, new in (('<Show>', '<!-- a comment -->\n  <Show>'),
+                         ('test2', 'test&#x32;'),
+                         ('<Show>', '<Show id="1">'),
+                         ('    <Season>', '\t<Season>')):
+            with open(self.tmpxml, 'w') as file:
+                file.write(self.xml.replace(old, new, 1))
+            showview = ShowView(self.tmpxml, readonly=True)
+            self.assertFalse(showview._is_canonical())
+            self.assertEqual(len(list(showview.get_shows())), 2)
+            self.assertEqual(len(list(ShowView(self.tmpxml).get_shows())), 2)
+
+    def test_single_pass(self):
+        """ streaming a canonical file scans it once """
+
+        showview = ShowView(self.tmpxml, readonly=True)
+        with patch.object(ShowView, '_scan_file', autospec=True,
+                          side_effect=ShowView._scan_file) as mock_scan:
+            self.assertEqual(len(list(showview.get_shows())), 2)
+        mock_scan.assert_called_once_with(showview)
+
+    def test_fallback_midway(self):
+        """ the stream switches to the parser where the layout changes """
+
+        with open(self.tmpxml, 'w') as file:
+            file.write(self.xml.replace('<Name>test2', '<Name>test&#x26;2'))
+        showview = ShowView(self.tmpxml, readonly=True)
+        with patch.object(ShowView, '_iter_file', autospec=True,
+                          side_effect=ShowView._iter_file) as mock_iter:
+            self.assertEqual(list(showview.get_shows()),
+                             [{"name": "test1", "season": 1, "episode": 1},
+                              {"name": "test&2", "season": 10,
+                               "episode": 10}])
+        mock_iter.assert_called_once_with(showview)
+
+    def test_readonly_lookup(self):
+        """ a readonly lookup doesn't hash the file for the snapshot """
+
+        writer = ShowView(self.tmpxml)
+        writer.set_show(name='test2', episode=11)
+        writer.write_shows()
+        showview = ShowView(self.tmpxml, readonly=True)
+        self.assertIsNotNone(showview._load_snapshot())
+        with patch.object(ShowView, '_file_digest') as mock_digest:
+            self.assertEqual(showview.get_show('test1'),
+                             {"name": "test1", "season": 1, "episode": 1})
+        mock_digest.assert_not_called()
+
+    def test_external_entity(self):
+        """ the parser doesn't read external entities """
+
+        secret = os.path.join(os.path.abspath(self.tempfolder), 'secret')
+        with open(secret, 'w') as file:
+            file.write('SECRET')
+        with open(self.tmpxml, 'w') as file:
+            file.write('<!DOCTYPE DocumentElement [<!ENTITY secret SYSTEM '
+                       '"file://{}">]>\n'.format(secret) +
+                       self.xml.replace('test2', 'test&secret;'))
+        try:
+            names = [show['name'] for show in
+                     ShowView(self.tmpxml, readonly=True).get_shows()]
+        except SyntaxError:
+            # ElementTree refuses the entity
+            names = []
+        self.assertNotIn('SECRET', ''.join(names))
+
+    def test_entity_name(self):
+        """ the names write_xml escapes are scanned as well """
+
+        names = ['Law & Order', '<Tag>', 'Amélie', '&#38;', '&']
+        for name in names:
+            self.showview.add_show(name=name)
+        self.showview.write_shows()
+        os.remove(self.showview.snapshotfile)
+        with patch.object(ShowView, '_iter_file') as mock_iter:
+            showview = ShowView(self.tmpxml)
+            self.assertTrue(showview._canonical)
+            for name in names:
+                self.assertEqual(showview.get_show(name)['name'], name)
+        mock_iter.assert_not_called()
+
+    def test_patch_entity_name(self):
+        """ a show with an escaped name is patched in place """
+
+        self.showview.add_show(name='Law & Order')
+        self.showview.write_shows()
+        inode = os.stat(self.tmpxml).st_ino
+        self.showview.set_show(name='Law & Order', episode=5)
+        self.showview.write_shows()
+        self.assertEqual(os.stat(self.tmpxml).st_ino, inode)
+        self.assertEqual(ShowView(self.tmpxml).get_show('Law & Order'),
+                         {"name": "Law & Order", "season": 0, "episode": 5})
+
+
+class TestComplete(TestCaseWithTempDir):
+    """ test the shell completion """
+
+    def setUp(self):
+        super().setUp()
+        self.showview.add_show(name='other')
+        self.showview.add_show(name='test10')
+        self.showview.write_shows()
+
+    def test_names_cache(self):
+        """ the names come from the cache write_shows keeps """
+
+        with open(self.showview.namesfile, 'r') as file:
+            self.assertEqual(file.read(), 'other\ntest1\ntest10\ntest2')
+        with patch.object(ShowView, '__init__') as mock_init:
+            self.assertEqual(complete('test1', self.tmpxml),
+                             ['test1', 'test10'])
+            self.assertEqual(complete('x', self.tmpxml), [])
+            self.assertEqual(len(complete('', self.tmpxml)), 4)
+        mock_init.assert_not_called()
+
+    def test_stale_cache(self):
+        """ without a fresh cache the showfile is read """
+
+        os.remove(self.showview.namesfile)
+        self.assertEqual(complete('test1', self.tmpxml), ['test1', 'test10'])
+
+    def test_patched(self):
+        """ the cache stays fresh when the showfile is patched in place """
+
+        # as written within one tick of a coarse clock
+        mtime = os.stat(self.tmpxml).st_mtime_ns
+        os.utime(self.showview.namesfile, ns=(mtime, mtime))
+        inode = os.stat(self.tmpxml).st_ino
+        self.showview.set_show(name='test1', episode=5)
+        self.showview.write_shows()
+        self.assertEqual(os.stat(self.tmpxml).st_ino, inode)
+        with patch.object(ShowView, '__init__') as mock_init:
+            self.assertEqual(complete('test1', self.tmpxml),
+                             ['test1', 'test10'])
+        mock_init.assert_not_called()
+
+    def test_journal(self):
+        """ new names are in the cache in journal mode too """
+
+        showview = ShowView(self.tmpxml, journal=True)
+        showview.add_show(name='test11')
+        showview.write_shows()
+        self.assertEqual(complete('test1', self.tmpxml),
+                         ['test1', 'test10', 'test11'])
+
+    def test_main_complete(self):
+        """ --complete prints the names without argparse """
+
+        sys.argv = ['showview.py', '--complete', 'test1',
+                    '--showfile', self.tmpxml]
+        output = io.StringIO()
+        with patch('sys.stdout', output):
+            main()
+        self.assertEqual(output.getvalue(), 'test1\ntest10\n')
+
+
+class TestImport(TestCaseWithTempDir):
+    """ test the bulk import and export """
+
+    shows = [{"name": "test3", "season": 3, "episode": 3},
+             {"name": "test0", "season": 0, "episode": 5},
+             {"name": "test1", "season": 7, "episode": 7}]
+
+    def test_import(self):
+        """ new shows are merged in order, existing ones are skipped """
+
+        self.assertEqual(self.showview.import_shows(self.shows), 2)
+        expected = [{"name": "test0", "season": 0, "episode": 5},
+                    {"name": "test1", "season": 1, "episode": 1},
+                    {"name": "test2", "season": 10, "episode": 10},
+                    {"name": "test3", "season": 3, "episode": 3}]
+        self.assertEqual(list(self.showview.get_shows()), expected)
+        self.assertEqual(
+            list(open_showview(self.showview.sourcefile).get_shows()),
+            expected)
+        self.assertEqual(self.showview.get_show('test3')['episode'], 3)
+
+    def test_replace(self):
+        """ replace takes season and episode of the imported show """
+
+        self.assertEqual(
+            self.showview.import_shows(self.shows, duplicates='replace'), 3)
+        self.assertEqual(self.showview.get_show('test1'),
+                         {"name": "test1", "season": 7, "episode": 7})
+
+    def test_error(self):
+        """ error raises before anything is changed """
+
+        with self.assertRaises(ValueError):
+            self.showview.import_shows(self.shows, duplicates='error')
+        self.assertEqual(len(list(self.showview.get_shows())), 2)
+        with self.assertRaises(ValueError):
+            self.showview.import_shows([{"name": "new"}, {"name": "new"}],
+                                       duplicates='error')
+
+    def test_journal(self):
+        """ the imported shows survive in the journal """
+
+        showview = ShowView(self.tmpxml, journal=True)
+        showview.import_shows(self.shows, duplicates='replace')
+        self.assertEqual(list(ShowView(self.tmpxml).get_shows()),
+                         list(showview.get_shows()))
+
+    def test_main_broken(self):
+        """ --import reports the line that isn't a show """
+
+        for suffix, content, line in (
+                ('.jsonl', '{"name": "a"}\n{"season": 1}\n', 2),
+                ('.jsonl', '{"name": "a"}\n\n{"name": "b"\n', 3),
+                ('.jsonl', '["a"]\n', 1),
+                ('.csv', 'title,season\na,1\n', 1),
+                ('.csv', 'name,season\na,1\nb,x\n', 3)):
+            imported = os.path.join(self.tempfolder, 'shows' + suffix)
+            with open(imported, 'w') as file:
+                file.write(content)
+            sys.argv = ['showview.py', '--showfile', self.tmpxml,
+                        '--import', imported]
+            with patch('builtins.print') as mock_print:
+                main()
+            self.assertTrue(str(mock_print.call_args[0][0]).startswith(
+                'line {}: '.format(line)), (content, mock_print.call_args))
+        self.assertEqual(len(list(ShowView(self.tmpxml).get_shows())), 2)
+
+    def test_main_export_missing(self):
+        """ an export of a missing showfile doesn't touch the target """
+
+        exported = os.path.join(self.tempfolder, 'shows.csv')
+        with open(exported, 'w') as file:
+            file.write('name\nkeep\n')
+        sys.argv = ['showview.py', '--showfile',
+                    os.path.join(self.tempfolder, 'missing.xml'),
+                    '--export', exported]
+        with self.assertRaises(OSError):
+            main()
+        with open(exported, 'r') as file:
+            self.assertEqual(file.read(), 'name\nkeep\n')
+
+    def test_main_roundtrip(self):
+        """ --export writes what --import reads, csv and jsonl """
+
+        for suffix in ('.csv', '.jsonl'):
+            exported = os.path.join(self.tempfolder, 'shows' + suffix)
+            sys.argv = ['showview.py', '--showfile', self.tmpxml,
+                        '--export', exported]
+            main()
+            target = os.path.join(self.tempfolder, 'target' + suffix + '.xml')
+            with open(target, 'w') as file:
+                file.write('<DocumentElement />')
+            sys.argv = ['showview.py', '--showfile', target,
+                        '--import', exported]
+            with patch('builtins.print') as mock_print:
+                main()
+            mock_print.assert_called_with('2 shows imported')
+            self.assertEqual(list(ShowView(target).get_shows()),
+                             list(self.showview.get_shows()))
+
+    def test_main_csv(self):
+        """ --import reads a csv with a header """
+
+        csvfile = os.path.join(self.tempfolder, 'shows.csv')
+        with open(csvfile, 'w') as file:
+            file.write('name,season,episode\ntest1,4,4\n"a, b",1,\n')
+        sys.argv = ['showview.py', '--showfile', self.tmpxml,
+                    '--import', csvfile, '--duplicates', 'replace']
+        with patch('builtins.print'):
+            main()
+        showview = ShowView(self.tmpxml)
+        self.assertEqual(showview.get_show('a, b'),
+                         {"name": "a, b", "season": 1, "episode": 0})
+        self.assertEqual(showview.get_show('test1')['season'], 4)
+
+
+class TestSearch(TestCaseWithTempDir):
+    """ test the substring and fuzzy search """
+
+    def setUp(self):
+        super().setUp()
+        self.showview.import_shows([{"name": "The Office (US)"},
+                                    {"name": "Office Space"},
+                                    {"name": "Coffee Table"},
+                                    {"name": "Lost"}])
+        self.showview = open_showview(self.showview.sourcefile)
+
+    def names(self, text, showview=None):
+        """ the names search returns for text """
+        showview = showview or self.showview
+        return [show['name'] for show in showview.search(text)]
+
+    def test_substring(self):
+        """ prefix matches first, then word starts, then substrings """
+
+        self.assertEqual(self.names('office'),
+                         ['Office Space', 'The Office (US)'])
+        self.assertEqual(self.names('ffi'),
+                         ['Office Space', 'The Office (US)'])
+        self.assertEqual(self.names('OST'), ['Lost'])
+        self.assertEqual(self.names('(US)'), ['The Office (US)'])
+        self.assertEqual(self.names('xyz'), [])
+        self.assertEqual(self.names(''), [])
+
+    def test_short(self):
+        """ one and two letters find every name containing them """
+
+        self.assertEqual(self.names('of'),
+                         ['Office Space', 'The Office (US)', 'Coffee Table'])
+        self.assertEqual(self.names('2'), ['test2'])
+
+    def test_typo(self):
+        """ names with most of the trigrams match after the substrings """
+
+        self.assertEqual(self.names('offce'),
+                         ['Office Space', 'The Office (US)'])
+        self.assertEqual(self.names('lots'), [])
+        self.assertEqual(self.names('Lsot'), [])
+
+    def test_limit(self):
+        """ limit returns the best matches """
+
+        self.assertEqual([show['name'] for show in
+                          self.showview.search('office', limit=1)],
+                         ['Office Space'])
+
+    def test_changes(self):
+        """ added and renamed shows are found """
+
+        self.assertEqual(self.names('space'), ['Office Space'])
+        self.showview.add_show(name='Deep Space Nine')
+        self.showview.set_show(name='Office Space', new_name='Office')
+        self.assertEqual(self.names('space'), ['Deep Space Nine'])
+        self.showview.write_shows()
+        self.assertEqual(self.names('space', open_showview(
+            self.showview.sourcefile, readonly=True)), ['Deep Space Nine'])
+
+    def test_main_search(self):
+        """ --search lists the matches """
+
+        sys.argv = ['showview.py', '--showfile', self.showview.sourcefile,
+                    '--search', 'lost']
+        with patch('builtins.print') as mock_print:
+            main()
+        mock_print.assert_called_once_with(
+            'Lost                                      0 -  0')
+
+
+class TestSearchIndex(TestSearch):
+    """ test the saved search index of the xml storage """
+
+    def test_saved(self):
+        """ the index is saved and reused until the showfile changes """
+
+        self.names('office')
+        self.assertTrue(os.path.exists(self.showview.trigramsfile))
+        with patch('showview._TrigramIndex.add') as mock_add:
+            self.assertEqual(self.names('offce', ShowView(self.tmpxml,
+                                                          readonly=True)),
+                             ['Office Space', 'The Office (US)'])
+        mock_add.assert_not_called()
+
+        other = ShowView(self.tmpxml)
+        other.add_show(name='Space 1999')
+        other.set_show(name='Lost', new_name='Found')
+        other.write_shows()
+        with patch('showview._TrigramIndex.add') as mock_add:
+            showview = ShowView(self.tmpxml, readonly=True)
+            self.assertEqual(self.names('space', showview),
+                             ['Space 1999', 'Office Space'])
+            self.assertEqual(self.names('lost', showview), [])
+            self.assertEqual(self.names('found', showview), ['Found'])
+        mock_add.assert_not_called()
+
+    def test_journal(self):
+        """ the index follows the journal """
+
+        showview = ShowView(self.tmpxml, journal=True)
+        self.names('lost', showview)
+        showview.add_show(name='Lost Girl')
+        showview.write_shows()
+        self.assertEqual(self.names('lost', ShowView(self.tmpxml,
+                                                     readonly=True)),
+                         ['Lost', 'Lost Girl'])
+
+
+JANUARY = 1705320000  # 2024-01-15 12:00 UTC
+FEBRUARY = 1707998400  # 2024-02-15 12:00 UTC
+
+
+class TestHistory(TestCaseWithTempDir):
+    """ test the watch history """
+
+    def watch(self, when, **values):
+        """ set values of test1 at the unix time when and write """
+
+        with patch('time.time', return_value=when):
+            self.showview.set_show(name='test1', **values)
+            self.showview.write_shows()
+
+    def reopen(self, **kwargs):
+        """ a new view of the showfile """
+        return open_showview(self.showview.sourcefile, **kwargs)
+
+    def test_events(self):
+        """ only changes of season or episode are events """
+
+        self.watch(JANUARY, episode=2)
+        self.watch(JANUARY + 60, episode=2)
+        self.watch(JANUARY + 120, season=2, episode=1)
+        self.assertEqual(self.reopen().watched_per_month(),
+                         {('test1', '2024-01'): 2})
+
+    def test_per_month(self):
+        """ forward events count per show and month, corrections don't """
+
+        self.watch(JANUARY, episode=2)
+        self.watch(JANUARY + 60, episode=3)
+        self.watch(JANUARY + 120, episode=2)
+        self.watch(FEBRUARY, episode=3)
+        self.watch(FEBRUARY + 60, episode=4)
+        self.assertEqual(self.reopen(readonly=True).watched_per_month(),
+                         {('test1', '2024-01'): 2, ('test1', '2024-02'): 2})
+
+    def test_episodes(self):
+        """ an event counts the episodes it moved forward """
+
+        self.watch(JANUARY, episode=2)
+        self.watch(JANUARY + 60, episode=10)
+        self.watch(JANUARY + 120, episode=4)
+        self.watch(FEBRUARY, season=2, episode=3)
+        self.watch(FEBRUARY + 60, season=1, episode=1)
+        self.watch(FEBRUARY + 120, season=2, episode=5)
+        self.assertEqual(self.reopen().watched_per_month(),
+                         {('test1', '2024-01'): 9, ('test1', '2024-02'): 8})
+
+    def test_rename(self):
+        """ the events stay with a renamed show """
+
+        self.watch(JANUARY, episode=2)
+        self.watch(FEBRUARY, new_name='zzz', episode=3)
+        self.assertEqual(self.reopen().watched_per_month(),
+                         {('zzz', '2024-01'): 1, ('zzz', '2024-02'): 1})
+
+    def test_untouched(self):
+        """ shows without an event in the last days """
+
+        self.watch(JANUARY, episode=2)
+        showview = self.reopen()
+        self.assertEqual([show['name'] for show in
+                          showview.untouched(30, now=JANUARY + 86400)],
+                         ['test2'])
+        self.assertEqual([show['name'] for show in
+                          showview.untouched(30, now=FEBRUARY + 86400)],
+                         ['test1', 'test2'])
+
+    def test_unwritten(self):
+        """ events are only recorded with the changes """
+
+        with self.showview.transaction():
+            self.showview.set_show(name='test1', episode=5)
+            self.showview.write_shows()
+            self.assertEqual(self.showview.watched_per_month(), {})
+        self.assertEqual(len(self.showview.watched_per_month()), 1)
+
+    def test_torn_event(self):
+        """ a torn last event is dropped before the next one """
+
+        self.watch(JANUARY, episode=2)
+        history = self.reopen()._histories()[0]
+        with open(history.historyfile, 'ab') as file:
+            file.write(b'torn')
+        self.assertEqual(len(history.columns()[0]), 1)
+        self.watch(FEBRUARY, episode=3)
+        self.assertEqual(os.path.getsize(history.historyfile),
+                         2 * HISTORY_RECORD.size)
+        self.assertEqual(self.reopen().watched_per_month(),
+                         {('test1', '2024-01'): 1, ('test1', '2024-02'): 1})
+
+    @patch('builtins.print')
+    def test_main(self, mock_print):
+        """ --per-month and --untouched print the queries """
+
+        self.watch(JANUARY, episode=2)
+        sys.argv = ['showview.py', '--showfile', self.showview.sourcefile,
+                    '--per-month']
+        main()
+        mock_print.assert_called_once_with(
+            '2024-01 test1                                      1')
+        sys.argv[-1:] = ['--untouched']
+        with patch('time.time', return_value=JANUARY):
+            main()
+        mock_print.assert_called_with(
+            'test2                                    10 - 10')
+
+    @patch('builtins.print')
+    def test_main_page(self, mock_print):
+        """ --per-month is paged and refuses the machine formats """
+
+        self.watch(JANUARY, episode=2)
+        self.watch(FEBRUARY, episode=3)
+        sys.argv = ['showview.py', '--showfile', self.showview.sourcefile,
+                    '--per-month', '--offset', '1']
+        main()
+        mock_print.assert_called_once_with(
+            '2024-02 test1                                      1')
+        mock_print.reset_mock()
+        sys.argv[-2:] = ['--limit', '0']
+        main()
+        mock_print.assert_not_called()
+        sys.argv[-2:] = ['--format', 'json']
+        main()
+        self.assertIn('--format json', str(mock_print.call_args[0][0]))
+
+    @skipUnless(importlib.util.find_spec('numpy'), 'needs numpy')
+    def test_numpy(self):
+        """ the numpy and the plain python queries agree """
+
+        for i in range(50):
+            self.watch(JANUARY + i * 86400, episode=i % 7, season=i // 20)
+        history = self.reopen()._histories()[0]
+        watched = history.watched_per_month()
+        last = history.last_watched()
+        with patch('showview._numpy', return_value=None):
+            self.assertEqual(history.watched_per_month(), watched)
+            self.assertEqual(history.last_watched(), last)
+
+
+class TestHistoryIndex(TestHistory):
+    """ test the watch history of the xml storage """
+
+    def test_disabled(self):
+        """ history=False records nothing """
+
+        showview = ShowView(self.tmpxml, history=False)
+        showview.set_show(name='test1', episode=5)
+        showview.write_shows()
+        self.assertFalse(os.path.exists(self.tmpxml + '.history'))
+        self.assertEqual(showview.watched_per_month(), {})
+
+    def test_journal(self):
+        """ replaying the journal doesn't record the events again """
+
+        showview = ShowView(self.tmpxml, journal=True)
+        with patch('time.time', return_value=JANUARY):
+            showview.set_show(name='test1', episode=5)
+            showview.write_shows()
+        showview = ShowView(self.tmpxml, journal=True)
+        showview.set_show(name='test2', season=10)
+        showview.write_shows()
+        showview.compact()
+        self.assertEqual(ShowView(self.tmpxml).watched_per_month(),
+                         {('test1', '2024-01'): 1})
 
 
 class TestMain(SimpleTestCase):
@@ -214,6 +1823,164 @@ class TestMain(SimpleTestCase):
             str(KeyError("No show found for name 'test_missing'")))
 
 
+class TestFormat(SimpleTestCase):
+    """ test the machine readable listings """
+
+    def setUp(self):
+        super().setUp()
+        sys.argv = ['showview.py', '--showfile', TESTXML]
+
+    def run_main(self, *argv):
+        """ the output of main() with argv """
+        sys.argv.extend(argv)
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            main()
+        return output.getvalue()
+
+    def test_json(self):
+        """ --format json prints one array """
+
+        self.assertEqual(json.loads(self.run_main('--format', 'json')),
+                         list(self.showview.get_shows()))
+
+    def test_jsonl(self):
+        """ --format jsonl prints a json object per line """
+
+        self.assertEqual(self.run_main('--format', 'jsonl'),
+                         ''.join(json.dumps(show) + '\n'
+                                 for show in self.showview.get_shows()))
+
+    def test_tsv(self):
+        """ --format tsv prints tab separated values """
+
+        self.assertEqual(self.run_main('--format', 'tsv'),
+                         'test1\t1\t1\ntest2\t10\t10\n')
+
+    def test_tsv_escape(self):
+        """ tabs, newlines and backslashes in names are escaped """
+
+        output = io.StringIO()
+        dump_shows(output, [{"name": "a\tb\nc\\", "season": 1,
+                             "episode": 2}], 'tsv')
+        self.assertEqual(output.getvalue(), 'a\\tb\\nc\\\\\t1\t2\n')
+
+    def test_empty(self):
+        """ an empty listing is an empty array """
+
+        self.assertEqual(self.run_main('--format', 'json', '--offset', '5'),
+                         '[]\n')
+
+    def test_page(self):
+        """ --offset and --limit pick a page of the listing """
+
+        self.assertEqual(self.run_main('--format', 'tsv', '--offset', '1',
+                                       '--limit', '1'),
+                         'test2\t10\t10\n')
+        sys.argv[3:] = ['-n', '--limit', '1']
+        self.assertEqual(self.run_main(), 'test1\n')
+
+    def test_names(self):
+        """ -n is listed in --format too """
+
+        self.assertEqual(self.run_main('-n', '--format', 'tsv', '--offset',
+                                       '1'),
+                         'test2\t10\t10\n')
+        sys.argv[3:] = ['-n', '--format', 'json']
+        self.assertEqual(json.loads(self.run_main()),
+                         list(self.showview.get_shows()))
+
+    def test_page_stops_early(self):
+        """ the shows after the page aren't read """
+
+        read = []
+
+        def get_shows(name=None):
+            for i in range(10):
+                read.append(i)
+                yield {"name": str(i), "season": 0, "episode": 0}
+
+        with patch.object(ShowView, 'get_shows', side_effect=get_shows):
+            self.run_main('--format', 'jsonl', '--limit', '2')
+        self.assertEqual(read, [0, 1])
+
+    @patch('sys.stderr')
+    def test_negative(self, mock_stderr):
+        """ a negative limit is refused """
+
+        with self.assertRaises(SystemExit):
+            self.run_main('--limit', '-1')
+
+
+class TestAggregate(TestCaseWithTempDir):
+    """ test summing up the showfiles of many users """
+
+    def setUp(self):
+        super().setUp()
+        self.userfiles = [self.tmpxml]
+        for user, shows in enumerate((
+                [Show('test1', 2, 1), Show('test3', 1, 1)],
+                [Show('test1', 1, 4), Show('test1', 5, 5)])):
+            path = os.path.join(self.tempfolder, 'user{}.xml'.format(user))
+            with open(path, 'wb') as file:
+                write_xml(file, shows)
+            self.userfiles.append(path)
+
+    def test_aggregate(self):
+        """ every file counts once per show, with its first season """
+
+        self.assertEqual(aggregate(self.userfiles, workers=1), {
+            "files": 3,
+            "tracked": {"test1": 3, "test2": 1, "test3": 1},
+            "seasons": {"test1": {1: 2, 2: 1}, "test2": {10: 1},
+                        "test3": {1: 1}}})
+
+    def test_workers(self):
+        """ the worker processes come to the same result """
+
+        self.assertEqual(aggregate(self.userfiles * 3, workers=2),
+                         aggregate(self.userfiles * 3, workers=1))
+
+    def test_storages(self):
+        """ sqlite and sharded showfiles are read as well """
+
+        migrate(self.tmpxml, os.path.join(self.tempfolder, 'test.db'))
+        migrate(self.tmpxml, os.path.join(self.tempfolder, 'shards') +
+                os.sep)
+        total = aggregate([self.tmpxml,
+                           os.path.join(self.tempfolder, 'test.db'),
+                           os.path.join(self.tempfolder, 'shards')],
+                          workers=1)
+        self.assertEqual(total['tracked'], {"test1": 3, "test2": 3})
+
+    @patch('builtins.print')
+    def test_main(self, mock_print):
+        """ --aggregate takes glob patterns and lists the most tracked """
+
+        sys.argv = ['showview.py', '--aggregate',
+                    os.path.join(self.tempfolder, 'user*.xml'), self.tmpxml,
+                    '--workers', '1', '--limit', '2']
+        main()
+        self.assertEqual(mock_print.mock_calls,
+                         [call('test1                                        '
+                               '3  1:2 2:1'),
+                          call('test2                                        '
+                               '1  10:1')])
+
+    @patch('builtins.print')
+    def test_main_json(self, mock_print):
+        """ --format json prints the whole aggregate """
+
+        sys.argv = ['showview.py', '--aggregate', *self.userfiles,
+                    '--workers', '1', '--format', 'json']
+        main()
+        total = json.loads(mock_print.mock_calls[0][1][0])
+        self.assertEqual(total['files'], 3)
+        self.assertEqual(total['shows'][0],
+                         {"name": "test1", "files": 3,
+                          "seasons": {"1": 2, "2": 1}})
+
+
 class TestMainWrite(TestCaseWithTempDir):
     """ test the main functions that change the xml file """
 
@@ -382,3 +2149,411 @@ class TestMainWrite(TestCaseWithTempDir):
         sys.argv.append('test_not_present')
         main()
         mock_print.assert_not_called()
+
+
+class ElementTreeTestCase(TestCase):
+    """
+    this test case parses with the stdlib ElementTree even if lxml is
+    installed, the tests of the xml parser fallback run with it by mixing
+    this in first
+    """
+
+    def setUp(self):
+        """ use the stdlib backend """
+        backend = patch('showview._etree', return_value=ET)
+        backend.start()
+        self.addCleanup(backend.stop)
+        super().setUp()
+
+
+@skipUnless(importlib.util.find_spec('lxml'), 'needs lxml')
+class LxmlTestCase(TestCase):
+    """
+    this test case parses with lxml, the tests of the xml parser fallback
+    run with it by mixing this in first
+    """
+
+    def setUp(self):
+        """ use the lxml backend """
+        from lxml import etree
+
+        backend = patch('showview._etree', return_value=etree)
+        backend.start()
+        self.addCleanup(backend.stop)
+        super().setUp()
+
+
+class TestSingleShowElementTree(ElementTreeTestCase, TestSingleShow):
+    """ test the single show functions with ElementTree """
+
+
+class TestAllShowsElementTree(ElementTreeTestCase, TestAllShows):
+    """ test all show functions with ElementTree """
+
+
+class TestInsertShowElementTree(ElementTreeTestCase, TestInsertShow):
+    """ test the insert function with ElementTree """
+
+
+class TestWriteElementTree(ElementTreeTestCase, TestWrite):
+    """ test the writing to a file with ElementTree """
+
+
+class TestScannerElementTree(ElementTreeTestCase, TestScanner):
+    """ test the parser fallback with ElementTree """
+
+
+class TestSingleShowLxml(LxmlTestCase, TestSingleShow):
+    """ test the single show functions with lxml """
+
+
+class TestAllShowsLxml(LxmlTestCase, TestAllShows):
+    """ test all show functions with lxml """
+
+
+class TestInsertShowLxml(LxmlTestCase, TestInsertShow):
+    """ test the insert function with lxml """
+
+
+class TestWriteLxml(LxmlTestCase, TestWrite):
+    """ test the writing to a file with lxml """
+
+
+class TestScannerLxml(LxmlTestCase, TestScanner):
+    """ test the parser fallback with lxml """
+
+
+class TestEtree(TestCase):
+    """ test picking the xml backend """
+
+    def test_fallback(self):
+        """ without lxml the stdlib ElementTree is used """
+
+        with patch.dict(sys.modules, {'lxml': None}):
+            self.assertIs(_etree(), ET)
+
+    @skipUnless(importlib.util.find_spec('lxml'), 'needs lxml')
+    def test_lxml(self):
+        """ lxml is preferred when it is installed """
+
+        from lxml import etree
+
+        self.assertIs(_etree(), etree)
+
+
+class SQLiteTestCase(TestCaseWithTempDir):
+    """
+    this test case migrates the xml file to a sqlite database in a
+    tempfolder, the tests of the xml storage run against it by mixing this
+    in first
+    """
+
+    def setUp(self):
+        """ migrate the xml to a database in a tempfolder """
+        super().setUp()
+        self.dbfile = os.path.join(self.tempfolder, 'show.db')
+        migrate(self.tmpxml, self.dbfile).close()
+        self.showview = SQLiteShowView(self.dbfile)
+
+    def tearDown(self):
+        """ close the database and clean up """
+        self.showview.close()
+        super().tearDown()
+
+
+class TestSingleShowSQLite(SQLiteTestCase, TestSingleShow):
+    """ tests the basic behaviors on sqlite """
+
+
+class TestAllShowsSQLite(SQLiteTestCase, TestAllShows):
+    """ tests the basic behaviors on sqlite """
+
+
+class TestChangeShowSQLite(SQLiteTestCase, TestChangeShow):
+    """ test the basic behavior to change a show on sqlite """
+
+
+class TestIndexSQLite(SQLiteTestCase, TestIndex):
+    """ test the name index on sqlite """
+
+
+class TestImportSQLite(SQLiteTestCase, TestImport):
+    """ test the bulk import and export on sqlite """
+
+    def test_journal(self):
+        """ sqlite has no journal of its own """
+
+
+class TestSearchSQLite(SQLiteTestCase, TestSearch):
+    """ test the search on sqlite """
+
+
+class TestMainSQLite(SQLiteTestCase, TestMain):
+    """ test the main function print statements on sqlite """
+
+    def setUp(self):
+        SQLiteTestCase.setUp(self)
+        sys.argv = ['showview.py', '--showfile', 'sqlite:' + self.dbfile]
+
+
+class TestMainWriteSQLite(SQLiteTestCase, TestMainWrite):
+    """ test the main functions that change the database """
+
+    def setUp(self):
+        SQLiteTestCase.setUp(self)
+        sys.argv = ['showview.py', '--showfile', self.dbfile]
+
+
+class TestSQLite(SQLiteTestCase):
+    """ test what is special about the sqlite storage """
+
+    def test_open_showview(self):
+        """ the storage is picked by the showfile """
+
+        self.assertIsInstance(open_showview(self.tmpxml), ShowView)
+        for showfile in (self.dbfile, 'sqlite:' + self.dbfile,
+                         'sqlite://' + self.dbfile):
+            showview = open_showview(showfile)
+            self.assertIsInstance(showview, SQLiteShowView)
+            self.assertEqual(showview.get_show('test2'),
+                             {"name": "test2", "season": 10, "episode": 10})
+            showview.close()
+
+    def test_transaction_rollback(self):
+        """ a failed transaction is rolled back """
+
+        with self.assertRaises(KeyError):
+            with self.showview.transaction():
+                self.showview.set_show(name='test1', episode=7)
+                self.showview.write_shows()
+                self.showview.get_show('NotExisting')
+        self.assertEqual(self.showview.get_show('test1'),
+                         {"name": "test1", "season": 1, "episode": 1})
+
+    def test_readonly(self):
+        """ readonly opens the database without write access """
+
+        readonly = SQLiteShowView(self.dbfile, readonly=True)
+        self.assertEqual(readonly.get_show('test2'),
+                         {"name": "test2", "season": 10, "episode": 10})
+        with self.assertRaises(sqlite3.OperationalError):
+            readonly._connection.execute('DELETE FROM Show')
+        readonly.close()
+        missing = os.path.join(self.tempfolder, 'missing.db')
+        with self.assertRaises(sqlite3.OperationalError):
+            SQLiteShowView(missing, readonly=True)
+        self.assertFalse(os.path.exists(missing))
+
+    def test_migrate_back(self):
+        """ xml -> sqlite -> xml keeps every show """
+
+        xmlfile = os.path.join(self.tempfolder, 'back.xml')
+        migrate(self.dbfile, xmlfile)
+        self.assertEqual(list(ShowView(xmlfile).get_shows()),
+                         list(ShowView(self.tmpxml).get_shows()))
+
+    def test_migrate_not_empty(self):
+        """ don't migrate into a showfile that already has shows """
+
+        with self.assertRaises(FileExistsError):
+            migrate(self.tmpxml, self.dbfile)
+
+    def test_migrate_duplicates(self):
+        """ every show of a name is migrated """
+
+        self.showview.add_show(name='test1', season=2)
+        self.showview.write_shows()
+        for destination in ('m.db', 'm.xml', 'm' + os.sep):
+            destination = os.path.join(self.tempfolder, destination)
+            self.assertEqual(list(migrate(self.dbfile,
+                                          destination).get_shows()),
+                             list(self.showview.get_shows()))
+
+    def test_migrate_failed(self):
+        """ a failed migration leaves no new showfile behind """
+
+        destination = os.path.join(self.tempfolder, 'm.db')
+        sys.argv = ['showview.py', '--showfile',
+                    os.path.join(self.tempfolder, 'missing.xml'),
+                    '--migrate', destination]
+        with patch('sys.stderr', io.StringIO()) as stderr, \
+                self.assertRaises(SystemExit):
+            main()
+        self.assertIn('missing.xml', stderr.getvalue())
+        self.assertFalse(os.path.exists(destination))
+        with patch.object(SQLiteShowView, '_import',
+                          side_effect=ValueError('broken')), \
+                self.assertRaises(ValueError):
+            migrate(self.tmpxml, destination)
+        self.assertEqual([file for file in os.listdir(self.tempfolder)
+                          if file.startswith('m.db')], [])
+
+
+class ShardedTestCase(TestCaseWithTempDir):
+    """
+    this test case migrates the xml file to a sharded showfile with one
+    show per shard, the tests of the xml storage run against it by mixing
+    this in first
+    """
+
+    def setUp(self):
+        """ shard the xml in a tempfolder """
+        super().setUp()
+        self.sharddir = os.path.join(self.tempfolder, 'shows')
+        migrate(self.tmpxml, self.sharddir + os.sep).rebalance(1)
+        self.showview = ShardedShowView(self.sharddir)
+
+
+class TestSingleShowSharded(ShardedTestCase, TestSingleShow):
+    """ tests the basic behaviors on shards """
+
+
+class TestAllShowsSharded(ShardedTestCase, TestAllShows):
+    """ tests the basic behaviors on shards """
+
+
+class TestChangeShowSharded(ShardedTestCase, TestChangeShow):
+    """ test the basic behavior to change a show on shards """
+
+
+class TestIndexSharded(ShardedTestCase, TestIndex):
+    """ test the name index on shards """
+
+
+class TestImportSharded(ShardedTestCase, TestImport):
+    """ test the bulk import and export on shards """
+
+    def test_journal(self):
+        """ the imported shows survive in the journals of the shards """
+
+        showview = ShardedShowView(self.sharddir, journal=True)
+        showview.import_shows(self.shows, duplicates='replace')
+        self.assertEqual(list(ShardedShowView(self.sharddir).get_shows()),
+                         list(showview.get_shows()))
+
+
+class TestSearchSharded(ShardedTestCase, TestSearch):
+    """ test the search across shards """
+
+
+class TestHistorySharded(ShardedTestCase, TestHistory):
+    """ test the watch history across shards """
+
+    def test_move(self):
+        """ the events follow a show into another shard """
+
+        self.watch(JANUARY, episode=2)
+        self.watch(FEBRUARY, new_name='zzz', episode=3)
+        self.assertEqual(self.showview._owner('zzz'), 1)
+        self.assertEqual(self.reopen().watched_per_month(),
+                         {('zzz', '2024-01'): 1, ('zzz', '2024-02'): 1})
+
+
+class TestMainWriteSharded(ShardedTestCase, TestMainWrite):
+    """ test the main functions that change the shards """
+
+    def setUp(self):
+        ShardedTestCase.setUp(self)
+        sys.argv = ['showview.py', '--showfile', self.sharddir]
+
+
+class TestSharded(ShardedTestCase):
+    """ test what is special about the sharded storage """
+
+    def shard(self, name):
+        """ the path of the shard that owns name """
+        return os.path.join(
+            self.sharddir,
+            self.showview._files[self.showview._owner(name)])
+
+    def test_layout(self):
+        """ one shard per show after the migration """
+
+        self.assertEqual(self.showview._starts, ['', 'test2'])
+        self.assertEqual(list(ShowView(self.shard('test1')).get_shows()),
+                         [{"name": "test1", "season": 1, "episode": 1}])
+        self.assertEqual(list(ShowView(self.shard('test2')).get_shows()),
+                         [{"name": "test2", "season": 10, "episode": 10}])
+        self.assertIsInstance(open_showview(self.sharddir), ShardedShowView)
+
+    def test_only_owning_shard(self):
+        """ a lookup and a change only load the shard owning the show """
+
+        before = os.stat(self.shard('test1')).st_mtime_ns
+        with patch('showview.ShowView', wraps=ShowView) as mock_view:
+            self.showview.set_show(name='test2', episode=11)
+            self.showview.write_shows()
+            self.assertEqual(self.showview.get_show('test2')['episode'], 11)
+        self.assertEqual([args[0] for args, _ in mock_view.call_args_list],
+                         [self.shard('test2')])
+        self.assertEqual(os.stat(self.shard('test1')).st_mtime_ns, before)
+
+    def test_move(self):
+        """ a new name owned by another shard moves the show there """
+
+        self.showview.set_show(name='test1', new_name='x', episode=5)
+        self.showview.write_shows()
+        self.assertEqual(list(ShowView(self.shard('x')).get_shows()),
+                         [{"name": "test2", "season": 10, "episode": 10},
+                          {"name": "x", "season": 1, "episode": 5}])
+        self.assertEqual(list(ShowView(self.shard('test1')).get_shows()), [])
+
+    def test_move_journal(self):
+        """ a move survives in the journals """
+
+        showview = ShardedShowView(self.sharddir, journal=True)
+        showview.set_show(name='test2', new_name='a')
+        showview.write_shows()
+        self.assertEqual([show['name'] for show in
+                          ShardedShowView(self.sharddir).get_shows()],
+                         ['a', 'test1'])
+
+    def test_rebalance(self):
+        """ big shards are split, shows with the same name stay together """
+
+        showview = ShardedShowView(self.sharddir)
+        for name in ('test3', 'test3', 'test4', 'test5'):
+            showview.add_show(name=name)
+        showview.write_shows()
+        self.assertEqual(showview.rebalance(2), 3)
+        self.assertEqual(showview._starts, ['', 'test2', 'test4'])
+        self.assertEqual([show['name'] for show in
+                          ShardedShowView(self.sharddir).get_shows('test')],
+                         ['test1', 'test2', 'test3', 'test3', 'test4',
+                          'test5'])
+
+    def test_refresh(self):
+        """ a rebalance of another process is picked up """
+
+        self.showview.set_show(name='test1', episode=5)
+        other = ShardedShowView(self.sharddir)
+        for name in ('test3', 'test4'):
+            other.add_show(name=name)
+        other.write_shows()
+        other.rebalance(1)
+
+        self.assertEqual(self.showview.refresh(),
+                         {"added": [], "removed": [], "changed": []})
+        self.assertEqual(len(self.showview._starts), 4)
+        self.assertEqual([show['name'] for show in self.showview.get_shows()],
+                         ['test1', 'test2', 'test3', 'test4'])
+        self.showview.write_shows()
+        self.assertEqual(ShardedShowView(self.sharddir).get_show('test1'),
+                         {"name": "test1", "season": 1, "episode": 5})
+
+    def test_crashed_rebalance(self):
+        """ shows the manifest moved to another shard are not read twice """
+
+        with open(self.shard('test1'), 'wb') as file:
+            write_xml(file, [Show('test1', 1, 1), Show('test2', 0, 0)])
+        self.assertEqual([show['name'] for show in self.showview.get_shows()],
+                         ['test1', 'test2'])
+
+    @patch('builtins.print')
+    def test_main_rebalance(self, mock_print):
+        """ --rebalance splits the shards """
+
+        sys.argv = ['showview.py', '--showfile', self.sharddir,
+                    '--rebalance']
+        main()
+        mock_print.assert_called_with('2 shards')